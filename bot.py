@@ -1,23 +1,526 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 import sqlite3
 import datetime
 import calendar
-from zoneinfo import ZoneInfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import asyncio
-from dateutil.relativedelta import relativedelta
 import urllib.parse
-import functools # Ajout pour asyncio.to_thread
+import functools
+import hashlib
+import hmac
+import secrets
+import json
+import csv
+import io
+import gzip
+import tempfile
+import argparse
+import os
+import socket
+import threading
+import queue
+import concurrent.futures
+import heapq
+import time
+import bisect
+import contextvars
+import logging
+import random
+import aiohttp
+from aiohttp import web
 
 # ====================================================================
 # 1. CONFIGURATION ET INITIALISATION
 # ====================================================================
 BOT_TOKEN = "YOUR_BOT_TOKEN_HERE" 
-FRENCH_TZ = ZoneInfo("Europe/Paris") 
+DEFAULT_TZ = ZoneInfo("Europe/Paris") # Fuseau des serveurs sans réglage (voir /parametres_serveur)
+DEFAULT_DURATION_HOURS = 2.0 # Durée par défaut des serveurs sans réglage
+SHARD_COUNT = None # None = nombre de shards recommandé par Discord
+RUN_MODE = "all" # "all" (un seul processus), "gateway" ou "worker" : voir l'option --mode
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+class TrainingBot(commands.AutoShardedBot):
+    """Bot du club : prépare les caches avant la connexion et ferme proprement le stockage."""
+    async def setup_hook(self):
+        instrument_http_client(self.http)
+        install_outbound_queue(self.http) # Par-dessus la mesure : l'attente en file n'est pas comptée comme durée REST
+        if RUN_MODE != "worker": # Le worker n'a ni passerelle, ni boutons, ni assistant
+            await warm_start()
+            await wizard_manager.restore()
+        if RUN_MODE == "gateway":
+            await ipc_hub.start()
+        if RUN_MODE != "worker":
+            await load_feed_secret()
+            await season_importer.restore() # Reprend les imports interrompus (publication en tâche de fond)
+        await start_http_server()
+
+    async def close(self):
+        await super().close()
+        await ipc_hub.close()
+        await stop_http_server()
+        await attendance_writer.close() # Valide les RSVP en attente avant de fermer la BDD
+        storage.close()
+
+bot = TrainingBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT)
+
+# ====================================================================
+# 1 bis. MÉTRIQUES D'EXÉCUTION (OBSERVABILITÉ)
+# ====================================================================
+HTTP_HOST = "127.0.0.1" # Serveur HTTP local (métriques Prometheus) : jamais exposé publiquement
+HTTP_PORT = 9108 # None pour désactiver le serveur HTTP
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRIC_HELP = {
+    "handler_seconds": ("histogram", "Durée des commandes slash et des boutons."),
+    "handler_errors_total": ("counter", "Erreurs non gérées par handler."),
+    "interaction_defer_seconds": ("histogram", "Délai entre la création de l'interaction et son defer."),
+    "db_seconds": ("histogram", "Durée des fonctions BDD (attente de la file comprise)."),
+    "discord_rest_seconds": ("histogram", "Durée des appels REST Discord par route."),
+    "discord_rest_429_total": ("counter", "Réponses 429 (rate limit) reçues par route."),
+    "scheduler_lag_seconds": ("histogram", "Retard entre l'échéance d'une action et son démarrage."),
+    "scheduler_action_seconds": ("histogram", "Durée des actions planifiées (rappels, nettoyage)."),
+    "dm_delivery_total": ("counter", "MPs de rappel par résultat."),
+    "outbound_wait_seconds": ("histogram", "Attente des appels REST dans la file sortante, par priorité."),
+    "outbound_retries_total": ("counter", "Nouveaux essais d'appels REST (429 échappé, réseau si idempotent)."),
+    "outbound_superseded_total": ("counter", "Appels REST retirés de la file car remplacés."),
+    "startup_phase_seconds": ("histogram", "Durée des étapes du démarrage (sync des commandes, préchargement)."),
+    "reminder_catchup_total": ("counter", "Rappels manqués (bot hors ligne) par action et décision de rattrapage."),
+    "import_rows_total": ("counter", "Séances d'imports de saison publiées ou en échec."),
+    "ics_requests_total": ("counter", "Requêtes des flux iCalendar par type de flux et résultat (304, cache, rendu)."),
+    "thread_member_ops_total": ("counter", "Ajouts/retraits de membres des fils, par résultat (skipped = déjà dans l'état voulu)."),
+    "capacity_claims_total": ("counter", "RSVP « Je viens » sur les événements à places limitées (ok, waitlisted, promoted)."),
+}
+
+class Histogram:
+    """Histogramme à seaux fixes (observation en O(log seaux))."""
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        """Estimation par la borne haute du seau contenant le quantile."""
+        if not self.count: return 0.0
+        rank, cumulative = fraction * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return self.bounds[-1]
+
+class Metrics:
+    """Registre de métriques en mémoire : compteurs, histogrammes et jauges calculées à la demande."""
+    def __init__(self):
+        self.counters = {} # (nom, labels) -> valeur
+        self.histograms = {} # (nom, labels) -> Histogram
+        self.gauges = {} # nom -> (aide, fonction sans argument)
+        self.started_at = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, help_text, fn):
+        """Enregistre une jauge évaluée seulement au moment de l'export (zéro coût sur le chemin chaud)."""
+        self.gauges[name] = (help_text, fn)
+
+    def series(self, name):
+        """Histogrammes d'une métrique : [(labels dict, Histogram)]."""
+        return [(dict(labels), h) for (n, labels), h in self.histograms.items() if n == name]
+
+    def counter_total(self, name):
+        return sum(value for (n, _), value in self.counters.items() if n == name)
+
+    def render_prometheus(self):
+        """Export au format texte Prometheus."""
+        lines = []
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs: return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+        names = sorted({n for n, _ in self.counters} | {n for n, _ in self.histograms})
+        for name in names:
+            kind, help_text = METRIC_HELP.get(name, ("untyped", name))
+            lines.append(f"# HELP training_{name} {help_text}")
+            lines.append(f"# TYPE training_{name} {kind}")
+            for (n, labels), value in sorted(self.counters.items()):
+                if n == name: lines.append(f"training_{name}{fmt_labels(labels)} {value}")
+            for (n, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if n != name: continue
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"training_{name}_bucket{fmt_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"training_{name}_sum{fmt_labels(labels)} {histogram.total}")
+                lines.append(f"training_{name}_count{fmt_labels(labels)} {histogram.count}")
+        for name, (help_text, fn) in sorted(self.gauges.items()):
+            try: value = fn()
+            except Exception: continue
+            lines.append(f"# HELP training_{name} {help_text}")
+            lines.append(f"# TYPE training_{name} gauge")
+            lines.append(f"training_{name} {value}")
+        lines.append(f"training_uptime_seconds {time.time() - self.started_at:.0f}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def instrumented(handler_name):
+    """Décorateur : mesure la durée d'une commande slash ou d'un bouton (à placer sous les décorateurs discord).
+
+    Les appels REST du handler passent en tête de la file sortante (priorité interaction).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with outbound_context(PRIORITY_INTERACTION):
+                    return await func(*args, **kwargs)
+            except Exception:
+                metrics.inc("handler_errors_total", handler=handler_name)
+                raise
+            finally:
+                metrics.observe("handler_seconds", time.perf_counter() - started, handler=handler_name)
+        return wrapper
+    return decorator
+
+async def defer_interaction(interaction: discord.Interaction, **kwargs):
+    """Defer d'une interaction, en mesurant le délai depuis sa création côté Discord."""
+    await interaction.response.defer(**kwargs)
+    delay = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    metrics.observe("interaction_defer_seconds", max(0.0, delay))
+
+# Route REST en cours dans la tâche courante (lue par le handler de logs pour attribuer les 429)
+_current_rest_route = contextvars.ContextVar("current_rest_route", default="inconnue")
+
+class RateLimitLogHandler(logging.Handler):
+    """Compte les 429 signalés par discord.py (il les absorbe et réessaie lui-même)."""
+    def emit(self, record):
+        if "responded with 429" in str(record.msg):
+            metrics.inc("discord_rest_429_total", route=_current_rest_route.get())
+
+def instrument_http_client(http):
+    """Enveloppe HTTPClient.request pour mesurer chaque appel REST par route (gabarit, sans IDs)."""
+    if getattr(http, "_training_instrumented", False):
+        return
+    original_request = http.request
+    async def request(route, **kwargs):
+        label = f"{route.method} {route.path}"
+        token = _current_rest_route.set(label)
+        started = time.perf_counter()
+        try:
+            return await original_request(route, **kwargs)
+        finally:
+            metrics.observe("discord_rest_seconds", time.perf_counter() - started, route=label)
+            _current_rest_route.reset(token)
+    http.request = request
+    http._training_instrumented = True
+    logging.getLogger("discord.http").addHandler(RateLimitLogHandler(level=logging.WARNING))
+
+_http_runner = None
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+def build_http_app():
+    """Application HTTP locale (les autres points de terminaison s'y ajoutent)."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    if RUN_MODE != "worker": # Les flux sont servis par le processus qui reçoit les RSVP
+        app.router.add_get("/ics/{kind}/{key}/{token:[0-9a-f]+}.ics", handle_ics)
+    return app
+
+async def start_http_server():
+    global _http_runner
+    if HTTP_PORT is None or _http_runner is not None:
+        return
+    runner = web.AppRunner(build_http_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, HTTP_HOST, HTTP_PORT).start()
+    except OSError as e:
+        print(f"Serveur HTTP local : impossible d'écouter sur {HTTP_HOST}:{HTTP_PORT} ({e}).")
+        await runner.cleanup()
+        return
+    _http_runner = runner
+    print(f"Serveur HTTP local : métriques sur http://{HTTP_HOST}:{HTTP_PORT}/metrics")
+
+async def stop_http_server():
+    global _http_runner
+    if _http_runner is not None:
+        await _http_runner.cleanup()
+        _http_runner = None
+
+# ====================================================================
+# 1 ter. FILE SORTANTE DES APPELS DISCORD (PRIORITÉS)
+# ====================================================================
+# Tous les appels REST du bot passent par HTTPClient.request, enveloppé ici : la file les
+# libère par priorité, dans la limite d'un budget par bucket (route + salon) et d'un budget
+# global. Les réponses aux interactions passent par le webhook d'interaction (hors de cette
+# file) : elles ne sont jamais retardées par un nettoyage ou une vague de MPs.
+PRIORITY_INTERACTION = 0 # Réponses liées à un clic (éditions d'interaction)
+PRIORITY_ROSTER = 1 # Liste des participant·e·s, accès aux fils
+PRIORITY_REMINDER = 2 # Rappels, publications, commandes admin (défaut)
+PRIORITY_DM = 3 # MPs de rappel
+PRIORITY_CLEANUP = 4 # Nettoyage (suppressions de messages et de fils)
+PRIORITY_IMPORT = 5 # Publications d'un import de saison (après tout le reste)
+OUTBOUND_CONCURRENCY = 6 # Appels REST simultanés max
+OUTBOUND_GLOBAL_RATE = 40.0 # Appels/s tous buckets confondus (limite globale Discord : 50/s)
+OUTBOUND_DEFAULT_BUDGET = (5.0, 5) # (débit/s, rafale) par bucket non listé ci-dessous
+OUTBOUND_BUCKET_BUDGETS = {
+    "POST /channels/{channel_id}/messages": (1.0, 5),
+    "PATCH /channels/{channel_id}/messages/{message_id}": (1.0, 5),
+    "DELETE /channels/{channel_id}/messages/{message_id}": (1.0, 5),
+    "POST /channels/{channel_id}/messages/bulk-delete": (1.0, 1),
+    "PUT /channels/{channel_id}/thread-members/{user_id}": (1.0, 10),
+    "DELETE /channels/{channel_id}/thread-members/{user_id}": (1.0, 10),
+    "POST /users/@me/channels": (10.0, 10),
+}
+OUTBOUND_MAX_ATTEMPTS = 4 # Essais max d'un appel (429 échappé, ou erreur réseau d'un appel idempotent)
+OUTBOUND_IDEMPOTENT_METHODS = ("GET", "PUT", "PATCH", "DELETE") # Un POST coupé a pu être reçu : jamais renvoyé
+OUTBOUND_BACKOFF_BASE = 0.5 # Attente avant le 2e essai (s), doublée ensuite (+ gigue)
+
+class RateBudget:
+    """Seau à jetons asynchrone : au plus `rate` acquisitions par seconde, rafale de `burst`."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Secondes avant qu'un jeton soit disponible (0.0 : tout de suite)."""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        """Consomme un jeton (à n'appeler que si `delay()` vaut 0)."""
+        self._tokens -= 1
+
+    async def acquire(self):
+        async with self._lock: # Les demandeurs sont servis dans l'ordre d'arrivée
+            while (delay := self.delay()) > 0:
+                await asyncio.sleep(delay)
+            self.take()
+
+class OutboundSuperseded(Exception):
+    """Appel retiré de la file avant envoi : une version plus récente l'a remplacé."""
+
+_outbound_priority = contextvars.ContextVar("outbound_priority", default=PRIORITY_REMINDER)
+_outbound_key = contextvars.ContextVar("outbound_key", default=None)
+
+class outbound_context:
+    """`with outbound_context(PRIORITY_DM):` -> priorité (et clé de remplacement) des appels du bloc."""
+    def __init__(self, priority, key=None):
+        self.priority = priority
+        self.key = key
+
+    def __enter__(self):
+        self._tokens = (_outbound_priority.set(self.priority), _outbound_key.set(self.key))
+
+    def __exit__(self, *exc):
+        _outbound_priority.reset(self._tokens[0])
+        _outbound_key.reset(self._tokens[1])
+
+class _OutboundRequest:
+    __slots__ = ("priority", "seq", "bucket", "call", "key", "future", "attempt", "not_before", "queued_at")
+
+    def __init__(self, priority, seq, bucket, call, key, future):
+        self.priority = priority
+        self.seq = seq
+        self.bucket = bucket
+        self.call = call
+        self.key = key
+        self.future = future
+        self.attempt = 1
+        self.not_before = 0.0
+        self.queued_at = time.monotonic()
+
+class OutboundScheduler:
+    """File de priorité des appels REST sortants.
+
+    Une tâche répartitrice libère l'appel le plus prioritaire (puis le plus ancien) dont le
+    bucket et le budget global ont un jeton, dans la limite de `concurrency` appels en vol.
+    Un bucket épuisé ne bloque pas les autres. Les 429 échappés à discord.py (tous verbes) et les
+    erreurs réseau des appels idempotents sont réessayés avec un délai exponentiel ; les 5xx
+    restent gérés par les essais de discord.py. Un appel soumis avec une clé
+    remplace l'appel de même clé encore en file (qui lève OutboundSuperseded).
+    """
+    def __init__(self, concurrency=OUTBOUND_CONCURRENCY, global_rate=OUTBOUND_GLOBAL_RATE):
+        self.concurrency = concurrency
+        self.global_rate = global_rate
+        self._heap = [] # (priorité, ordre d'arrivée, n° d'insertion, requête)
+        self._seq = 0
+        self._pushes = 0 # Départage une requête et celle qu'elle remplace (même ordre d'arrivée)
+        self._budgets = {}
+        self._global_budget = None
+        self._pending_by_key = {}
+        self._released_slots = {} # clé -> (ordre, heure) de l'appel remplacé, repris par son remplaçant
+        self._in_flight = 0
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self):
+        return sum(1 for *_, request in self._heap if not request.future.done())
+
+    def _budget_for(self, bucket):
+        budget = self._budgets.get(bucket)
+        if budget is None:
+            rate, burst = OUTBOUND_BUCKET_BUDGETS.get(bucket[0], OUTBOUND_DEFAULT_BUDGET)
+            budget = self._budgets[bucket] = RateBudget(rate, burst)
+        return budget
+
+    def supersede(self, key):
+        """Retire de la file l'appel encore en attente pour `key` (s'il y en a un).
+
+        Son remplaçant (prochain appel soumis avec la même clé) reprend sa place dans la file :
+        des remplacements répétés ne le font pas reculer.
+        """
+        request = self._pending_by_key.pop(key, None)
+        if request and not request.future.done():
+            request.future.set_exception(OutboundSuperseded(key))
+            self._released_slots[key] = (request.seq, request.queued_at)
+            metrics.inc("outbound_superseded_total")
+
+    def forget(self, key):
+        """Abandonne l'appel en file pour `key` et la place qu'il aurait laissée."""
+        self.supersede(key)
+        self._released_slots.pop(key, None)
+
+    async def submit(self, call, bucket, priority=PRIORITY_REMINDER, key=None):
+        """Met `call()` (fabrique de coroutine) en file et retourne son résultat."""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._global_budget = RateBudget(self.global_rate)
+            self._task = asyncio.create_task(self._dispatch())
+        slot = None
+        if key is not None:
+            self.supersede(key)
+            slot = self._released_slots.pop(key, None)
+        if slot is None:
+            self._seq += 1
+            slot = (self._seq, time.monotonic())
+        request = _OutboundRequest(priority, slot[0], bucket, call, key, asyncio.get_running_loop().create_future())
+        request.queued_at = slot[1]
+        if key is not None:
+            self._pending_by_key[key] = request
+        self._push(request)
+        return await request.future
+
+    def _push(self, request):
+        self._pushes += 1
+        heapq.heappush(self._heap, (request.priority, request.seq, self._pushes, request))
+        self._wakeup.set()
+
+    def _pick(self):
+        """Requête libérable la plus prioritaire, sinon délai avant la prochaine (ou None)."""
+        if self._in_flight >= self.concurrency:
+            return None, None
+        global_delay = self._global_budget.delay()
+        if global_delay > 0:
+            return None, global_delay
+        now = time.monotonic()
+        blocked, chosen, next_delay = [], None, None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            request = entry[-1]
+            if request.future.done():
+                continue # Remplacée ou abandonnée par l'appelant
+            budget = self._budget_for(request.bucket)
+            delay = max(request.not_before - now, budget.delay())
+            if delay > 0:
+                blocked.append(entry)
+                next_delay = delay if next_delay is None else min(next_delay, delay)
+                continue
+            budget.take()
+            self._global_budget.take()
+            chosen = request
+            break
+        for entry in blocked:
+            heapq.heappush(self._heap, entry)
+        return chosen, next_delay
+
+    async def _dispatch(self):
+        while True:
+            request, delay = self._pick()
+            if request is not None:
+                if self._pending_by_key.get(request.key) is request:
+                    del self._pending_by_key[request.key] # En vol : ne peut plus être remplacée
+                if request.attempt == 1:
+                    metrics.observe("outbound_wait_seconds", time.monotonic() - request.queued_at, priority=str(request.priority))
+                self._in_flight += 1
+                asyncio.create_task(self._execute(request))
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, request):
+        try:
+            result = await request.call()
+        except (discord.Forbidden, discord.NotFound) as e:
+            if not request.future.done(): request.future.set_exception(e)
+        except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = getattr(e, "status", None)
+            idempotent = request.bucket[0].split(" ", 1)[0] in OUTBOUND_IDEMPOTENT_METHODS # route.key = "VERBE /chemin"
+            retryable = status == 429 or (status is None and idempotent)
+            if retryable and request.attempt < OUTBOUND_MAX_ATTEMPTS and not request.future.done():
+                delay = OUTBOUND_BACKOFF_BASE * 2 ** (request.attempt - 1) * random.uniform(1.0, 1.5)
+                request.attempt += 1
+                request.not_before = time.monotonic() + delay
+                metrics.inc("outbound_retries_total", route=request.bucket[0])
+                self._push(request)
+            elif not request.future.done():
+                request.future.set_exception(e)
+        except Exception as e:
+            if not request.future.done(): request.future.set_exception(e)
+        else:
+            if not request.future.done(): request.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._wakeup.set()
+
+outbound = OutboundScheduler()
+
+def install_outbound_queue(http):
+    """Fait passer chaque HTTPClient.request par la file sortante (priorité lue dans le contexte)."""
+    if getattr(http, "_training_outbound", False):
+        return
+    inner_request = http.request
+    async def request(route, **kwargs):
+        bucket = (route.key, route.major_parameters)
+        return await outbound.submit(lambda: inner_request(route, **kwargs), bucket,
+                                     _outbound_priority.get(), _outbound_key.get())
+    http.request = request
+    http._training_outbound = True
 
 # ====================================================================
 # 2. CONFIGURATION BDD ET FONCTIONS UTILITAIRES
@@ -25,23 +528,242 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 
 DB_NAME = "club_attendance.db"
 DB_TIMEOUT = 10.0 # Timeout pour éviter les "database is locked"
+DB_READERS = 3 # Taille du pool de connexions en lecture
+# Pragmas appliqués à chaque connexion persistante (WAL : les lecteurs ne bloquent plus l'écrivain)
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # En WAL, fsync seulement aux checkpoints (carte SD du Pi)
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",    # ~8 Mo de cache par connexion
+    "PRAGMA mmap_size=67108864",  # 64 Mo de lecture mappée
+)
+
+class Storage:
+    """Moteur SQLite persistant.
+
+    Les connexions restent ouvertes en mode WAL. Toutes les écritures passent par un seul
+    thread écrivain (file FIFO, une transaction par opération) et les lectures par un petit
+    pool de threads lecteurs, chacun avec sa propre connexion.
+    Les fonctions passées à `read`/`write` reçoivent la connexion en premier argument.
+    """
+    def __init__(self, db_name, readers=DB_READERS):
+        self.db_name = db_name
+        self.readers = readers
+        self._write_queue = queue.SimpleQueue()
+        self._writer = None
+        self._reader_pool = None
+        self._local = threading.local()
+        self._reader_conns = []
+        self._conns_lock = threading.Lock()
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(self.db_name, timeout=DB_TIMEOUT, check_same_thread=False)
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        if read_only:
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def start(self):
+        """Démarre le thread écrivain et le pool de lecteurs (idempotent)."""
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self._writer.start()
+        self._reader_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader")
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            fn, args, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with conn: # Transaction : COMMIT si succès, ROLLBACK sinon
+                    result = fn(conn, *args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        try: conn.execute("PRAGMA optimize")
+        except sqlite3.Error: pass
+        conn.close()
+
+    def _run_read(self, fn, args):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._reader_conns.append(conn)
+        return fn(conn, *args)
+
+    def submit_write(self, fn, *args):
+        """Met une écriture en file pour le thread écrivain (retourne un concurrent.futures.Future)."""
+        if self._writer is None:
+            raise RuntimeError("Storage non démarré")
+        future = concurrent.futures.Future()
+        self._write_queue.put((fn, args, future))
+        return future
+
+    async def write(self, fn, *args):
+        """Exécute `fn(conn, *args)` dans le thread écrivain, dans une transaction."""
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self.submit_write(fn, *args))
+        finally:
+            metrics.observe("db_seconds", time.perf_counter() - started, helper=fn.__name__, mode="write")
+
+    async def read(self, fn, *args):
+        """Exécute `fn(conn, *args)` sur une connexion du pool de lecteurs."""
+        if self._reader_pool is None:
+            raise RuntimeError("Storage non démarré")
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self._reader_pool.submit(self._run_read, fn, args))
+        finally:
+            metrics.observe("db_seconds", time.perf_counter() - started, helper=fn.__name__, mode="read")
+
+    def close(self):
+        """Vide la file d'écriture puis ferme toutes les connexions."""
+        if self._writer is None:
+            return
+        self._write_queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._reader_pool.shutdown(wait=True)
+        self._reader_pool = None
+        with self._conns_lock:
+            for conn in self._reader_conns:
+                conn.close()
+            self._reader_conns.clear()
+        print("Stockage : connexions BDD fermées.")
 
 # MODIFIÉ : init_db est maintenant synchrone et appelée une seule fois au démarrage.
 def init_db():
     """Initialise la base de données (exécutée de manière synchrone au démarrage)."""
     conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL") # Persistant dans le fichier de la BDD
     cursor = conn.cursor()
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS events (
         message_id INTEGER PRIMARY KEY, thread_id INTEGER, channel_id INTEGER, 
         event_date TEXT, event_time TEXT, details TEXT,
         is_recurrent INTEGER DEFAULT 0, 
-        target_group TEXT, reminder_3d_sent INTEGER DEFAULT 0, 
-        reminder_24h_sent INTEGER DEFAULT 0, keep_thread INTEGER DEFAULT 0,
+        target_group TEXT, keep_thread INTEGER DEFAULT 0,
         recurrence_type TEXT DEFAULT 'none', is_cancelled INTEGER DEFAULT 0,
-        reminder_dm_sent INTEGER DEFAULT 0,
-        duration_hours REAL DEFAULT 2.0  -- AJOUT : Durée de l'événement
+        duration_hours REAL DEFAULT 2.0,  -- AJOUT : Durée de l'événement
+        start_utc INTEGER, end_utc INTEGER,  -- AJOUT : Début/fin en epoch UTC (précalculés)
+        series_id INTEGER,  -- AJOUT : Série récurrente d'origine (NULL si ponctuel)
+        guild_id INTEGER,  -- AJOUT : Serveur (fuseau, durée par défaut, partition de l'ordonnanceur)
+        capacity INTEGER  -- AJOUT : Places (NULL = illimité ; au-delà, liste d'attente)
+    )''')
+    # AJOUT : Séries récurrentes (règle + modèle des occurrences)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS series (
+        series_id INTEGER PRIMARY KEY AUTOINCREMENT, channel_id INTEGER,
+        rule TEXT, anchor_date TEXT, event_time TEXT, details TEXT, target_group TEXT,
+        keep_thread INTEGER DEFAULT 0, duration_hours REAL DEFAULT 2.0,
+        last_occurrence TEXT,  -- Dernière occurrence créée (AAAA-MM-JJTHH:MM:SS, heure locale du serveur)
+        is_active INTEGER DEFAULT 1, guild_id INTEGER
+    )''')
+    # AJOUT : Réglages par serveur (remplacent le fuseau et la durée globaux)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS guild_settings (
+        guild_id INTEGER PRIMARY KEY, timezone TEXT, default_duration REAL
+    )''')
+    # AJOUT : Messages publiés par le bot dans le salon, par événement (suppression ciblée au nettoyage)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bot_messages (
+        message_id INTEGER PRIMARY KEY, event_id INTEGER, channel_id INTEGER,
+        kind TEXT  -- 'event', 'ping', 'reminder'...
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bot_messages_event ON bot_messages(event_id)")
+    # AJOUT : Étape en cours des assistants /creer_wizard (reprise après redémarrage)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS wizard_sessions (
+        user_id INTEGER PRIMARY KEY, dm_channel_id INTEGER, target_channel_id INTEGER,
+        step INTEGER, answers TEXT, updated_utc INTEGER
     )''')
+    # AJOUT : Journal des rappels manqués pendant un arrêt du bot et de leur rattrapage
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS reminder_catchups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, message_id INTEGER, action TEXT,
+        decision TEXT,  -- 'sent', 'collapsed' (remplacé par un rappel plus récent), 'skipped'
+        missed_due_utc INTEGER, handled_utc INTEGER
+    )''')
+    # AJOUT : Rappels (une ligne par événement et par règle) et règles par salon / par événement
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, message_id INTEGER, rule_key TEXT,
+        target TEXT, audience TEXT,  -- channel / thread / dm ; coming / maybe / coming_maybe / target_group
+        due_at INTEGER, window_end INTEGER,  -- Fenêtre d'envoi [due_at, window_end) en epoch UTC
+        sent_at INTEGER, outcome TEXT,  -- NULL tant que non traité ; 'sent', 'collapsed', 'skipped'
+        UNIQUE(message_id, rule_key)
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders(due_at) WHERE sent_at IS NULL")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS reminder_rules (
+        scope TEXT, scope_id INTEGER, rules TEXT,  -- scope : 'channel' ou 'event'
+        PRIMARY KEY (scope, scope_id)
+    )''')
+    # AJOUT : Archives des événements terminés / supprimés et agrégats mis à jour à l'archivage
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS events_archive (
+        message_id INTEGER PRIMARY KEY, guild_id INTEGER, channel_id INTEGER, series_id INTEGER,
+        event_date TEXT, event_time TEXT, details TEXT, duration_hours REAL,
+        start_utc INTEGER, end_utc INTEGER, is_cancelled INTEGER,
+        archive_reason TEXT, archived_utc INTEGER  -- 'cleanup' ou 'deleted'
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_archive_series ON events_archive(series_id, start_utc)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_archive_start ON events_archive(start_utc)") # Export chronologique
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS attendance_archive (
+        message_id INTEGER, user_id INTEGER, user_name TEXT, status TEXT,
+        PRIMARY KEY (message_id, user_id)
+    )''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_archive_user ON attendance_archive(user_id)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS member_stats (
+        guild_id INTEGER, user_id INTEGER, user_name TEXT,
+        responses INTEGER DEFAULT 0, coming INTEGER DEFAULT 0, maybe INTEGER DEFAULT 0, not_coming INTEGER DEFAULT 0,
+        current_streak INTEGER DEFAULT 0, best_streak INTEGER DEFAULT 0, last_event_utc INTEGER,
+        PRIMARY KEY (guild_id, user_id)
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS series_stats (
+        series_id INTEGER PRIMARY KEY, guild_id INTEGER,
+        events INTEGER DEFAULT 0, responses INTEGER DEFAULT 0,
+        coming INTEGER DEFAULT 0, maybe INTEGER DEFAULT 0, not_coming INTEGER DEFAULT 0,
+        best_turnout INTEGER DEFAULT 0, last_event_utc INTEGER
+    )''')
+    # AJOUT : Imports de saison (lignes validées, puis publiées une à une ; reprise après un arrêt)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER, user_id INTEGER, file_name TEXT,
+        total INTEGER, status TEXT DEFAULT 'running', created_utc INTEGER, finished_utc INTEGER
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_rows (
+        job_id INTEGER, row_no INTEGER, channel_id INTEGER, event_date TEXT, event_time TEXT, details TEXT,
+        target_group TEXT, keep_thread INTEGER, duration_hours REAL,
+        state TEXT DEFAULT 'pending', -- pending / posting / posted / failed
+        message_id INTEGER, error TEXT, updated_utc INTEGER,
+        PRIMARY KEY (job_id, row_no)
+    )''')
+    # AJOUT : Exécution des actions planifiées, réservée par une seule instance (jamais deux envois)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS action_claims (
+        message_id INTEGER, action TEXT, holder TEXT, claimed_utc INTEGER,
+        PRIMARY KEY (message_id, action)
+    )''')
+    # AJOUT : Baux d'élection du worker leader (mode --mode worker)
+    cursor.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT, expires_utc REAL)")
+    # AJOUT : Valeurs techniques persistantes (ex: empreinte de l'arbre de commandes synchronisé)
+    cursor.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS attendance (
         id INTEGER PRIMARY KEY AUTOINCREMENT, message_id INTEGER, user_id INTEGER,
@@ -57,95 +779,543 @@ def init_db():
     if 'is_cancelled' not in all_columns:
         print("Migration BDD : Ajout 'is_cancelled'")
         cursor.execute("ALTER TABLE events ADD COLUMN is_cancelled INTEGER DEFAULT 0")
-    if 'reminder_dm_sent' not in all_columns:
-        print("Migration BDD : Ajout 'reminder_dm_sent'")
-        cursor.execute("ALTER TABLE events ADD COLUMN reminder_dm_sent INTEGER DEFAULT 0")
     # AJOUT : Migration pour la durée
     if 'duration_hours' not in all_columns:
         print("Migration BDD : Ajout 'duration_hours'")
         cursor.execute("ALTER TABLE events ADD COLUMN duration_hours REAL DEFAULT 2.0")
+    # AJOUT : Migration des horaires précalculés en UTC (+ remplissage des lignes existantes)
+    if 'start_utc' not in all_columns:
+        print("Migration BDD : Ajout 'start_utc' / 'end_utc'")
+        cursor.execute("ALTER TABLE events ADD COLUMN start_utc INTEGER")
+        cursor.execute("ALTER TABLE events ADD COLUMN end_utc INTEGER")
+    to_backfill = cursor.execute("SELECT message_id, event_date, event_time, duration_hours FROM events WHERE start_utc IS NULL OR end_utc IS NULL").fetchall()
+    for message_id, event_date, event_time, duration_hours in to_backfill:
+        start_ts, end_ts = compute_event_times(event_date, event_time, duration_hours)
+        if start_ts is None:
+            print(f"Migration BDD : Date illisible pour l'événement {message_id}, horaires UTC non remplis.")
+            continue
+        cursor.execute("UPDATE events SET start_utc = ?, end_utc = ? WHERE message_id = ?", (start_ts, end_ts, message_id))
+    if to_backfill:
+        print(f"Migration BDD : {len(to_backfill)} événement(s) avec horaires UTC recalculés.")
+    # AJOUT : Rattachement des événements récurrents existants à une série (règle équivalente)
+    if 'series_id' not in all_columns:
+        print("Migration BDD : Ajout 'series_id'")
+        cursor.execute("ALTER TABLE events ADD COLUMN series_id INTEGER")
+    legacy_recurrent = cursor.execute('''
+        SELECT message_id, channel_id, event_date, event_time, details, target_group, keep_thread,
+               duration_hours, recurrence_type
+        FROM events WHERE series_id IS NULL AND recurrence_type IN ('weekly', 'monthly')
+    ''').fetchall()
+    for message_id, channel_id, event_date, event_time, details, target_group, keep_thread, duration_hours, recurrence_type in legacy_recurrent:
+        cursor.execute('''
+        INSERT INTO series (channel_id, rule, anchor_date, event_time, details, target_group,
+                            keep_thread, duration_hours, last_occurrence)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (channel_id, f"FREQ={recurrence_type.upper()}", event_date, event_time, details, target_group,
+              keep_thread, duration_hours, f"{event_date}T{event_time}"))
+        cursor.execute("UPDATE events SET series_id = ? WHERE message_id = ?", (cursor.lastrowid, message_id))
+    if legacy_recurrent:
+        print(f"Migration BDD : {len(legacy_recurrent)} événement(s) récurrent(s) rattaché(s) à une série.")
+    # AJOUT : Serveur des événements et séries (rempli au premier on_ready pour les lignes existantes)
+    if 'guild_id' not in all_columns:
+        print("Migration BDD : Ajout 'guild_id'")
+        cursor.execute("ALTER TABLE events ADD COLUMN guild_id INTEGER")
+    if 'capacity' not in all_columns:
+        print("Migration BDD : Ajout 'capacity'")
+        cursor.execute("ALTER TABLE events ADD COLUMN capacity INTEGER")
+    if 'guild_id' not in [col[1] for col in cursor.execute("PRAGMA table_info(series)").fetchall()]:
+        cursor.execute("ALTER TABLE series ADD COLUMN guild_id INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_guild_start ON events(guild_id, start_utc)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_series_guild ON series(guild_id, is_active)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_series ON events(series_id, start_utc)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_start ON events(start_utc)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_cancelled_start ON events(is_cancelled, start_utc)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_channel_start ON events(channel_id, start_utc)") # Flux iCalendar
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_user ON attendance(user_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_event_status ON attendance(message_id, status, id)") # Places / liste d'attente
+    # AJOUT : Anciennes colonnes reminder_*_sent -> table `reminders` (colonnes laissées en place, plus lues)
+    if 'reminder_3d_sent' in all_columns and _db_get_meta_sync(conn, "reminders_migrated") is None:
+        guild_settings.load(_db_get_guild_settings_sync(conn)) # Fuseaux des rappels J-3
+        dm_flag = "reminder_dm_sent" if 'reminder_dm_sent' in all_columns else "0" # Colonne ajoutée plus tard
+        legacy_flags = cursor.execute(
+            f"SELECT message_id, reminder_3d_sent, reminder_24h_sent, {dm_flag} FROM events").fetchall()
+        migrated_ts = int(time.time())
+        for message_id, *flags in legacy_flags:
+            _db_materialize_reminders_sync(conn, message_id, now_ts=0) # Fenêtres passées comprises : rattrapage
+            sent_keys = [key for key, flag in zip(LEGACY_REMINDER_KEYS, flags) if flag]
+            conn.executemany("UPDATE reminders SET sent_at = ?, outcome = 'sent' WHERE message_id = ? AND rule_key = ?",
+                             [(migrated_ts, message_id, key) for key in sent_keys])
+        _db_set_meta_sync(conn, "reminders_migrated", str(migrated_ts))
+        print(f"Migration BDD : Rappels de {len(legacy_flags)} événement(s) déplacés vers la table 'reminders'.")
         
     conn.commit()
     conn.close()
 
-# MODIFIÉ : log_attendance est divisée en une partie synchrone et un wrapper async
-def _log_attendance_sync(message_id, user_id, user_name, status):
-    """Partie synchrone de l'enregistrement de la présence."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
-    cursor = conn.cursor()
-    cursor.execute('''
+# MODIFIÉ : les parties synchrones reçoivent la connexion persistante du Storage
+def _db_flush_attendance_sync(conn, rows):
+    """Partie synchrone de la validation groupée : toutes les présences en une transaction.
+
+    Les événements sont relus sous le verrou d'écriture. Les RSVP d'un événement déjà archivé
+    (nettoyé par un autre processus) sont ignorés : ils recréeraient des présences orphelines.
+    Un RSVP mis en file alors que le cache ignorait encore la limite de l'événement passe
+    par la logique de places limitées.
+    Retourne ({message_id: places} de ces événements, [(message_id, user_id, user_name,
+    statut enregistré, promu·e·s)] de leurs RSVP).
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    message_ids = list({row[0] for row in rows})
+    events = dict(conn.execute(
+        f"SELECT message_id, capacity FROM events WHERE message_id IN ({', '.join('?' * len(message_ids))})",
+        message_ids).fetchall())
+    capped = {message_id: capacity for message_id, capacity in events.items() if capacity is not None}
+    conn.executemany('''
     REPLACE INTO attendance (message_id, user_id, user_name, status)
     VALUES (?, ?, ?, ?)
-    ''', (message_id, user_id, user_name, status))
-    conn.commit()
-    conn.close()
+    ''', [row for row in rows if row[0] in events and row[0] not in capped])
+    claimed = []
+    for message_id, user_id, user_name, status in rows:
+        if message_id in capped:
+            recorded, promoted = _db_claim_in_transaction_sync(conn, message_id, user_id, user_name, status, capped[message_id])
+            claimed.append((message_id, user_id, user_name, recorded, promoted))
+    return capped, claimed
+
+ATTENDANCE_FLUSH_INTERVAL = 0.05 # Délai max (s) avant validation des RSVP en attente
+ATTENDANCE_FLUSH_MAX_ITEMS = 200 # Validation immédiate au-delà de ce nombre de RSVP en attente
+
+class AttendanceWriteBehind:
+    """File d'écriture différée des RSVP avec validation groupée (group commit).
+
+    Seul le dernier statut par (message_id, user_id) est conservé ; les écritures en
+    attente sont validées en une seule transaction toutes les `interval` secondes ou dès
+    `max_items` éléments. `pending_for` sert de surcouche en mémoire pour les lectures.
+    """
+    def __init__(self, interval=ATTENDANCE_FLUSH_INTERVAL, max_items=ATTENDANCE_FLUSH_MAX_ITEMS):
+        self.interval = interval
+        self.max_items = max_items
+        self._pending = {} # (message_id, user_id) -> (user_name, status), dans l'ordre des clics
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+
+    def submit(self, message_id, user_id, user_name, status):
+        key = (message_id, user_id)
+        self._pending.pop(key, None) # Le dernier clic passe en fin de file (ordre des réponses)
+        self._pending[key] = (user_name, status)
+        if len(self._pending) >= self.max_items:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def pending_for(self, message_id):
+        """RSVP pas encore validés d'un événement : [(user_id, user_name, status)]."""
+        return [(user_id, name, status) for (msg_id, user_id), (name, status) in self._pending.items() if msg_id == message_id]
+
+    def discard(self, message_id):
+        """Oublie les RSVP en attente d'un événement archivé par un autre processus."""
+        for key in [key for key in self._pending if key[0] == message_id]:
+            del self._pending[key]
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def _run(self):
+        while self._pending and not self._closing:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """Valide toutes les écritures en attente en une transaction."""
+        async with self._flush_lock:
+            self._full.clear()
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            rows = [(message_id, user_id, name, status) for (message_id, user_id), (name, status) in batch.items()]
+            try:
+                capped, claimed = await storage.write(_db_flush_attendance_sync, rows)
+            except Exception as e:
+                print(f"Erreur BDD (validation groupée de {len(rows)} RSVP) : {e}")
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value) # Sans écraser un clic plus récent
+                await asyncio.sleep(self.interval)
+                return
+            if claimed:
+                apply_late_claims(capped, claimed)
+
+    async def close(self):
+        """Valide ce qui reste en attente (arrêt du bot).
+
+        La tâche n'est pas annulée : une validation en cours (lot déjà retiré de `_pending`)
+        serait perdue. Elle est réveillée et attendue, puis le reste est validé.
+        """
+        self._closing = True
+        self._full.set()
+        if self._task and not self._task.done():
+            await self._task
+        await self.flush()
+        if self._pending:
+            print(f"ATTENTION : {len(self._pending)} RSVP n'ont pas pu être enregistrés avant l'arrêt.")
+
+attendance_writer = AttendanceWriteBehind()
 
 async def log_attendance(message_id, user_id, user_name, status):
-    """Wrapper Asynchrone : Enregistre la présence dans un thread séparé."""
-    await asyncio.to_thread(_log_attendance_sync, message_id, user_id, user_name, status)
+    """Enregistre la présence : index en mémoire immédiatement, BDD via la file d'écriture différée."""
+    index = await attendance_indexes.get(message_id) # Chargé une fois par événement
+    attendance_writer.submit(message_id, user_id, user_name, status)
+    index.apply(user_id, user_name, status)
+    feed_versions.touch_member(user_id)
 
-# MODIFIÉ : get_attendance_summary
-def _get_attendance_summary_sync(message_id):
-    """Partie synchrone de la récupération du résumé."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT user_name, status, user_id FROM attendance
-        WHERE message_id = ? GROUP BY user_id
-    """, (message_id,))
-    attendance_data = cursor.fetchall()
-    conn.close()
-    
-    coming = [(name, user_id) for name, status, user_id in attendance_data if status == "Coming"]
-    maybe = [(name, user_id) for name, status, user_id in attendance_data if status == "Maybe"]
-    not_coming = [(name, user_id) for name, status, user_id in attendance_data if status == "Not Coming"]
-    return {"coming": coming, "maybe": maybe, "not_coming": not_coming}
+# --- AJOUT : Places limitées et liste d'attente ---
+# Sur un événement à places limitées, le RSVP ne passe pas par la file d'écriture différée :
+# compter les places, inscrire ou mettre en attente, et promouvoir la liste d'attente se font
+# dans une seule transaction (BEGIN IMMEDIATE) du thread écrivain. Les clics simultanés sont
+# donc sérialisés en BDD et l'événement ne peut pas être surréservé.
+WAITLIST_STATUS = "Waitlist"
+
+def _db_promote_waitlist_sync(conn, message_id, capacity):
+    """Promeut la liste d'attente (premier arrivé, premier servi) tant qu'il reste des places.
+
+    Retourne [(user_id, user_name)] des membres promu·e·s. Doit être appelée dans la transaction en cours.
+    """
+    if capacity is None:
+        free = -1 # Illimité : toute la liste d'attente passe
+    else:
+        taken = conn.execute("SELECT COUNT(*) FROM attendance WHERE message_id = ? AND status = 'Coming'", (message_id,)).fetchone()[0]
+        free = capacity - taken
+        if free <= 0:
+            return []
+    promoted = conn.execute('''
+        SELECT user_id, user_name FROM attendance WHERE message_id = ? AND status = ? ORDER BY id LIMIT ?
+    ''', (message_id, WAITLIST_STATUS, free)).fetchall()
+    conn.executemany("REPLACE INTO attendance (message_id, user_id, user_name, status) VALUES (?, ?, ?, 'Coming')",
+                     [(message_id, user_id, user_name) for user_id, user_name in promoted])
+    return promoted
+
+def _db_claim_attendance_sync(conn, message_id, user_id, user_name, status):
+    """RSVP sur un événement à places limitées, en une transaction.
+
+    « Coming » prend une place s'il en reste, sinon met en liste d'attente (sans perdre son rang
+    si déjà en attente). Quitter « Coming » libère une place, aussitôt donnée au premier en attente.
+    Retourne (statut enregistré, [(user_id, user_name)] promu·e·s).
+    """
+    conn.execute("BEGIN IMMEDIATE") # Verrou d'écriture avant de compter (aussi entre processus)
+    row = conn.execute("SELECT capacity FROM events WHERE message_id = ?", (message_id,)).fetchone()
+    return _db_claim_in_transaction_sync(conn, message_id, user_id, user_name, status, row[0] if row else None)
+
+def _db_claim_in_transaction_sync(conn, message_id, user_id, user_name, status, capacity):
+    """Cœur de `_db_claim_attendance_sync`, dans une transaction BEGIN IMMEDIATE déjà ouverte."""
+    current = conn.execute("SELECT status FROM attendance WHERE message_id = ? AND user_id = ?", (message_id, user_id)).fetchone()
+    current = current[0] if current else None
+    if status == "Coming" and current in ("Coming", WAITLIST_STATUS):
+        conn.execute("UPDATE attendance SET user_name = ? WHERE message_id = ? AND user_id = ?", (user_name, message_id, user_id))
+        return current, [] # Place ou rang conservé
+    if status == "Coming" and capacity is not None:
+        taken = conn.execute("SELECT COUNT(*) FROM attendance WHERE message_id = ? AND status = 'Coming'", (message_id,)).fetchone()[0]
+        if taken >= capacity:
+            status = WAITLIST_STATUS
+    conn.execute("REPLACE INTO attendance (message_id, user_id, user_name, status) VALUES (?, ?, ?, ?)",
+                 (message_id, user_id, user_name, status))
+    promoted = _db_promote_waitlist_sync(conn, message_id, capacity) if current == "Coming" else []
+    return status, promoted
+
+def _db_set_capacity_sync(conn, message_id, capacity):
+    """Change les places d'un événement et promeut la liste d'attente si des places s'ouvrent.
+
+    Retourne None si l'événement est inconnu, sinon [(user_id, user_name)] promu·e·s.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    if conn.execute("UPDATE events SET capacity = ? WHERE message_id = ?", (capacity, message_id)).rowcount == 0:
+        return None
+    return _db_promote_waitlist_sync(conn, message_id, capacity)
+
+def apply_promotions(index, promoted):
+    """Reporte des promotions dans l'index en mémoire (fin de la liste des présent·e·s)."""
+    for user_id, user_name in promoted:
+        index.apply(user_id, user_name, "Coming")
+        feed_versions.touch_member(user_id)
+
+async def claim_attendance(message_id, user_id, user_name, status):
+    """RSVP d'un événement à places limitées : retourne (statut enregistré, promu·e·s)."""
+    index = await attendance_indexes.get(message_id)
+    status, promoted = await storage.write(_db_claim_attendance_sync, message_id, user_id, user_name, status)
+    index.apply(user_id, user_name, status)
+    apply_promotions(index, promoted)
+    feed_versions.touch_member(user_id)
+    metrics.inc("capacity_claims_total", outcome="waitlisted" if status == WAITLIST_STATUS else "ok")
+    if promoted:
+        metrics.inc("capacity_claims_total", len(promoted), outcome="promoted")
+    return status, promoted
+
+def apply_late_claims(capped, claimed):
+    """RSVP validés en différé sur un événement à places limitées (cache en retard sur /places).
+
+    Corrige le cache d'état et l'index en mémoire, puis prévient les membres promu·e·s.
+    """
+    for message_id, capacity in capped.items():
+        event_state_cache.set_capacity(message_id, capacity)
+    for message_id, user_id, user_name, status, promoted in claimed:
+        index = attendance_indexes.peek(message_id)
+        if index is not None:
+            index.apply(user_id, user_name, status)
+            apply_promotions(index, promoted)
+        metrics.inc("capacity_claims_total", outcome="waitlisted" if status == WAITLIST_STATUS else "ok")
+        if promoted:
+            metrics.inc("capacity_claims_total", len(promoted), outcome="promoted")
+            asyncio.create_task(notify_promoted(message_id, promoted))
+
+async def notify_promoted(message_id, promoted):
+    """Prévient par MP les membres promu·e·s de la liste d'attente (déjà dans le fil)."""
+    try:
+        event = await get_event(message_id)
+        if event is None:
+            return
+        tz = guild_settings.tz(event["guild_id"])
+        embed = discord.Embed(title="🎉 Une place s'est libérée !",
+                              description=f"Vous êtes inscrit·e à l'entraînement du **{event['event_date']}** à **{event['event_time']}** "
+                                          f"({tz_label(tz)}). Empêché·e ? Cliquez sur ❌ pour libérer la place.",
+                              color=discord.Color.green())
+        embed.add_field(name="Détails", value=event["details"], inline=False)
+        with outbound_context(PRIORITY_DM):
+            stats = await fan_out_dms([(user_name, user_id) for user_id, user_name in promoted], embed=embed)
+        print(f"Liste d'attente (event {message_id}) : {len(promoted)} promu·e(s), MPs : {format_delivery_stats(stats)}.")
+    except Exception as e:
+        print(f"Erreur lors de la notification des promu·e·s (event {message_id}) : {e}")
+
+# MODIFIÉ : les résumés sont servis par un index en mémoire (plus de requête par clic)
+ATTENDANCE_STATUSES = {"Coming": "coming", "Maybe": "maybe", "Not Coming": "not_coming", "Waitlist": "waitlist"}
+
+def _get_attendance_rows_sync(conn, message_id):
+    """Partie synchrone du chargement des présences d'un événement (ordre des réponses)."""
+    return conn.execute("""
+        SELECT user_id, user_name, status FROM attendance
+        WHERE message_id = ? ORDER BY id
+    """, (message_id,)).fetchall()
+
+class AttendanceIndex:
+    """Présences d'un événement en mémoire : statut -> membres, dans l'ordre des réponses.
+
+    `apply` est en O(1) : le membre est retiré de son ancien statut et ajouté en fin du
+    nouveau, comme le fait le REPLACE INTO en BDD.
+    """
+    def __init__(self, rows=()):
+        self._status_of = {} # user_id -> statut
+        self._members = {status: {} for status in ATTENDANCE_STATUSES} # statut -> {user_id: nom}
+        for user_id, user_name, status in rows:
+            self.apply(user_id, user_name, status)
+
+    def apply(self, user_id, user_name, status):
+        old_status = self._status_of.get(user_id)
+        if old_status is not None:
+            self._members[old_status].pop(user_id, None)
+        self._members.setdefault(status, {})[user_id] = user_name
+        self._status_of[user_id] = status
+
+    def status_of(self, user_id):
+        return self._status_of.get(user_id)
+
+    def count(self, status):
+        return len(self._members.get(status, ()))
+
+    def members(self, status):
+        """Liste [(nom, user_id)] des membres ayant ce statut."""
+        return [(name, user_id) for user_id, name in self._members.get(status, {}).items()]
+
+    def summary(self):
+        return {key: self.members(status) for status, key in ATTENDANCE_STATUSES.items()}
+
+class AttendanceIndexRegistry:
+    """Index de présence par événement, chargés paresseusement depuis la table `attendance`."""
+    def __init__(self):
+        self._indexes = {}
+        self._loading = {} # message_id -> tâche de chargement en cours (partagée)
+
+    def peek(self, message_id):
+        return self._indexes.get(message_id)
+
+    async def get(self, message_id):
+        index = self._indexes.get(message_id)
+        if index is not None:
+            return index
+        loading = self._loading.get(message_id)
+        if loading is None:
+            loading = self._loading[message_id] = asyncio.ensure_future(self._load(message_id))
+        return await asyncio.shield(loading)
+
+    async def _load(self, message_id):
+        try:
+            rows = await storage.read(_get_attendance_rows_sync, message_id)
+            index = AttendanceIndex(rows)
+            for user_id, user_name, status in attendance_writer.pending_for(message_id):
+                index.apply(user_id, user_name, status) # Surcouche : RSVP pas encore validés
+            if message_id in self._loading: # Pas oublié pendant le chargement
+                self._indexes[message_id] = index
+            return index
+        finally:
+            self._loading.pop(message_id, None)
+
+    def discard(self, message_id):
+        self._indexes.pop(message_id, None)
+        self._loading.pop(message_id, None)
+
+    def preload(self, rows_by_event):
+        """Installe des index déjà lus en BDD (démarrage) : {message_id: [(user_id, nom, statut)]}."""
+        for message_id, rows in rows_by_event.items():
+            index = AttendanceIndex(rows)
+            for user_id, user_name, status in attendance_writer.pending_for(message_id):
+                index.apply(user_id, user_name, status)
+            self._indexes[message_id] = index
+
+    def __len__(self):
+        return len(self._indexes)
+
+attendance_indexes = AttendanceIndexRegistry()
 
 async def get_attendance_summary(message_id):
-    """Wrapper Asynchrone : Récupère le résumé des présences."""
-    return await asyncio.to_thread(_get_attendance_summary_sync, message_id)
+    """Récupère le résumé des présences depuis l'index en mémoire."""
+    if RUN_MODE == "worker": # Les RSVP arrivent dans le processus gateway : toujours relire la BDD
+        return AttendanceIndex(await storage.read(_get_attendance_rows_sync, message_id)).summary()
+    return (await attendance_indexes.get(message_id)).summary()
 
-# MODIFIÉ : get_event_state (utilise duration_hours)
-def _get_event_state_sync(message_id):
-    """Partie synchrone de la récupération de l'état (date/heure/durée)."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
-    cursor = conn.cursor()
-    # AJOUT : Sélectionne duration_hours
-    cursor.execute("SELECT event_date, event_time, is_cancelled, duration_hours FROM events WHERE message_id = ?", (message_id,))
-    row = cursor.fetchone()
-    conn.close()
-    if not row: return (None, False)
-    
-    date, time, is_cancelled, duration_hours = row
-    
+# --- AJOUT : Réglages par serveur (fuseau horaire, durée par défaut) ---
+def _db_get_guild_settings_sync(conn):
+    return conn.execute("SELECT guild_id, timezone, default_duration FROM guild_settings").fetchall()
+
+def _db_set_guild_settings_sync(conn, guild_id, timezone, default_duration):
+    conn.execute('''
+    INSERT INTO guild_settings (guild_id, timezone, default_duration) VALUES (?, ?, ?)
+    ON CONFLICT(guild_id) DO UPDATE SET timezone = COALESCE(excluded.timezone, timezone),
+                                        default_duration = COALESCE(excluded.default_duration, default_duration)
+    ''', (guild_id, timezone, default_duration))
+
+class GuildSettingsCache:
+    """Réglages des serveurs en mémoire (lus partout, y compris par le thread écrivain).
+
+    Un serveur sans réglage (ou un événement sans serveur connu) utilise DEFAULT_TZ et
+    DEFAULT_DURATION_HOURS.
+    """
+    def __init__(self):
+        self._settings = {} # guild_id -> (ZoneInfo, durée par défaut)
+
+    def load(self, rows):
+        self._settings = {}
+        for guild_id, timezone, default_duration in rows:
+            self.set(guild_id, timezone, default_duration)
+
+    def set(self, guild_id, timezone=None, default_duration=None):
+        current_tz, current_duration = self._settings.get(guild_id, (DEFAULT_TZ, DEFAULT_DURATION_HOURS))
+        try:
+            tz = ZoneInfo(timezone) if timezone else current_tz
+        except Exception:
+            print(f"Réglages : Fuseau '{timezone}' inconnu pour le serveur {guild_id}, {current_tz.key} conservé.")
+            tz = current_tz
+        self._settings[guild_id] = (tz, default_duration if default_duration else current_duration)
+
+    def tz(self, guild_id):
+        return self._settings.get(guild_id, (DEFAULT_TZ, None))[0]
+
+    def default_duration(self, guild_id):
+        return self._settings.get(guild_id, (None, DEFAULT_DURATION_HOURS))[1]
+
+guild_settings = GuildSettingsCache()
+
+def tz_label(tz):
+    """Libellé affiché après une heure (« Heure de Paris » pour le fuseau historique)."""
+    return "Heure de Paris" if tz.key == "Europe/Paris" else f"Heure {tz.key}"
+
+def channel_guild_id(channel):
+    """Serveur d'un salon (None pour un MP ou un salon inconnu)."""
+    guild = getattr(channel, "guild", None)
+    return guild.id if guild else None
+
+def compute_event_times(event_date, event_time, duration_hours, tz=DEFAULT_TZ):
+    """Calcule (début, fin) de l'événement en epoch UTC (entiers), ou (None, None) si la date est illisible."""
     # Assurer une durée par défaut si la BDD est NULL
     if duration_hours is None:
-        duration_hours = 2.0 
-        
+        duration_hours = DEFAULT_DURATION_HOURS
     try:
-        naive_dt = datetime.datetime.fromisoformat(f"{date}T{time}")
-        local_dt = naive_dt.replace(tzinfo=FRENCH_TZ)
-        event_start_utc = local_dt.astimezone(datetime.timezone.utc)
-        # MODIFIÉ : Utilise duration_hours au lieu de 2h fixes
-        event_end_utc = event_start_utc + datetime.timedelta(hours=duration_hours)
-        return (event_end_utc, bool(is_cancelled))
+        naive_dt = datetime.datetime.fromisoformat(f"{event_date}T{event_time}")
+        local_dt = naive_dt.replace(tzinfo=tz)
+        start_ts = int(local_dt.timestamp())
+        return (start_ts, start_ts + int(duration_hours * 3600))
     except Exception as e:
-        print(f"Erreur d'analyse BDD (get_event_state) : {e}")
-        return (None, False)
+        print(f"Erreur d'analyse BDD (date/heure {event_date} {event_time}) : {e}")
+        return (None, None)
+
+def compute_event_end_ts(event_date, event_time, duration_hours, tz=DEFAULT_TZ):
+    """Calcule la fin de l'événement en timestamp UTC (epoch), ou None si la date est illisible."""
+    return compute_event_times(event_date, event_time, duration_hours, tz)[1]
+
+class EventStateCache:
+    """Cache process de l'état des événements pour le chemin chaud des boutons RSVP.
+
+    message_id -> (fin de l'événement en epoch UTC, annulé, places ou None). Rempli au démarrage,
+    puis tenu à jour par la création, l'annulation, /places, la suppression et le nettoyage.
+    Chaque changement invalide aussi les flux iCalendar (`feed_versions`).
+    """
+    def __init__(self):
+        self._states = {}
+
+    def get(self, message_id):
+        return self._states.get(message_id)
+
+    def set(self, message_id, end_ts, is_cancelled=False, capacity=None):
+        state = (end_ts, bool(is_cancelled), capacity)
+        if self._states.get(message_id) != state:
+            self._states[message_id] = state
+            feed_versions.touch_events()
+
+    def mark_cancelled(self, message_id):
+        end_ts, _, capacity = self._states.get(message_id, (None, False, None))
+        self.set(message_id, end_ts, True, capacity)
+
+    def set_capacity(self, message_id, capacity):
+        if message_id in self._states:
+            end_ts, is_cancelled, _ = self._states[message_id]
+            self.set(message_id, end_ts, is_cancelled, capacity)
+
+    def discard(self, message_id):
+        if self._states.pop(message_id, None) is not None:
+            feed_versions.touch_events()
+
+    def load(self, rows):
+        """Remplace le contenu du cache à partir de lignes (message_id, fin en epoch UTC, annulé, places)."""
+        self._states = {message_id: (end_ts, bool(is_cancelled), capacity) for message_id, end_ts, is_cancelled, capacity in rows}
+        feed_versions.touch_events()
+
+    def __len__(self):
+        return len(self._states)
+
+event_state_cache = EventStateCache()
+
+# MODIFIÉ : get_event_state (utilise duration_hours)
+def _get_event_state_sync(conn, message_id):
+    """Partie synchrone de la récupération de l'état (fin précalculée en UTC)."""
+    return conn.execute("SELECT message_id, end_utc, is_cancelled, capacity FROM events WHERE message_id = ?", (message_id,)).fetchone()
 
 async def get_event_state(message_id):
-    """Wrapper Asynchrone : Récupère l'état de l'événement."""
-    return await asyncio.to_thread(_get_event_state_sync, message_id)
+    """Récupère (fin en epoch UTC, annulé, places) depuis le cache, ou depuis la BDD en cas d'absence."""
+    state = event_state_cache.get(message_id)
+    if state is not None:
+        return state
+    row = await storage.read(_get_event_state_sync, message_id)
+    if not row: return (None, False, None)
+    _, end_ts, is_cancelled, capacity = row
+    event_state_cache.set(message_id, end_ts, is_cancelled, capacity)
+    return event_state_cache.get(message_id)
 
 # MODIFIÉ : create_google_calendar_link (utilise duration_hours)
-def create_google_calendar_link(event_date, event_time, details, duration_hours):
+def create_google_calendar_link(event_date, event_time, details, duration_hours, tz=DEFAULT_TZ):
     """Crée un lien Google Calendar (fonction synchrone, pas d'accès BDD)."""
     try:
         if duration_hours is None:
-            duration_hours = 2.0
+            duration_hours = DEFAULT_DURATION_HOURS
             
         naive_dt = datetime.datetime.fromisoformat(f"{event_date}T{event_time}")
-        start_local = naive_dt.replace(tzinfo=FRENCH_TZ)
+        start_local = naive_dt.replace(tzinfo=tz)
         # MODIFIÉ : Utilise duration_hours
         end_local = start_local + datetime.timedelta(hours=duration_hours)
         
@@ -161,82 +1331,671 @@ def create_google_calendar_link(event_date, event_time, details, duration_hours)
         print(f"Erreur création lien Google Calendar : {e}")
         return None
 
+def _db_get_meta_sync(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _db_set_meta_sync(conn, key, value):
+    conn.execute("REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+# --- AJOUT : Règles de rappel (table `reminders` : une ligne par événement et par règle) ---
+DEFAULT_REMINDER_RULES = "J-3:salon:groupe, H-24:fil:participants, H-2:mp:participants" # Les trois rappels historiques
+LEGACY_REMINDER_KEYS = ("J-3:salon:groupe", "H-24:fil:participants", "H-2:mp:participants") # reminder_3d/24h/dm_sent
+REMINDER_MAX_RULES = 10
+REMINDER_WINDOW_SECONDS = 3600 # Un rappel H-n / M-n non envoyé dans l'heure est « manqué » (voir rattrapage)
+REMINDER_MAX_WINDOW_SECONDS = 86400 # Fenêtre la plus longue (rappels J-n)
+
+def local_day_start_ts(day: datetime.date, tz=DEFAULT_TZ) -> int:
+    """Minuit (heure locale du fuseau `tz`) du jour donné, en epoch UTC."""
+    return int(datetime.datetime.combine(day, datetime.time(0), tzinfo=tz).timestamp())
+
+class ReminderRule:
+    """Règle de rappel `<décalage>:<cible>:<public>`, ex: `J-3:salon:groupe`, `H-2:mp:participants`.
+
+    Décalage : J-n (minuit, heure locale, n jours avant le jour de l'événement), H-n ou M-n
+    (n heures / minutes avant le début). Cible : salon, fil ou mp. Public : participants
+    (présent·e·s et indécis·e·s), presents, indecis, ou groupe (groupe cible de l'événement).
+    """
+    UNITS = {"J": 86400, "H": 3600, "M": 60}
+    TARGETS = {"salon": "channel", "fil": "thread", "mp": "dm"}
+    AUDIENCES = {"participants": "coming_maybe", "presents": "coming", "indecis": "maybe", "groupe": "target_group"}
+
+    def __init__(self, unit, amount, target, audience):
+        self.unit, self.amount, self.target, self.audience = unit, amount, target, audience
+
+    @classmethod
+    def parse(cls, text):
+        """Lève ValueError (message en français) si la règle est invalide."""
+        parts = [part.strip().lower() for part in text.split(":")]
+        if len(parts) != 3:
+            raise ValueError(f"`{text.strip()}` : format attendu décalage:cible:public (ex: H-2:mp:participants)")
+        offset, target, audience = parts
+        unit, _, amount = offset.upper().partition("-")
+        if unit not in cls.UNITS or not amount.isdigit() or not 0 < int(amount) <= 366 * 86400 // cls.UNITS.get(unit, 1):
+            raise ValueError(f"`{offset}` : décalage attendu J-n, H-n ou M-n (ex: J-3, H-24, M-30)")
+        if target not in cls.TARGETS:
+            raise ValueError(f"`{target}` : cible attendue parmi {', '.join(cls.TARGETS)}")
+        if audience not in cls.AUDIENCES:
+            raise ValueError(f"`{audience}` : public attendu parmi {', '.join(cls.AUDIENCES)}")
+        if target == "mp" and audience == "groupe":
+            raise ValueError("un rappel en MP s'adresse aux participant·e·s, pas au groupe cible")
+        return cls(unit, int(amount), cls.TARGETS[target], cls.AUDIENCES[audience])
+
+    @classmethod
+    def parse_list(cls, text):
+        """`règle, règle, ...` (ou `aucun`) -> [ReminderRule] sans doublons."""
+        if text.strip().lower() in ("aucun", ""):
+            return []
+        rules = {}
+        for part in text.split(","):
+            rule = cls.parse(part)
+            rules.setdefault(str(rule), rule)
+        if len(rules) > REMINDER_MAX_RULES:
+            raise ValueError(f"{REMINDER_MAX_RULES} rappels au maximum")
+        return list(rules.values())
+
+    def __str__(self):
+        target = next(word for word, value in self.TARGETS.items() if value == self.target)
+        audience = next(word for word, value in self.AUDIENCES.items() if value == self.audience)
+        return f"{self.unit}-{self.amount}:{target}:{audience}"
+
+    def describe(self):
+        """Ex: « H-2 en MP aux participant·e·s »."""
+        target = {"channel": "dans le salon", "thread": "dans le fil", "dm": "en MP"}[self.target]
+        audience = {"coming_maybe": "aux participant·e·s", "coming": "aux présent·e·s", "maybe": "aux indécis·e·s",
+                    "target_group": "au groupe cible"}[self.audience]
+        return f"{self.unit}-{self.amount} {target} {audience}"
+
+    def label(self):
+        """Libellé court pour les messages : J-3, J-1 (pour H-24), H-2, 30 min."""
+        if self.unit == "M":
+            return f"{self.amount} min"
+        if self.unit == "H" and self.amount % 24:
+            return f"H-{self.amount}"
+        return f"J-{self.amount if self.unit == 'J' else self.amount // 24}"
+
+    def window(self, start_ts, event_date, tz):
+        """Fenêtre d'envoi (échéance, fin) en epoch UTC, jamais au-delà du début de l'événement."""
+        if self.unit == "J":
+            due = local_day_start_ts(datetime.date.fromisoformat(event_date) - datetime.timedelta(days=self.amount), tz)
+            return due, min(due + 86400, start_ts)
+        due = start_ts - self.amount * self.UNITS[self.unit]
+        return due, min(due + REMINDER_WINDOW_SECONDS, start_ts)
+
+def _db_get_reminder_rules_sync(conn, message_id, channel_id):
+    """Règles en vigueur : celles de l'événement, sinon celles du salon, sinon les règles par défaut."""
+    row = conn.execute('''
+        SELECT rules FROM reminder_rules
+        WHERE (scope = 'event' AND scope_id = ?) OR (scope = 'channel' AND scope_id = ?)
+        ORDER BY scope = 'event' DESC LIMIT 1
+    ''', (message_id, channel_id)).fetchone()
+    return ReminderRule.parse_list(row[0] if row else DEFAULT_REMINDER_RULES)
+
+def _db_materialize_reminders_sync(conn, message_id, now_ts=None):
+    """(Re)crée les rappels non envoyés d'un événement d'après les règles en vigueur.
+
+    Les rappels déjà traités sont conservés ; ceux dont la fenêtre est déjà refermée ne sont
+    pas créés (sauf `now_ts=0`, pour la migration).
+    """
+    conn.execute("DELETE FROM reminders WHERE message_id = ? AND sent_at IS NULL", (message_id,))
+    event = conn.execute("SELECT channel_id, event_date, target_group, start_utc, guild_id FROM events WHERE message_id = ?",
+                         (message_id,)).fetchone()
+    if event is None or event[3] is None:
+        return
+    channel_id, event_date, target_group, start_ts, guild_id = event
+    now_ts = time.time() if now_ts is None else now_ts
+    rows = []
+    for rule in _db_get_reminder_rules_sync(conn, message_id, channel_id):
+        if rule.audience == "target_group" and not target_group:
+            continue
+        due, window_end = rule.window(start_ts, event_date, guild_settings.tz(guild_id))
+        if window_end > now_ts:
+            rows.append((message_id, str(rule), rule.target, rule.audience, due, window_end))
+    conn.executemany('''
+        INSERT OR IGNORE INTO reminders (message_id, rule_key, target, audience, due_at, window_end)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', rows)
+
 # MODIFIÉ : Fonction BDD pour insérer un nouvel événement
-def _db_insert_event_sync(message_id, thread_id_to_save, channel_id, date, time, details, recurrence_type, target_group, garder_le_fil, duration_hours):
-    """Partie synchrone de l'insertion d'un nouvel événement."""
+def _db_insert_event_sync(conn, message_id, thread_id_to_save, channel_id, date, time, details, recurrence_type, target_group, garder_le_fil, duration_hours, series_id=None, tracked_messages=(), guild_id=None):
+    """Partie synchrone de l'insertion d'un nouvel événement (horaires dans le fuseau du serveur)."""
     is_recurrent_int = 1 if recurrence_type != 'none' else 0
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
-    cursor = conn.cursor()
-    cursor.execute('''
+    start_ts, end_ts = compute_event_times(date, time, duration_hours, guild_settings.tz(guild_id))
+    conn.execute('''
     INSERT INTO events (message_id, thread_id, channel_id, event_date, event_time, details, 
-                        is_recurrent, target_group, reminder_3d_sent, reminder_24h_sent, 
-                        keep_thread, recurrence_type, is_cancelled, duration_hours)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, 0, ?, ?, 0, ?)
+                        is_recurrent, target_group, 
+                        keep_thread, recurrence_type, is_cancelled, duration_hours,
+                        start_utc, end_utc, series_id, guild_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?)
     ''', (message_id, thread_id_to_save, channel_id, date, time, details, 
-          is_recurrent_int, target_group, int(garder_le_fil), recurrence_type, duration_hours))
-    conn.commit()
-    conn.close()
+          is_recurrent_int, target_group, int(garder_le_fil), recurrence_type, duration_hours,
+          start_ts, end_ts, series_id, guild_id))
+    _db_track_messages_sync(conn, message_id, channel_id, tracked_messages)
+    _db_materialize_reminders_sync(conn, message_id)
+
+async def insert_event(message_id, thread_id_to_save, channel_id, date, time, details, recurrence_type, target_group, garder_le_fil, duration_hours, series_id=None, tracked_messages=(), guild_id=None):
+    """Wrapper Asynchrone : Insère un nouvel événement via le thread écrivain."""
+    await storage.write(
+        _db_insert_event_sync,
+        message_id, thread_id_to_save, channel_id, date, time, details,
+        recurrence_type, target_group, garder_le_fil, duration_hours, series_id, tracked_messages, guild_id
+    )
+
+# --- AJOUT : Suivi des messages publiés par le bot ---
+def _db_track_messages_sync(conn, event_id, channel_id, messages):
+    """Enregistre des messages du bot [(message_id, kind)] rattachés à un événement."""
+    conn.executemany(
+        "INSERT OR REPLACE INTO bot_messages (message_id, event_id, channel_id, kind) VALUES (?, ?, ?, ?)",
+        [(message_id, event_id, channel_id, kind) for message_id, kind in messages]
+    )
+
+def _db_get_tracked_messages_sync(conn, event_id):
+    """IDs des messages du bot rattachés à un événement."""
+    return [row[0] for row in conn.execute("SELECT message_id FROM bot_messages WHERE event_id = ?", (event_id,))]
+
+async def track_bot_message(event_id, message, kind):
+    """Wrapper Asynchrone : Retient un message publié dans le salon pour le supprimer au nettoyage."""
+    await storage.write(_db_track_messages_sync, event_id, message.channel.id, [(message.id, kind)])
 
 # Appel synchrone de l'initialisation de la BDD au démarrage du script
 init_db()
+# Démarrage du moteur de stockage (connexions persistantes, thread écrivain, pool de lecteurs)
+storage = Storage(DB_NAME)
+storage.start()
 
 # ====================================================================
-# 3. LOGIQUE DES BOUTONS (VIEWS) -- TEXTE INCLUSIF
+# 2 bis. RÉCURRENCE (CALCUL DIRECT DES OCCURRENCES)
 # ====================================================================
-class TrainingView(discord.ui.View):
-    def __init__(self):
-        super().__init__(timeout=None)
-        
-    async def update_message(self, interaction: discord.Interaction):
-        # MODIFIÉ : Appel async BDD
-        summary = await get_attendance_summary(interaction.message.id)
-        
-        coming_list = "\n".join([f"• {name}" for name, user_id in summary["coming"]]) or "— Personne pour l'instant —"
-        maybe_list = "\n".join([f"• {name}" for name, user_id in summary["maybe"]]) or "— Personne pour l'instant —"
-        not_coming_list = "\n".join([f"• {name}" for name, user_id in summary["not_coming"]]) or "— Personne pour l'instant —"
-        
-        if not interaction.message or not interaction.message.embeds:
-            print("Impossible de mettre à jour le message (probablement supprimé).")
-            return
-            
-        original_embed = interaction.message.embeds[0]
-        new_embed = discord.Embed(title=original_embed.title, description=original_embed.description, color=original_embed.color)
-        
-        for field in original_embed.fields:
-            if (not field.name.startswith("✅ Présent·e·s") and not field.name.startswith("❓ Indécis·e·s") and not field.name.startswith("❌ Absent·e·s")):
-                    new_embed.add_field(name=field.name, value=field.value, inline=field.inline)
-                    
-        new_embed.add_field(name=f"✅ Présent·e·s ({len(summary['coming'])})", value=coming_list, inline=True)
-        new_embed.add_field(name=f"❓ Indécis·e·s ({len(summary['maybe'])})", value=maybe_list, inline=True)
-        new_embed.add_field(name=f"❌ Absent·e·s ({len(summary['not_coming'])})", value=not_coming_list, inline=True)
-        
-        try:
-            await interaction.message.edit(embed=new_embed, view=self)
-        except discord.NotFound:
-            print(f"Échec de l'édition du message {interaction.message.id} (n'existe plus).")
-        except Exception as e:
-            print(f"Erreur inconnue lors de l'édition du message : {e}")
+# Règles façon RRULE (RFC 5545), sous-ensemble utile au club :
+#   FREQ=WEEKLY|MONTHLY ; INTERVAL=n ; BYDAY=MO,WE (hebdo) ; BYMONTHDAY=n ou -1 (mensuel) ;
+#   UNTIL=AAAA-MM-JJ ; COUNT=n ; EXDATE=AAAA-MM-JJ,AAAA-MM-JJ
+# Les occurrences sont calculées directement depuis l'ancre (1re date de la série) : pas de
+# boucle de rattrapage après une longue coupure, et pas de dérive (le 31 reste le 31, borné
+# au dernier jour des mois courts). COUNT compte les occurrences de la règle, EXDATE compris.
+SERIES_HORIZON_DAYS = 0 # Fenêtre pré-créée automatiquement (0 = seulement la prochaine occurrence)
+SERIES_MAX_BATCH = 60 # Nombre max d'occurrences créées en un lot
+WEEKDAY_CODES = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+WEEKDAY_NAMES_FR = ("lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche")
 
-    async def invite_and_update(self, interaction: discord.Interaction, status: str, response_text: str):
-        await interaction.response.defer(ephemeral=True, thinking=True)
-        
-        # MODIFIÉ : Appel async BDD
-        await log_attendance(interaction.message.id, interaction.user.id, interaction.user.display_name, status)
-        
+def _parse_rule_date(value):
+    """Date d'une règle : AAAA-MM-JJ ou AAAAMMJJ (un éventuel 'T...' est ignoré)."""
+    value = value.strip().split("T")[0]
+    if len(value) == 8 and value.isdigit():
+        value = f"{value[:4]}-{value[4:6]}-{value[6:]}"
+    return datetime.date.fromisoformat(value)
+
+class RecurrenceRule:
+    """Règle de récurrence : calcule directement les occurrences postérieures à une date."""
+
+    def __init__(self, freq, interval=1, weekdays=None, month_day=None, until=None, count=None, exdates=()):
+        if freq not in ("weekly", "monthly"):
+            raise ValueError(f"Fréquence inconnue : {freq}")
+        if interval < 1 or (count is not None and count < 1):
+            raise ValueError("INTERVAL et COUNT doivent être positifs")
+        if month_day is not None and not (1 <= abs(month_day) <= 31):
+            raise ValueError("BYMONTHDAY doit être entre 1 et 31 (ou -1 à -31)")
+        self.freq = freq
+        self.interval = interval
+        self.weekdays = tuple(sorted(set(weekdays))) if weekdays else None
+        self.month_day = month_day
+        self.until = until
+        self.count = count
+        self.exdates = frozenset(exdates)
+
+    @classmethod
+    def parse(cls, text):
+        """Lit une règle `CLÉ=valeur;...` (préfixe 'RRULE:' accepté). Lève ValueError si invalide."""
+        text = text.strip()
+        if text.upper().startswith("RRULE:"):
+            text = text[6:]
+        parts = {}
+        for part in filter(None, (p.strip() for p in text.split(";"))):
+            key, sep, value = part.partition("=")
+            if not sep:
+                raise ValueError(f"Élément de règle invalide : {part}")
+            parts[key.strip().upper()] = value.strip()
+        freq = {"WEEKLY": "weekly", "MONTHLY": "monthly"}.get(parts.pop("FREQ", "").upper())
+        if freq is None:
+            raise ValueError("FREQ doit valoir WEEKLY ou MONTHLY")
+        kwargs = {}
+        if "INTERVAL" in parts: kwargs["interval"] = int(parts.pop("INTERVAL"))
+        if "COUNT" in parts: kwargs["count"] = int(parts.pop("COUNT"))
+        if "UNTIL" in parts: kwargs["until"] = _parse_rule_date(parts.pop("UNTIL"))
+        if "EXDATE" in parts: kwargs["exdates"] = [_parse_rule_date(d) for d in parts.pop("EXDATE").split(",") if d.strip()]
+        if "BYDAY" in parts:
+            if freq != "weekly":
+                raise ValueError("BYDAY n'est accepté qu'en FREQ=WEEKLY")
+            codes = [c.strip().upper() for c in parts.pop("BYDAY").split(",") if c.strip()]
+            unknown = [c for c in codes if c not in WEEKDAY_CODES]
+            if unknown:
+                raise ValueError(f"Jour(s) inconnu(s) : {', '.join(unknown)}")
+            kwargs["weekdays"] = [WEEKDAY_CODES.index(c) for c in codes]
+        if "BYMONTHDAY" in parts:
+            if freq != "monthly":
+                raise ValueError("BYMONTHDAY n'est accepté qu'en FREQ=MONTHLY")
+            kwargs["month_day"] = int(parts.pop("BYMONTHDAY"))
+        if parts:
+            raise ValueError(f"Élément(s) non pris en charge : {', '.join(parts)}")
+        return cls(freq, **kwargs)
+
+    @classmethod
+    def from_legacy(cls, recurrence_type):
+        """Règle équivalente à l'ancien `recurrence_type` ('weekly'/'monthly'), None si ponctuel."""
+        if recurrence_type in ("weekly", "monthly"):
+            return cls(recurrence_type)
+        return None
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq.upper()}"]
+        if self.interval != 1: parts.append(f"INTERVAL={self.interval}")
+        if self.weekdays: parts.append("BYDAY=" + ",".join(WEEKDAY_CODES[d] for d in self.weekdays))
+        if self.month_day is not None: parts.append(f"BYMONTHDAY={self.month_day}")
+        if self.until: parts.append(f"UNTIL={self.until.isoformat()}")
+        if self.count is not None: parts.append(f"COUNT={self.count}")
+        if self.exdates: parts.append("EXDATE=" + ",".join(d.isoformat() for d in sorted(self.exdates)))
+        return ";".join(parts)
+
+    def describe(self):
+        """Libellé court en français (affiché dans l'embed de l'événement)."""
+        if self.freq == "weekly":
+            text = "Hebdomadaire" if self.interval == 1 else f"Toutes les {self.interval} semaines"
+            if self.weekdays:
+                text += " (" + ", ".join(WEEKDAY_NAMES_FR[d] for d in self.weekdays) + ")"
+        else:
+            text = "Mensuel" if self.interval == 1 else f"Tous les {self.interval} mois"
+            if self.month_day == -1: text += " (dernier jour du mois)"
+            elif self.month_day is not None: text += f" (le {self.month_day})"
+        if self.until: text += f", jusqu'au {self.until.isoformat()}"
+        if self.count is not None: text += f", {self.count} séance(s)"
+        return text
+
+    def _candidates(self, anchor, start_date):
+        """(index, date) des occurrences de la règle à partir de `start_date`, dans l'ordre.
+
+        L'index (rang depuis l'ancre) est calculé directement : on saute d'emblée à la
+        période (semaine ou mois) qui contient `start_date`.
+        """
+        anchor_date = anchor.date()
+        if self.freq == "weekly":
+            days = self.weekdays or (anchor_date.weekday(),)
+            skipped = sum(1 for d in days if d < anchor_date.weekday()) # Jours de la 1re semaine avant l'ancre
+            week_zero = anchor_date - datetime.timedelta(days=anchor_date.weekday())
+            week = max(0, (start_date - week_zero).days // 7)
+            week += -week % self.interval # Première semaine active
+            while True:
+                monday = week_zero + datetime.timedelta(weeks=week)
+                for position, weekday in enumerate(days):
+                    day = monday + datetime.timedelta(days=weekday)
+                    if day >= anchor_date:
+                        yield (week // self.interval) * len(days) + position - skipped, day
+                week += self.interval
+        else:
+            day_of_month = self.month_day or anchor_date.day
+            month_zero = anchor_date.year * 12 + anchor_date.month - 1
+
+            def day_in(month):
+                year, month_index = divmod(month_zero + month, 12)
+                last_day = calendar.monthrange(year, month_index + 1)[1]
+                target = day_of_month if day_of_month > 0 else last_day + 1 + day_of_month
+                return datetime.date(year, month_index + 1, min(max(target, 1), last_day))
+
+            skipped = 1 if day_in(0) < anchor_date else 0 # Jour du 1er mois déjà passé à l'ancre
+            month = max(0, start_date.year * 12 + start_date.month - 1 - month_zero)
+            month += -month % self.interval
+            while True:
+                day = day_in(month)
+                if day >= anchor_date:
+                    yield month // self.interval - skipped, day
+                month += self.interval
+
+    def occurrences(self, anchor, after):
+        """Occurrences (datetime dans le fuseau de `anchor`) strictement postérieures à `after`.
+
+        `anchor` fixe la phase (semaine/mois de départ) et l'heure des séances. Le générateur
+        s'arrête à UNTIL / COUNT ; sans limite, il est infini (le consommateur borne).
+        """
+        tz = anchor.tzinfo
+        start_date = max(after.astimezone(tz).date(), anchor.date())
+        for index, day in self._candidates(anchor, start_date):
+            if self.count is not None and index >= self.count: return
+            if self.until and day > self.until: return
+            occurrence = datetime.datetime.combine(day, anchor.time()).replace(tzinfo=tz)
+            if occurrence <= after or day in self.exdates: continue
+            yield occurrence
+
+    def next_after(self, anchor, after):
+        """Prochaine occurrence après `after`, ou None si la série est terminée."""
+        return next(self.occurrences(anchor, after), None)
+
+# --- Stockage des séries ---
+SERIES_COLUMNS = '''
+    series_id, channel_id, rule, anchor_date, event_time, details, target_group,
+    keep_thread, duration_hours, last_occurrence, is_active, guild_id
+'''
+
+def _db_insert_series_sync(conn, channel_id, rule, anchor_date, event_time, details, target_group, keep_thread, duration_hours, guild_id=None):
+    """Partie synchrone de la création d'une série (retourne son identifiant)."""
+    cursor = conn.execute('''
+    INSERT INTO series (channel_id, rule, anchor_date, event_time, details, target_group, keep_thread, duration_hours, guild_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (channel_id, rule, anchor_date, event_time, details, target_group, int(keep_thread), duration_hours, guild_id))
+    return cursor.lastrowid
+
+def _db_get_series_sync(conn, series_id, now_ts):
+    """Série + nombre d'occurrences déjà créées et encore à venir."""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(f'''
+    SELECT {SERIES_COLUMNS},
+           (SELECT COUNT(*) FROM events e WHERE e.series_id = s.series_id AND e.start_utc > ?) AS upcoming
+    FROM series s WHERE series_id = ?
+    ''', (now_ts, series_id))
+    return cursor.fetchone()
+
+def _db_record_series_occurrences_sync(conn, series_id, rows, last_occurrence, is_active):
+    """Enregistre un lot d'occurrences et avance le curseur de la série, en une transaction."""
+    for *row, tracked, guild_id in rows:
+        _db_insert_event_sync(conn, *row, series_id, tracked, guild_id)
+    conn.execute("UPDATE series SET last_occurrence = COALESCE(?, last_occurrence), is_active = ? WHERE series_id = ?",
+                 (last_occurrence, int(is_active), series_id))
+
+def _db_deactivate_series_sync(conn, series_id):
+    conn.execute("UPDATE series SET is_active = 0 WHERE series_id = ?", (series_id,))
+
+async def get_series(series_id):
+    """Wrapper Asynchrone : Lit une série (sqlite3.Row) ou None."""
+    return await storage.read(_db_get_series_sync, series_id, int(time.time()))
+
+def series_anchor(series):
+    """Ancre (datetime dans le fuseau du serveur) d'une ligne `series`."""
+    return datetime.datetime.fromisoformat(f"{series['anchor_date']}T{series['event_time']}").replace(tzinfo=guild_settings.tz(series["guild_id"]))
+
+# ====================================================================
+# 3. LOGIQUE DES BOUTONS (VIEWS) -- TEXTE INCLUSIF
+# ====================================================================
+ROSTER_EDITS_PER_SECOND = 1.0 # Débit max d'éditions de l'embed par message d'événement
+WAITLIST_DISPLAY_MAX = 20 # Noms affichés dans la liste d'attente (limite de 1024 caractères par champ)
+
+def build_roster_embed(original_embed: discord.Embed, summary, capacity=None) -> discord.Embed:
+    """Reconstruit l'embed de l'événement avec les listes de présence à jour (et la liste d'attente)."""
+    coming_list = "\n".join([f"• {name}" for name, user_id in summary["coming"]]) or "— Personne pour l'instant —"
+    maybe_list = "\n".join([f"• {name}" for name, user_id in summary["maybe"]]) or "— Personne pour l'instant —"
+    not_coming_list = "\n".join([f"• {name}" for name, user_id in summary["not_coming"]]) or "— Personne pour l'instant —"
+    
+    new_embed = discord.Embed(title=original_embed.title, description=original_embed.description, color=original_embed.color)
+    
+    for field in original_embed.fields:
+        if (not field.name.startswith("✅ Présent·e·s") and not field.name.startswith("❓ Indécis·e·s") and not field.name.startswith("❌ Absent·e·s")
+                and not field.name.startswith("⏳ Liste d'attente")):
+                new_embed.add_field(name=field.name, value=field.value, inline=field.inline)
+                
+    coming_count = f"{len(summary['coming'])}/{capacity}" if capacity is not None else f"{len(summary['coming'])}"
+    new_embed.add_field(name=f"✅ Présent·e·s ({coming_count})", value=coming_list, inline=True)
+    new_embed.add_field(name=f"❓ Indécis·e·s ({len(summary['maybe'])})", value=maybe_list, inline=True)
+    new_embed.add_field(name=f"❌ Absent·e·s ({len(summary['not_coming'])})", value=not_coming_list, inline=True)
+    if summary["waitlist"]:
+        waitlist = "\n".join(f"{rank}. {name}" for rank, (name, user_id) in enumerate(summary["waitlist"][:WAITLIST_DISPLAY_MAX], 1))
+        if len(summary["waitlist"]) > WAITLIST_DISPLAY_MAX:
+            waitlist += f"\n… et {len(summary['waitlist']) - WAITLIST_DISPLAY_MAX} autre(s)"
+        new_embed.add_field(name=f"⏳ Liste d'attente ({len(summary['waitlist'])})", value=waitlist, inline=False)
+    return new_embed
+
+def embed_signature(embed: discord.Embed):
+    """Empreinte du contenu visible d'un embed (pour détecter les éditions inutiles)."""
+    color = embed.color.value if embed.color is not None else None
+    fields = tuple((field.name, field.value, field.inline) for field in embed.fields)
+    return (embed.title, embed.description, color, fields)
+
+class RosterEditCoalescer:
+    """Regroupe les mises à jour de l'embed d'un message d'événement.
+
+    Les clics marquent la liste comme « sale » ; une seule tâche par message pousse l'état
+    le plus récent (jamais deux éditions en parallèle, donc jamais dans le désordre), au plus
+    `max_per_second` éditions par seconde. L'édition est sautée si l'embed rendu est
+    identique au dernier envoyé.
+    """
+    def __init__(self, message_id, max_per_second=ROSTER_EDITS_PER_SECOND):
+        self.message_id = message_id
+        self.min_interval = 1.0 / max_per_second
+        self._message = None
+        self._view = None
+        self._dirty = False
+        self._task = None
+        self._last_signature = None
+        self._last_edit_at = 0.0
+
+    def mark_dirty(self, message: discord.Message, view: discord.ui.View):
+        """Signale un changement de la liste ; lance la tâche d'édition si elle ne tourne pas."""
+        self._message = message
+        self._view = view
+        self._dirty = True
+        # AJOUT : Une édition encore en file sortante est périmée : elle est remplacée par l'état le plus récent
+        outbound.supersede(("roster", self.message_id))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def cancel(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        outbound.forget(("roster", self.message_id))
+
+    async def _run(self):
+        while self._dirty:
+            delay = self._last_edit_at + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay) # Les clics reçus pendant l'attente sont regroupés
+            self._dirty = False
+            message = self._message
+            if not message or not message.embeds:
+                print("Impossible de mettre à jour le message (probablement supprimé).")
+                return
+            try:
+                summary = await get_attendance_summary(self.message_id)
+                capacity = (await get_event_state(self.message_id))[2]
+                new_embed = build_roster_embed(message.embeds[0], summary, capacity)
+                signature = embed_signature(new_embed)
+                if self._last_signature is None:
+                    self._last_signature = embed_signature(message.embeds[0])
+                if signature == self._last_signature:
+                    continue # Rien de visible n'a changé (ex: même statut cliqué deux fois)
+                with outbound_context(PRIORITY_ROSTER, key=("roster", self.message_id)):
+                    await message.edit(embed=new_embed, view=self._view)
+                self._last_signature = signature
+                self._last_edit_at = time.monotonic() # Seule une édition envoyée espace la suivante
+            except OutboundSuperseded:
+                pass # Un clic plus récent l'a remplacée en file : on reconstruit tout de suite
+            except discord.NotFound:
+                print(f"Échec de l'édition du message {self.message_id} (n'existe plus).")
+                return
+            except Exception as e:
+                print(f"Erreur inconnue lors de l'édition du message : {e}")
+                self._last_edit_at = time.monotonic() # Appel tenté : pas de nouvel essai immédiat
+
+# Un coalesceur par message d'événement (message_id -> RosterEditCoalescer)
+roster_coalescers = {}
+
+def get_roster_coalescer(message_id):
+    coalescer = roster_coalescers.get(message_id)
+    if coalescer is None:
+        coalescer = roster_coalescers[message_id] = RosterEditCoalescer(message_id)
+    return coalescer
+
+def discard_roster_coalescer(message_id):
+    """Oublie le coalesceur d'un événement (annulé, supprimé ou nettoyé) et stoppe ses éditions."""
+    coalescer = roster_coalescers.pop(message_id, None)
+    if coalescer: coalescer.cancel()
+
+# --- AJOUT : Membres des fils (cache + file d'ajouts/retraits par fil) ---
+THREAD_MEMBER_OPS_PER_SECOND = 1.0 # Débit max d'ajouts/retraits par fil (limite Discord par salon)
+
+class ThreadMembership:
+    """Membres connus d'un fil d'événement et changements d'accès en attente.
+
+    Le cache est amorcé une fois (`fetch_members`) puis tenu à jour par les événements
+    `on_thread_member_join/remove`. Un clic ne fait qu'enregistrer l'état voulu : les appels
+    redondants (déjà dans le fil / déjà sorti·e) sont sautés, et une tâche par fil applique
+    le reste hors de l'interaction, au plus `max_per_second` appels par seconde. Si un
+    membre change d'avis avant l'application, seul son dernier état compte ; s'il change
+    d'avis pendant un appel, son nouvel état est réappliqué une fois l'appel terminé.
+    """
+    def __init__(self, thread, max_per_second=THREAD_MEMBER_OPS_PER_SECOND):
+        self.thread = thread
+        self.min_interval = 1.0 / max_per_second
+        self.members = None # IDs des membres (None tant que non amorcé)
+        self._pending = {} # user_id -> (True = dans le fil, utilisateur·rice)
+        self._in_flight = {} # user_id -> état en cours d'application (attente du débit ou appel REST)
+        self._task = None
+        self._last_call_at = 0.0
+
+    def is_member(self, user_id):
+        """True/False si connu, None si le cache n'est pas encore amorcé."""
+        if self.members is None: return None
+        return user_id in self.members
+
+    def want(self, user, inside):
+        """Enregistre l'état voulu pour `user`. Retourne False si rien n'est à faire."""
+        self._pending.pop(user.id, None)
+        # L'état de référence est celui en cours d'application, sinon le cache des membres
+        current = self._in_flight[user.id] if user.id in self._in_flight else self.is_member(user.id)
+        if current == inside:
+            metrics.inc("thread_member_ops_total", outcome="skipped")
+            return False
+        self._pending[user.id] = (inside, user)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    def on_member_join(self, user_id):
+        if self.members is not None: self.members.add(user_id)
+
+    def on_member_remove(self, user_id):
+        if self.members is not None: self.members.discard(user_id)
+
+    def cancel(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def _seed(self):
+        try:
+            self.members = {member.id for member in await self.thread.fetch_members()}
+        except Exception as e:
+            print(f"Fil {self.thread.id} : Membres non lus ({e}), appels non dédoublonnés.")
+            self.members = set()
+
+    async def _run(self):
+        with outbound_context(PRIORITY_ROSTER):
+            await self._apply_pending()
+
+    async def _apply_pending(self):
+        if self.members is None:
+            await self._seed()
+        while self._pending:
+            user_id, (inside, user) = next(iter(self._pending.items()))
+            del self._pending[user_id]
+            if self.is_member(user_id) == inside:
+                metrics.inc("thread_member_ops_total", outcome="skipped")
+                continue
+            self._in_flight[user_id] = inside
+            try:
+                delay = self._last_call_at + self.min_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    if user_id in self._pending: continue # Avis inverse pendant l'attente : traité à son tour
+                await self._apply(user_id, inside, user)
+            except discord.NotFound:
+                print(f"Fil {self.thread.id} introuvable, file d'accès abandonnée.")
+                self._pending.clear()
+                return
+            finally:
+                # Un clic inverse arrivé pendant l'appel est resté dans _pending : la boucle le réapplique
+                self._in_flight.pop(user_id, None)
+
+    async def _apply(self, user_id, inside, user):
         try:
-            thread = interaction.message.thread
-            if thread:
-                if status in ["Coming", "Maybe"]:
-                    await thread.add_user(interaction.user)
-                    response_text += "\n✅ **Vous avez été ajouté·e au fil de discussion privé.**"
-                elif status == "Not Coming":
-                    await thread.remove_user(interaction.user)
-                    response_text += "\n👋 **Vous avez été retiré·e du fil de discussion privé.**"
+            if inside:
+                await self.thread.add_user(user)
+                self.on_member_join(user_id)
+            else:
+                await self.thread.remove_user(user)
+                self.on_member_remove(user_id)
+            metrics.inc("thread_member_ops_total", outcome="added" if inside else "removed")
+        except discord.NotFound:
+            raise
         except discord.Forbidden:
-            print(f"Erreur : Le bot n'a pas la permission de gérer les utilisateurs dans le thread {thread.id}")
-            response_text += "\n⚠️ Le bot n'a pas les permissions pour gérer l'accès au thread."
+            metrics.inc("thread_member_ops_total", outcome="forbidden")
+            print(f"Erreur : Le bot n'a pas la permission de gérer les utilisateurs dans le thread {self.thread.id}")
         except Exception as e:
+            metrics.inc("thread_member_ops_total", outcome="failed")
             print(f"Erreur lors de la gestion de l'accès au thread : {e}")
+        finally:
+            self._last_call_at = time.monotonic()
+
+# Une file par fil d'événement (thread_id -> ThreadMembership)
+thread_memberships = {}
+
+def get_thread_membership(thread):
+    membership = thread_memberships.get(thread.id)
+    if membership is None:
+        membership = thread_memberships[thread.id] = ThreadMembership(thread)
+    membership.thread = thread # Objet le plus récent (cache discord.py)
+    return membership
+
+def discard_thread_membership(thread_id):
+    """Oublie le cache d'un fil (supprimé ou archivé au nettoyage) et stoppe sa file."""
+    membership = thread_memberships.pop(thread_id, None)
+    if membership: membership.cancel()
+
+class TrainingView(discord.ui.View):
+    def __init__(self):
+        super().__init__(timeout=None)
+        
+    async def update_message(self, interaction: discord.Interaction):
+        # MODIFIÉ : L'édition est confiée au coalesceur du message (débit limité, dernier état gagnant)
+        if not interaction.message:
+            print("Impossible de mettre à jour le message (probablement supprimé).")
+            return
+        get_roster_coalescer(interaction.message.id).mark_dirty(interaction.message, self)
+
+    async def check_open(self, interaction: discord.Interaction) -> bool:
+        """Vérifie que les inscriptions sont ouvertes (sans I/O si l'événement est en cache)."""
+        event_end_ts, is_cancelled, capacity = await get_event_state(interaction.message.id)
+        
+        if is_cancelled:
+            await interaction.response.send_message("Désolé, cet événement a été **annulé**. Les inscriptions sont fermées.", ephemeral=True)
+            return False
+        if not event_end_ts or time.time() > event_end_ts:
+            await interaction.response.send_message("Désolé, cet événement est déjà terminé.", ephemeral=True)
+            return False
+        return True
+
+    async def invite_and_update(self, interaction: discord.Interaction, status: str, response_text: str):
+        await defer_interaction(interaction, ephemeral=True, thinking=True)
+        
+        # MODIFIÉ : Places limitées : une transaction par clic (place, liste d'attente ou promotion)
+        message_id = interaction.message.id
+        capacity = (await get_event_state(message_id))[2]
+        if capacity is None:
+            await log_attendance(message_id, interaction.user.id, interaction.user.display_name, status)
+        else:
+            status, promoted = await claim_attendance(message_id, interaction.user.id, interaction.user.display_name, status)
+            if status == WAITLIST_STATUS:
+                waitlist = [user_id for name, user_id in (await attendance_indexes.get(message_id)).members(WAITLIST_STATUS)]
+                rank = waitlist.index(interaction.user.id) + 1 if interaction.user.id in waitlist else len(waitlist)
+                response_text = (f"⏳ L'entraînement est complet ({capacity} places). Vous êtes **n°{rank}** sur la liste d'attente : "
+                                 "vous serez prévenu·e par MP si une place se libère.")
+            if promoted:
+                asyncio.create_task(notify_promoted(message_id, promoted))
+        
+        # MODIFIÉ : Accès au fil via la file du fil (appels redondants sautés, hors de l'interaction)
+        thread = interaction.message.thread
+        if thread:
+            inside = status in ["Coming", "Maybe", WAITLIST_STATUS] # En attente : accès au fil pour suivre les places
+            if get_thread_membership(thread).want(interaction.user, inside):
+                response_text += ("\n✅ **Vous allez être ajouté·e au fil de discussion privé.**" if inside
+                                  else "\n👋 **Vous allez être retiré·e du fil de discussion privé.**")
+            else:
+                response_text += ("\n✅ **Vous êtes déjà dans le fil de discussion privé.**" if inside
+                                  else "\n👋 **Vous n'êtes pas dans le fil de discussion privé.**")
             
         await interaction.followup.send(response_text, ephemeral=True)
         
@@ -246,68 +2005,46 @@ class TrainingView(discord.ui.View):
             print(f"Erreur lors de l'update_message (après followup) : {e}")
 
     @discord.ui.button(label="✅ Je viens", style=discord.ButtonStyle.green, custom_id="coming")
+    @instrumented("bouton_coming")
     async def coming_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # MODIFIÉ : Appel async BDD
-        event_end_utc, is_cancelled = await get_event_state(interaction.message.id)
-        
-        if is_cancelled:
-            await interaction.response.send_message("Désolé, cet événement a été **annulé**. Les inscriptions sont fermées.", ephemeral=True)
-            return
-        if not event_end_utc or datetime.datetime.now(datetime.timezone.utc) > event_end_utc:
-            await interaction.response.send_message("Désolé, cet événement est déjà terminé.", ephemeral=True)
-            return
-            
+        if not await self.check_open(interaction): return
         await self.invite_and_update(interaction, "Coming", "Vous êtes marqué·e comme 'Présent·e'. Rendez-vous là-bas !")
 
     @discord.ui.button(label="❓ Je ne sais pas", style=discord.ButtonStyle.blurple, custom_id="maybe")
+    @instrumented("bouton_maybe")
     async def maybe_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # MODIFIÉ : Appel async BDD
-        event_end_utc, is_cancelled = await get_event_state(interaction.message.id)
-        
-        if is_cancelled:
-            await interaction.response.send_message("Désolé, cet événement a été **annulé**. Les inscriptions sont fermées.", ephemeral=True)
-            return
-        if not event_end_utc or datetime.datetime.now(datetime.timezone.utc) > event_end_utc:
-            await interaction.response.send_message("Désolé, cet événement est déjà terminé.", ephemeral=True)
-            return
-            
+        if not await self.check_open(interaction): return
         await self.invite_and_update(interaction, "Maybe", "Vous êtes marqué·e comme 'Indécis·e'. Merci de mettre à jour si possible !")
 
     @discord.ui.button(label="❌ Je ne viens pas", style=discord.ButtonStyle.red, custom_id="not_coming")
+    @instrumented("bouton_not_coming")
     async def not_coming_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # MODIFIÉ : Appel async BDD
-        event_end_utc, is_cancelled = await get_event_state(interaction.message.id)
-        
-        if is_cancelled:
-            await interaction.response.send_message("Désolé, cet événement a été **annulé**. Les inscriptions sont fermées.", ephemeral=True)
-            return
-        if not event_end_utc or datetime.datetime.now(datetime.timezone.utc) > event_end_utc:
-            await interaction.response.send_message("Désolé, cet événement est déjà terminé.", ephemeral=True)
-            return
-            
+        if not await self.check_open(interaction): return
         await self.invite_and_update(interaction, "Not Coming", "Vous êtes marqué·e comme 'Absent·e'. Merci d'avoir prévenu.")
 
 
 # ====================================================================
 # 4. FONCTION PRINCIPALE DE CRÉATION D'ÉVÉNEMENT
 # ====================================================================
-# MODIFIÉ : Ajout de duration_hours
-async def create_event_post(date: str, time: str, details: str, recurrence_type: str, target_group: str, channel: discord.TextChannel, garder_le_fil: bool, duration_hours: float = 2.0):
+# MODIFIÉ : Publication (message + fil) séparée de l'enregistrement, pour les lots de séries
+async def post_event_message(date: str, time: str, details: str, recurrence_label: str, target_group: str, channel: discord.TextChannel, duration_hours: float):
+    """Publie le message d'un événement et son fil privé.
+
+    Retourne (message, fil ou None, [(id, type)] des messages publiés dans le salon), ou None.
+    """
+    tz = guild_settings.tz(channel_guild_id(channel))
     try:
-        naive_dt = datetime.datetime.fromisoformat(f"{date}T{time}")
-        local_dt = naive_dt.replace(tzinfo=FRENCH_TZ)
+        datetime.datetime.fromisoformat(f"{date}T{time}")
     except ValueError:
         await channel.send("Erreur : Format de date ou d'heure invalide.", delete_after=10)
-        return False
+        return None
         
     # AJOUT : Mention de la durée
     embed = discord.Embed(title=f"📅 Entraînement : {date}", 
-                          description=f"**Heure**: {time} (Heure de Paris)\n**Durée**: {duration_hours}h\n**Lieu/Détails**: {details}", 
+                          description=f"**Heure**: {time} ({tz_label(tz)})\n**Durée**: {duration_hours}h\n**Lieu/Détails**: {details}", 
                           color=discord.Color.blue())
                           
-    if recurrence_type == 'weekly': recurrence_text = " (Récurrent : Hebdomadaire)"
-    elif recurrence_type == 'monthly': recurrence_text = " (Récurrent : Mensuel)"
-    else: recurrence_text = ""
+    recurrence_text = f" (Récurrent : {recurrence_label})" if recurrence_label else ""
     
     embed.add_field(name=f"Veuillez répondre{recurrence_text}", value="Cliquez sur un bouton ci-dessous.", inline=False)
     embed.add_field(name="✅ Présent·e·s (0)", value="— Personne pour l'instant —", inline=True)
@@ -319,10 +2056,10 @@ async def create_event_post(date: str, time: str, details: str, recurrence_type:
         message = await channel.send(embed=embed, view=view)
     except discord.Forbidden:
         print(f"ERREUR : Permissions manquantes pour envoyer un message dans le salon {channel.name} ({channel.id})")
-        return False 
+        return None 
     except Exception as e:
         print(f"Erreur inconnue lors de l'envoi du message : {e}")
-        return False
+        return None
         
     # Crée un THREAD PRIVÉ
     thread_name = f"💬 Discussion entraînement du {date}"
@@ -342,208 +2079,549 @@ async def create_event_post(date: str, time: str, details: str, recurrence_type:
         print(f"Erreur création thread : {e}")
         thread = None
 
+    tracked = [(message.id, "event")]
     if target_group:
-        await channel.send(f"Nouvel entraînement publié ! {target_group} veuillez répondre. ({date} @ {time} Heure de Paris)")
+        ping = await channel.send(f"Nouvel entraînement publié ! {target_group} veuillez répondre. ({date} @ {time} {tz_label(tz)})")
+        tracked.append((ping.id, "ping"))
+    return message, thread, tracked
+
+async def discard_event_post(message, thread, tracked):
+    """Retire les messages publiés (et le fil) quand l'enregistrement BDD a échoué."""
+    await delete_tracked_messages(message.channel, [message_id for message_id, kind in tracked])
+    if thread:
+        try: await thread.delete()
+        except Exception: pass
+
+# AJOUT : Suppression ciblée des messages du bot (plus de parcours de l'historique du salon)
+BULK_DELETE_MAX_AGE = 14 * 86400 - 3600 # Limite Discord de la suppression groupée (14 jours), avec marge
+
+async def delete_tracked_messages(channel, message_ids):
+    """Supprime des messages par ID : en lots de 100 s'ils ont moins de 14 jours, un par un sinon."""
+    cutoff = time.time() - BULK_DELETE_MAX_AGE
+    message_ids = sorted(set(message_ids))
+    recent = [i for i in message_ids if discord.utils.snowflake_time(i).timestamp() > cutoff]
+    single = [i for i in message_ids if discord.utils.snowflake_time(i).timestamp() <= cutoff]
+    for start in range(0, len(recent), 100):
+        chunk = recent[start:start + 100]
+        try:
+            await channel.delete_messages([discord.Object(id=i) for i in chunk])
+        except discord.HTTPException as e:
+            # Ex : un message déjà supprimé fait échouer le lot -> repli un par un
+            print(f"Suppression groupée refusée dans {channel.id} ({e}), repli un par un.")
+            single.extend(chunk)
+    for message_id in single:
+        try: await channel.get_partial_message(message_id).delete()
+        except discord.NotFound: pass
+        except Exception as e: print(f"Erreur suppression message {message_id} : {e}")
+
+async def create_event_post(date: str, time: str, details: str, recurrence_type: str, target_group: str, channel: discord.TextChannel, garder_le_fil: bool, duration_hours: float = None):
+    """Publie et enregistre un événement ponctuel (durée par défaut : celle du serveur)."""
+    guild_id = channel_guild_id(channel)
+    if duration_hours is None:
+        duration_hours = guild_settings.default_duration(guild_id)
+    legacy_labels = {"weekly": "Hebdomadaire", "monthly": "Mensuel"}
+    posted = await post_event_message(date, time, details, legacy_labels.get(recurrence_type), target_group, channel, duration_hours)
+    if posted is None:
+        return False
+    message, thread, tracked = posted
 
     # Enregistrement BDD (MODIFIÉ : Appel async BDD)
     thread_id_to_save = thread.id if thread else None
     try:
-        # MODIFIÉ : Utilise asyncio.to_thread pour l'insertion
-        await asyncio.to_thread(
-            _db_insert_event_sync,
+        # MODIFIÉ : Insertion via le thread écrivain du Storage
+        await insert_event(
             message.id, thread_id_to_save, channel.id, date, time, details, 
-            recurrence_type, target_group, garder_le_fil, duration_hours
+            recurrence_type, target_group, garder_le_fil, duration_hours, tracked_messages=tracked, guild_id=guild_id
         )
     except Exception as e:
         print(f"ERREUR BDD lors de l'insertion de l'événement : {e}")
-        await message.delete() # On tente de supprimer le message si la BDD a échoué
-        if thread: await thread.delete()
+        await discard_event_post(message, thread, tracked) # On tente de supprimer le message si la BDD a échoué
         return False
         
+    event_state_cache.set(message.id, compute_event_end_ts(date, time, duration_hours, guild_settings.tz(guild_id)))
+    await reschedule_event(message.id)
     return True
 
+# --- AJOUT : Séries récurrentes ---
+async def extend_series(series_id, horizon_days=None):
+    """Crée en un lot les prochaines occurrences d'une série. Retourne les dates créées.
+
+    Les occurrences sont calculées directement après la dernière déjà créée (ou maintenant,
+    après une coupure) ; on garde toujours au moins une occurrence à venir, plus celles qui
+    tombent dans la fenêtre `horizon_days`. Tous les messages sont publiés, puis enregistrés
+    en une seule transaction.
+    """
+    series = await get_series(series_id)
+    if series is None or not series["is_active"]:
+        return []
+    channel = await resolve_channel(series["channel_id"])
+    if channel is None:
+        print(f"Série {series_id} : Salon {series['channel_id']} non trouvé.")
+        return []
+    rule = RecurrenceRule.parse(series["rule"])
+    anchor = series_anchor(series)
+    now_local = datetime.datetime.now(anchor.tzinfo)
+    cursor = max(anchor - datetime.timedelta(seconds=1), now_local) # L'ancre elle-même est candidate
+    if series["last_occurrence"]:
+        cursor = max(cursor, datetime.datetime.fromisoformat(series["last_occurrence"]).replace(tzinfo=anchor.tzinfo))
+    horizon_end = now_local + datetime.timedelta(days=SERIES_HORIZON_DAYS if horizon_days is None else horizon_days)
+
+    planned, exhausted = [], True
+    for occurrence in rule.occurrences(anchor, cursor):
+        if len(planned) >= SERIES_MAX_BATCH or (occurrence > horizon_end and (planned or series["upcoming"])):
+            exhausted = False
+            break
+        planned.append(occurrence)
+
+    posted = []
+    for occurrence in planned:
+        date, event_time = occurrence.strftime("%Y-%m-%d"), occurrence.strftime("%H:%M:%S")
+        result = await post_event_message(date, event_time, series["details"], rule.describe(),
+                                          series["target_group"], channel, series["duration_hours"])
+        if result is None:
+            break # Permissions, salon... on reprendra au prochain passage
+        posted.append((occurrence, *result))
+
+    rows = [
+        (message.id, thread.id if thread else None, channel.id, occurrence.strftime("%Y-%m-%d"), occurrence.strftime("%H:%M:%S"),
+         series["details"], rule.freq, series["target_group"], bool(series["keep_thread"]), series["duration_hours"], tracked,
+         series["guild_id"])
+        for occurrence, message, thread, tracked in posted
+    ]
+    last_occurrence = posted[-1][0].strftime("%Y-%m-%dT%H:%M:%S") if posted else None
+    still_active = not (exhausted and len(posted) == len(planned))
+    try:
+        await storage.write(_db_record_series_occurrences_sync, series_id, rows, last_occurrence, still_active)
+    except Exception as e:
+        print(f"ERREUR BDD lors de l'enregistrement de la série {series_id} : {e}")
+        for occurrence, message, thread, tracked in posted:
+            await discard_event_post(message, thread, tracked)
+        return []
+
+    for row in rows:
+        event_state_cache.set(row[0], compute_event_end_ts(row[3], row[4], row[9], anchor.tzinfo))
+        await reschedule_event(row[0])
+    if not still_active:
+        print(f"Série {series_id} : Terminée (UNTIL/COUNT atteint).")
+    return [row[3] for row in rows]
+
+async def create_series_post(date: str, time: str, details: str, rule: RecurrenceRule, target_group: str, channel: discord.TextChannel, garder_le_fil: bool, duration_hours: float = None, horizon_days=None):
+    """Crée une série récurrente ancrée sur `date` `time` et publie ses premières occurrences."""
+    guild_id = channel_guild_id(channel)
+    if duration_hours is None:
+        duration_hours = guild_settings.default_duration(guild_id)
+    try:
+        datetime.datetime.fromisoformat(f"{date}T{time}")
+    except ValueError:
+        await channel.send("Erreur : Format de date ou d'heure invalide.", delete_after=10)
+        return []
+    series_id = await storage.write(_db_insert_series_sync, channel.id, str(rule), date, time,
+                                    details, target_group, garder_le_fil, duration_hours, guild_id)
+    created = await extend_series(series_id, horizon_days)
+    if not created:
+        await storage.write(_db_deactivate_series_sync, series_id)
+    return created
+
 # ====================================================================
 # 5. ÉVÉNEMENTS DU BOT ET COMMANDES
 # ====================================================================
 @bot.event
 async def on_ready():
-    """Confirme la connexion, enregistre les vues persistantes, et lance les tâches."""
+    """Confirme la connexion et lance les tâches (vues, commandes et caches : voir warm_start)."""
     print(f'Connecté en tant que {bot.user}')
     print('Le bot est prêt !')
     
-    bot.add_view(TrainingView()) 
-    
-    await bot.tree.sync() 
-    # On vérifie si les tâches ne sont pas déjà lancées avant de les démarrer.
-    if not check_for_cleanup.is_running():
-        check_for_cleanup.start()
-        print("Tâche de nettoyage (check_for_cleanup) démarrée.")
-        
-    if not check_reminders.is_running():
-        check_reminders.start()
-        print("Tâche de rappels (check_reminders) démarrée.")
+    # On vérifie si l'ordonnanceur n'est pas déjà lancé (reconnexion) avant de le démarrer.
+    if not event_scheduler.is_running():
+        await backfill_guild_ids()
+        event_scheduler.start()
+        if RUN_MODE == "all":
+            print("Ordonnanceur des rappels et nettoyages démarré.")
+    if RUN_MODE == "all": # En mode gateway, le worker leader s'en charge
+        await catch_up_missed_reminders() # Démarrage ou reconnexion complète
+    if "ready" not in startup_timings: # Premier on_ready seulement (pas les reconnexions)
+        startup_timings["ready"] = time.time() - metrics.started_at
+        metrics.observe("startup_phase_seconds", startup_timings["ready"], phase="ready")
+        print(f"Démarrage : prêt en {startup_timings['ready']:.1f} s.")
+
+@bot.event
+async def on_resumed():
+    """Reprise de session passerelle : rattrape les rappels dont la fenêtre s'est refermée entre-temps."""
+    if RUN_MODE == "all":
+        await catch_up_missed_reminders()
+
+# AJOUT : Tient à jour le cache des membres des fils (ajouts/retraits manuels compris)
+@bot.event
+async def on_thread_member_join(member: discord.ThreadMember):
+    membership = thread_memberships.get(member.thread_id)
+    if membership: membership.on_member_join(member.id)
+
+@bot.event
+async def on_thread_member_remove(member: discord.ThreadMember):
+    membership = thread_memberships.get(member.thread_id)
+    if membership: membership.on_member_remove(member.id)
 
 
 
 # --- COMMANDE SLASH (RAPIDE) ---
 # MODIFIÉ : Ajout de duration_hours
-@bot.tree.command(name="creer_entrainement", description="Créer un nouvel entraînement (Heure de Paris)")
+@bot.tree.command(name="creer_entrainement", description="Créer un nouvel entraînement (heure locale du serveur)")
 @discord.app_commands.describe(
     date="Date (AAAA-MM-JJ)", time="Heure (HH:MM:SS)", details="Détails", 
-    duration_hours="Durée en heures (ex: 2.5 pour 2h30)", # AJOUT
+    duration_hours="Durée en heures (ex: 2.5 pour 2h30, défaut : réglage du serveur)", # AJOUT
     recurrent="[Obsolète] True=Hebdo", target_group="Rôle(s) ou Membre(s) à notifier", 
-    garder_le_fil="True=NE PAS supprimer le fil"
+    garder_le_fil="True=NE PAS supprimer le fil",
+    regle="Récurrence avancée, ex: FREQ=WEEKLY;BYDAY=TU,TH;UNTIL=2026-06-30" # AJOUT
 )
+@instrumented("creer_entrainement")
 async def create_training(interaction: discord.Interaction, date: str, time: str, details: str, 
-                        duration_hours: float = 2.0, # AJOUT
-                        recurrent: bool = False, target_group: str = None, garder_le_fil: bool = False):
+                        duration_hours: float = None, # AJOUT
+                        recurrent: bool = False, target_group: str = None, garder_le_fil: bool = False,
+                        regle: str = None): # AJOUT
+    
+    # AJOUT : Règle de récurrence (validée avant toute publication)
+    try:
+        rule = RecurrenceRule.parse(regle) if regle else RecurrenceRule.from_legacy('weekly' if recurrent else 'none')
+    except ValueError as e:
+        await interaction.response.send_message(f"Règle de récurrence invalide : {e}", ephemeral=True); return
     
     await interaction.response.send_message(f"Création de l'entraînement...", ephemeral=True)
     channel = interaction.channel
-    recurrence_str = 'weekly' if recurrent else 'none'
     
-    # MODIFIÉ : Passe duration_hours
-    success = await create_event_post(date, time, details, recurrence_str, target_group, channel, garder_le_fil, duration_hours)
+    if rule:
+        created = await create_series_post(date, time, details, rule, target_group, channel, garder_le_fil, duration_hours)
+        success = bool(created)
+    else:
+        # MODIFIÉ : Passe duration_hours
+        success = await create_event_post(date, time, details, 'none', target_group, channel, garder_le_fil, duration_hours)
     
     if success:
         await interaction.edit_original_response(content="Entraînement publié avec succès !")
     else:
         await interaction.edit_original_response(content="⚠️ **Échec de la publication.** Vérifiez les logs et les permissions du bot dans ce salon.")
 
-# --- DÉBUT DE L'ASSISTANT (WIZARD) ---
-async def ask_text(user: discord.User, question: str, timeout: int = 300) -> str:
-    dm = await user.create_dm()
-    await dm.send(question)
-    def check(m): return m.author == user and m.channel == dm
-    try:
-        message = await bot.wait_for('message', check=check, timeout=timeout)
-        if message.content.lower().strip() in ['aucun', 'non', 'none', '']: return None
-        return message.content
-    except asyncio.TimeoutError:
-        await dm.send("Délai expiré. Relancez la commande."); return None
-        
-async def ask_choice(user: discord.User, question: str, choices: list[str], timeout: int = 300) -> str:
-    dm = await user.create_dm()
-    view = discord.ui.View(timeout=timeout)
-    result = asyncio.Future()
-    
-    # Correction de la lambda pour capturer la variable 'choice' correctement
-    async def callback(interaction: discord.Interaction, button_label: str):
-        await interaction.response.edit_message(content=f"Sélectionné·e : **{button_label}**", view=None)
-        if not result.done():
-            result.set_result(button_label)
-
-    for choice in choices:
-        button = discord.ui.Button(label=choice, style=discord.ButtonStyle.primary)
-        # functools.partial est plus sûr que lambda dans les boucles pour ce cas
-        button.callback = functools.partial(callback, button_label=choice)
-        view.add_item(button)
-        
-    await dm.send(question, view=view)
-    try: 
-        return await asyncio.wait_for(result, timeout=timeout)
-    except (asyncio.TimeoutError, asyncio.CancelledError):
-        await dm.send("Délai expiré. Relancez la commande."); return None
+# --- ASSISTANT DE CRÉATION (WIZARD) ---
+# MODIFIÉ : Plus de `bot.wait_for` par question (chaque message reçu était testé contre toutes
+# les closures en attente). Les MPs sont routés par salon MP via un dict, les boutons par
+# custom_id, et l'état de chaque session est enregistré en BDD : un redémarrage reprend
+# l'assistant à l'étape en cours.
+WIZARD_IDLE_SECONDS = 300 # Session abandonnée après 5 min sans réponse (comme l'ancien timeout par question)
+WIZARD_MAX_SESSIONS = 20 # Assistants simultanés max
+WIZARD_EMPTY_ANSWERS = ('aucun', 'non', 'none', '')
+WIZARD_STEPS = (
+    # (clé, question, choix (None = réponse texte), réponse obligatoire)
+    ("date", "📅 **Étape 1/7 :** Date ? (AAAA-MM-JJ)", None, True),
+    ("time", "🕒 **Étape 2/7 :** Heure de début ? (HH:MM:SS)", None, True),
+    ("details", "📝 **Étape 3/7 :** Détails (lieu, etc.) ?", None, True),
+    ("duration", "⏳ **Étape 4/7 :** Durée en heures ? (ex: `2.5` pour 2h30, 'aucun' pour la durée par défaut du serveur)", None, False),
+    ("recurrence", "🔁 **Étape 5/7 :** Récurrence ?", ("Aucune", "Hebdomadaire", "Mensuelle"), True),
+    ("keep_thread", "🧵 **Étape 6/7 :** Garder le fil après l'événement ?", ("Non (supprimer)", "Oui (archiver)"), True),
+    ("target_group", "🔔 **Étape 7/7 (Optionnel) :** Rôle(s) ou Membre(s) à mentionner ? (ex: `@Membres @Louis`). 'aucun' si personne.", None, False),
+)
+
+def _db_save_wizard_session_sync(conn, user_id, dm_channel_id, target_channel_id, step, answers, updated_utc):
+    """Partie synchrone : enregistre l'étape en cours d'une session d'assistant."""
+    conn.execute('''
+    REPLACE INTO wizard_sessions (user_id, dm_channel_id, target_channel_id, step, answers, updated_utc)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, dm_channel_id, target_channel_id, step, json.dumps(answers), updated_utc))
+
+def _db_delete_wizard_session_sync(conn, user_id):
+    conn.execute("DELETE FROM wizard_sessions WHERE user_id = ?", (user_id,))
+
+def _db_get_wizard_sessions_sync(conn):
+    return conn.execute("SELECT user_id, dm_channel_id, target_channel_id, step, answers, updated_utc FROM wizard_sessions").fetchall()
+
+class WizardSession:
+    """État d'un assistant : salon MP, salon cible, étape en cours et réponses déjà données."""
+    def __init__(self, user_id, dm_channel_id, target_channel_id, step=0, answers=None):
+        self.user_id = user_id
+        self.dm_channel_id = dm_channel_id
+        self.target_channel_id = target_channel_id
+        self.step = step
+        self.answers = answers or {}
+        self.timer = None # Expiration pour inactivité (loop.call_later)
+        self.busy = False # Réponse en cours de traitement (double clic / double envoi ignoré)
+
+    @property
+    def dm(self):
+        return bot.get_channel(self.dm_channel_id) or bot.get_partial_messageable(self.dm_channel_id, type=discord.ChannelType.private)
+
+class WizardManager:
+    """Sessions d'assistant indexées par salon MP et par utilisateur·rice (routage en O(1)).
+
+    Au plus `max_sessions` sessions simultanées ; une session sans réponse pendant
+    `idle_seconds` est fermée (minuteur réarmé à chaque réponse).
+    """
+    def __init__(self, max_sessions=WIZARD_MAX_SESSIONS, idle_seconds=WIZARD_IDLE_SECONDS):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.by_channel = {}
+        self.by_user = {}
+
+    def __len__(self):
+        return len(self.by_user)
+
+    def has_room(self, user_id):
+        return user_id in self.by_user or len(self) < self.max_sessions
+
+    async def start(self, user, target_channel):
+        """Ouvre une session (remplace celle en cours de la même personne). False si complet."""
+        if not self.has_room(user.id):
+            return False
+        previous = self.by_user.get(user.id)
+        if previous is not None:
+            await self._end(previous)
+        dm = await user.create_dm()
+        session = WizardSession(user.id, dm.id, target_channel.id)
+        self._register(session)
+        try:
+            await self._save(session)
+            await self._ask(session)
+        except Exception:
+            await self._end(session)
+            raise
+        return True
+
+    async def restore(self):
+        """Recharge les sessions enregistrées (au démarrage) et repose la question en cours."""
+        rows = await storage.read(_db_get_wizard_sessions_sync)
+        now = time.time()
+        for user_id, dm_channel_id, target_channel_id, step, answers, updated_utc in rows:
+            session = WizardSession(user_id, dm_channel_id, target_channel_id, step, json.loads(answers or "{}"))
+            if now - (updated_utc or 0) > self.idle_seconds or len(self) >= self.max_sessions:
+                await storage.write(_db_delete_wizard_session_sync, user_id)
+                continue
+            self._register(session)
+            try:
+                await session.dm.send("🔄 Le bot a redémarré : l'assistant reprend où vous en étiez.")
+                await self._ask(session)
+            except Exception as e:
+                print(f"Assistant : Reprise impossible pour {user_id} ({e}).")
+                await self._end(session)
+        if self.by_user:
+            print(f"Assistant : {len(self)} session(s) reprise(s).")
+
+    def _register(self, session):
+        self.by_channel[session.dm_channel_id] = session
+        self.by_user[session.user_id] = session
+        self._touch(session)
+
+    def _touch(self, session):
+        if session.timer: session.timer.cancel()
+        session.timer = asyncio.get_running_loop().call_later(
+            self.idle_seconds, lambda: asyncio.create_task(self._end(session, "Délai expiré. Relancez la commande."))
+        )
+
+    async def _save(self, session):
+        await storage.write(_db_save_wizard_session_sync, session.user_id, session.dm_channel_id,
+                            session.target_channel_id, session.step, session.answers, int(time.time()))
+
+    async def _end(self, session, notice=None):
+        if self.by_user.get(session.user_id) is not session:
+            return # Déjà fermée (ou remplacée)
+        del self.by_user[session.user_id]
+        self.by_channel.pop(session.dm_channel_id, None)
+        if session.timer: session.timer.cancel()
+        await storage.write(_db_delete_wizard_session_sync, session.user_id)
+        if notice:
+            try: await session.dm.send(notice)
+            except Exception: pass # L'utilisateur a peut-être bloqué le bot
+
+    async def _ask(self, session):
+        key, question, choices, required = WIZARD_STEPS[session.step]
+        if choices is None:
+            await session.dm.send(question)
+            return
+        view = discord.ui.View(timeout=None)
+        for index, choice in enumerate(choices):
+            view.add_item(discord.ui.Button(label=choice, style=discord.ButtonStyle.primary,
+                                            custom_id=f"wizard:{session.user_id}:{session.step}:{index}"))
+        await session.dm.send(question, view=view)
+        view.stop() # Les clics sont routés par custom_id (on_interaction), y compris après un redémarrage
+
+    async def on_dm(self, message):
+        """Réponse texte reçue en MP (appelé pour chaque MP : une seule recherche dans un dict)."""
+        session = self.by_channel.get(message.channel.id)
+        if session is None or message.author.id != session.user_id or session.busy:
+            return
+        key, question, choices, required = WIZARD_STEPS[session.step]
+        if choices is not None:
+            await message.channel.send("Merci de répondre avec les boutons ci-dessus.")
+            return
+        content = message.content.strip()
+        session.busy = True # Réservé avant le premier await : l'étape n'avance qu'une fois
+        try:
+            await self._answer(session, None if content.lower() in WIZARD_EMPTY_ANSWERS else content)
+        finally:
+            session.busy = False
+
+    async def on_choice(self, interaction, custom_id):
+        """Clic sur un bouton d'assistant (`wizard:<user_id>:<étape>:<choix>`)."""
+        try:
+            _, user_id, step, index = custom_id.split(":")
+            user_id, step, index = int(user_id), int(step), int(index)
+        except ValueError:
+            return
+        session = self.by_user.get(user_id)
+        if session is None or session.step != step or session.busy or interaction.user.id != user_id:
+            await interaction.response.edit_message(content="Cette question n'est plus active.", view=None)
+            return
+        session.busy = True # Réservé avant le premier await : un double clic ne répond pas à la question suivante
+        try:
+            label = WIZARD_STEPS[step][2][index]
+            await interaction.response.edit_message(content=f"Sélectionné·e : **{label}**", view=None)
+            if self.by_user.get(user_id) is session and session.step == step: # Session expirée pendant l'édition ?
+                await self._answer(session, label)
+        finally:
+            session.busy = False
+
+    async def _answer(self, session, value):
+        key, question, choices, required = WIZARD_STEPS[session.step]
+        if value is None and required:
+            await self._end(session, "Assistant annulé. Relancez la commande.")
+            return
+        if key == "duration":
+            try:
+                value = float(value.replace(',', '.')) if value else None
+            except ValueError:
+                await session.dm.send("Durée invalide. Utilisation de la durée par défaut du serveur.")
+                value = None
+            else:
+                if value is None:
+                    await session.dm.send("Utilisation de la durée par défaut du serveur.")
+        session.answers[key] = value
+        session.step += 1
+        self._touch(session)
+        if session.step < len(WIZARD_STEPS):
+            await self._save(session)
+            await self._ask(session)
+        else:
+            await self._end(session) # Avant la publication : un double envoi ne crée pas deux événements
+            await self._finish(session)
+
+    async def _finish(self, session):
+        answers = session.answers
+        user_dm = session.dm
+        try:
+            original_channel = bot.get_channel(session.target_channel_id) or await bot.fetch_channel(session.target_channel_id)
+            garder_le_fil = (answers["keep_thread"] == "Oui (archiver)")
+            target_group_str = answers.get("target_group")
+            
+            confirmation_msg = f"✅ **Terminé !** Création dans {original_channel.mention}."
+            if target_group_str: confirmation_msg += f" Rappels pour {target_group_str}."
+            await user_dm.send(confirmation_msg)
+            
+            recurrence_map = {"Aucune": "none", "Hebdomadaire": "weekly", "Mensuelle": "monthly"}
+            rule = RecurrenceRule.from_legacy(recurrence_map.get(answers["recurrence"], "none"))
+            if rule:
+                success = bool(await create_series_post(
+                    answers["date"], answers["time"], answers["details"], rule, target_group_str,
+                    original_channel, garder_le_fil, answers["duration"]
+                ))
+            else:
+                success = await create_event_post(
+                    date=answers["date"], time=answers["time"], details=answers["details"],
+                    recurrence_type='none', target_group=target_group_str, 
+                    channel=original_channel, garder_le_fil=garder_le_fil,
+                    duration_hours=answers["duration"]
+                )
+            
+            if not success:
+                await user_dm.send(f"⚠️ **Échec de la publication !** Je n'ai pas pu poster l'événement dans {original_channel.mention}. Vérifiez les permissions du bot dans ce salon (voir logs).")
+                
+        except Exception as e:
+            print(f"Erreur durant l'assistant : {e}")
+            try:
+                await user_dm.send(f"Erreur lors de la création. Détails : {e}")
+            except Exception:
+                pass # L'utilisateur a peut-être bloqué le bot
+
+wizard_manager = WizardManager()
+
+@bot.listen("on_message")
+async def route_wizard_dm(message: discord.Message):
+    if message.guild is None and not message.author.bot:
+        with outbound_context(PRIORITY_INTERACTION):
+            await wizard_manager.on_dm(message)
+
+@bot.listen("on_interaction")
+async def route_wizard_choice(interaction: discord.Interaction):
+    if interaction.type is discord.InteractionType.component:
+        custom_id = (interaction.data or {}).get("custom_id", "")
+        if custom_id.startswith("wizard:"):
+            with outbound_context(PRIORITY_INTERACTION):
+                await wizard_manager.on_choice(interaction, custom_id)
 
 @bot.tree.command(name="creer_wizard", description="[ADMIN] Lancer l'assistant de création d'événement en MP.")
 @discord.app_commands.checks.has_permissions(administrator=True)
+@instrumented("creer_wizard")
 async def creer_wizard(interaction: discord.Interaction):
-    user = interaction.user
-    original_channel = interaction.channel 
+    if not wizard_manager.has_room(interaction.user.id):
+        await interaction.response.send_message(f"Trop d'assistants en cours ({WIZARD_MAX_SESSIONS} max). Réessayez dans quelques minutes.", ephemeral=True); return
     await interaction.response.send_message(f"Parfait ! Message privé envoyé.", ephemeral=True)
-    
     try:
-        # MODIFIÉ : Ajout de la durée (Étape 4/7)
-        date_str = await ask_text(user, "📅 **Étape 1/7 :** Date ? (AAAA-MM-JJ)")
-        if not date_str: return
-        time_str = await ask_text(user, "🕒 **Étape 2/7 :** Heure de début ? (HH:MM:SS)")
-        if not time_str: return
-        details_str = await ask_text(user, "📝 **Étape 3/7 :** Détails (lieu, etc.) ?")
-        if not details_str: return
-        
-        # AJOUT ÉTAPE DURÉE
-        duration_float = 2.0 # Défaut
-        duration_str = await ask_text(user, "⏳ **Étape 4/7 :** Durée en heures ? (ex: `2.5` pour 2h30, `2` par défaut)")
-        if duration_str:
-            try:
-                duration_float = float(duration_str.replace(',', '.'))
-            except ValueError:
-                await user.send("Durée invalide. Utilisation de 2.0 heures par défaut.")
-                duration_float = 2.0
-        else:
-             await user.send("Utilisation de 2.0 heures par défaut.")
-             
-        recurrence_choice = await ask_choice(user, "🔁 **Étape 5/7 :** Récurrence ?", ["Aucune", "Hebdomadaire", "Mensuelle"])
-        if not recurrence_choice: return
-        recurrence_map = {"Aucune": "none", "Hebdomadaire": "weekly", "Mensuelle": "monthly"}
-        recurrence_type = recurrence_map.get(recurrence_choice, "none")
-        
-        keep_choice = await ask_choice(user, "🧵 **Étape 6/7 :** Garder le fil après l'événement ?", ["Non (supprimer)", "Oui (archiver)"])
-        if not keep_choice: return
-        garder_le_fil = (keep_choice == "Oui (archiver)")
-        
-        target_group_str = await ask_text(user, "🔔 **Étape 7/7 (Optionnel) :** Rôle(s) ou Membre(s) à mentionner ? (ex: `@Membres @Louis`). 'aucun' si personne.")
-        
-        confirmation_msg = f"✅ **Terminé !** Création dans {original_channel.mention}."
-        if target_group_str: confirmation_msg += f" Rappels pour {target_group_str}."
-        await user.send(confirmation_msg)
-        
-        success = await create_event_post(
-            date=date_str, time=time_str, details=details_str,
-            recurrence_type=recurrence_type, target_group=target_group_str, 
-            channel=original_channel, garder_le_fil=garder_le_fil,
-            duration_hours=duration_float # AJOUT
-        )
-        
-        if not success:
-            await user.send(f"⚠️ **Échec de la publication !** Je n'ai pas pu poster l'événement dans {original_channel.mention}. Vérifiez les permissions du bot dans ce salon (voir logs).")
-            
-    except Exception as e:
-        print(f"Erreur durant l'assistant : {e}")
-        try:
-            await user.send(f"Erreur lors de la création. Détails : {e}")
-        except Exception:
-            pass # L'utilisateur a peut-être bloqué le bot
+        if not await wizard_manager.start(interaction.user, interaction.channel):
+            await interaction.followup.send(f"Trop d'assistants en cours ({WIZARD_MAX_SESSIONS} max). Réessayez dans quelques minutes.", ephemeral=True)
+    except discord.Forbidden:
+        await interaction.followup.send("Impossible de vous écrire en MP (MPs fermés ?).", ephemeral=True)
 
 # --- COMMANDE DE SUPPRESSION ---
-# MODIFIÉ : Utilise asyncio.to_thread pour la BDD
-def _db_admin_delete_sync(message_id):
-    """Partie synchrone de la suppression admin (event + attendance)."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
+# MODIFIÉ : Passe par le thread écrivain du Storage
+def _db_admin_delete_sync(conn, message_id):
+    """Partie synchrone de la suppression admin (event + attendance, archivés)."""
     cursor = conn.cursor()
     cursor.execute("SELECT thread_id, channel_id FROM events WHERE message_id = ?", (message_id,))
     event_data = cursor.fetchone()
     
     if event_data:
-        cursor.execute("DELETE FROM events WHERE message_id = ?", (message_id,))
-        # CORRECTION FUITE DE DONNÉES (aussi appliquée ici)
-        cursor.execute("DELETE FROM attendance WHERE message_id = ?", (message_id,))
-        conn.commit()
+        series_id = cursor.execute("SELECT series_id FROM events WHERE message_id = ?", (message_id,)).fetchone()[0]
+        tracked_ids = _db_get_tracked_messages_sync(conn, message_id)
+        cursor.execute("DELETE FROM bot_messages WHERE event_id = ?", (message_id,))
+        cursor.execute("DELETE FROM action_claims WHERE message_id = ?", (message_id,))
+        # MODIFIÉ : Archivé plutôt que supprimé (compté dans les agrégats seulement s'il a eu lieu)
+        _db_archive_event_sync(conn, message_id, "deleted", int(time.time()))
+        # AJOUT : Supprimer la seule occurrence restante arrête la série (comme avant : « annule sa récurrence »)
+        cursor.execute('''
+        UPDATE series SET is_active = 0
+        WHERE series_id = ? AND NOT EXISTS (SELECT 1 FROM events WHERE series_id = ?)
+        ''', (series_id, series_id))
+        return (*event_data, tracked_ids)
         
-    conn.close()
     return event_data # Retourne les données ou None
 
+async def admin_delete_event(message_id):
+    """Wrapper Asynchrone : Supprime un événement et ses présences."""
+    await attendance_writer.flush() # Aucun RSVP en attente ne doit recréer de présences orphelines
+    return await storage.write(_db_admin_delete_sync, message_id)
+
 @bot.tree.command(name="supprimer_evenement", description="[ADMIN] Supprime manuellement un événement.")
 @discord.app_commands.describe(message_id="L'ID du message de l'événement à supprimer")
 @discord.app_commands.checks.has_permissions(administrator=True)
+@instrumented("supprimer_evenement")
 async def supprimer_evenement(interaction: discord.Interaction, message_id: str):
     await interaction.response.send_message(f"Recherche et suppression de {message_id}...", ephemeral=True)
     try: msg_id_int = int(message_id)
     except ValueError:
         await interaction.edit_original_response(content="Erreur : L'ID doit être un nombre."); return
     
-    # MODIFIÉ : Opérations BDD dans un thread
-    event_data = await asyncio.to_thread(_db_admin_delete_sync, msg_id_int)
+    # MODIFIÉ : Opérations BDD via le Storage
+    event_data = await admin_delete_event(msg_id_int)
+    event_state_cache.discard(msg_id_int)
+    discard_roster_coalescer(msg_id_int)
+    attendance_indexes.discard(msg_id_int)
+    event_scheduler.unschedule(msg_id_int)
     
     if not event_data:
         await interaction.edit_original_response(content="Événement non trouvé dans la BDD."); return
         
-    thread_id, channel_id = event_data
+    thread_id, channel_id, tracked_ids = event_data
+    discard_thread_membership(thread_id)
     print(f"Suppression manuelle {msg_id_int} par {interaction.user.name}")
     
     try:
         channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
-        if channel: message = await channel.fetch_message(msg_id_int); await message.delete()
+        if channel: await delete_tracked_messages(channel, tracked_ids + [msg_id_int])
     except Exception: pass 
     
     try:
@@ -554,32 +2632,38 @@ async def supprimer_evenement(interaction: discord.Interaction, message_id: str)
     await interaction.edit_original_response(content=f"Succès ! L'événement {msg_id_int} a été supprimé.")
 
 # --- COMMANDE D'ANNULATION ---
-# MODIFIÉ : Utilise asyncio.to_thread pour la BDD
-def _db_admin_cancel_sync(message_id):
+# MODIFIÉ : Passe par le thread écrivain du Storage
+def _db_admin_cancel_sync(conn, message_id):
     """Partie synchrone de l'annulation admin."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
     cursor.execute("SELECT thread_id, channel_id FROM events WHERE message_id = ?", (message_id,))
     event_data = cursor.fetchone()
     
     if event_data:
         cursor.execute("UPDATE events SET is_cancelled = 1 WHERE message_id = ?", (message_id,))
-        conn.commit()
         
-    conn.close()
     return event_data
 
+async def admin_cancel_event(message_id):
+    """Wrapper Asynchrone : Marque un événement comme annulé."""
+    return await storage.write(_db_admin_cancel_sync, message_id)
+
 @bot.tree.command(name="annuler_evenement", description="[ADMIN] Annule un événement (bloque les inscriptions).")
 @discord.app_commands.describe(message_id="L'ID du message de l'événement à annuler")
 @discord.app_commands.checks.has_permissions(administrator=True)
+@instrumented("annuler_evenement")
 async def annuler_evenement(interaction: discord.Interaction, message_id: str):
-    await interaction.response.defer(ephemeral=True, thinking=True)
+    await defer_interaction(interaction, ephemeral=True, thinking=True)
     try: msg_id_int = int(message_id)
     except ValueError:
         await interaction.followup.send("Erreur : L'ID doit être un nombre.", ephemeral=True); return
     
-    # MODIFIÉ : Opérations BDD dans un thread
-    event_data = await asyncio.to_thread(_db_admin_cancel_sync, msg_id_int)
+    # MODIFIÉ : Opérations BDD via le Storage
+    event_data = await admin_cancel_event(msg_id_int)
+    if event_data:
+        event_state_cache.mark_cancelled(msg_id_int)
+        discard_roster_coalescer(msg_id_int) # Évite qu'une édition en attente ne remette les boutons
+        await reschedule_event(msg_id_int) # Plus de rappels, seul le nettoyage reste programmé
 
     if not event_data:
         await interaction.followup.send(f"Événement non trouvé dans la BDD.", ephemeral=True); return
@@ -608,285 +2692,1964 @@ async def annuler_evenement(interaction: discord.Interaction, message_id: str):
     
     await interaction.followup.send(f"Succès ! L'événement {msg_id_int} a été marqué comme annulé.", ephemeral=True)
 
-# --- GESTION DES ERREURS ---
-@bot.event
-async def on_tree_error(interaction: discord.Interaction, error: discord.app_commands.AppCommandError):
-    if isinstance(error, discord.app_commands.MissingPermissions):
-        await interaction.response.send_message("Erreur : Permissions (Admin) insuffisantes.", ephemeral=True)
-    else:
-        print(f"Erreur commande non gérée : {error}")
-        error_msg = f"Une erreur inattendue est survenue."
-        try: 
-            if interaction.response.is_done():
-                await interaction.followup.send(error_msg, ephemeral=True)
-            else:
-                await interaction.response.send_message(error_msg, ephemeral=True)
-        except Exception as e:
-            print(f"Impossible d'envoyer un message d'erreur à l'utilisateur : {e}")
+# --- AJOUT : PLACES LIMITÉES ---
+@bot.tree.command(name="places", description="[ADMIN] Limite le nombre de participant·e·s d'un événement (liste d'attente au-delà).")
+@discord.app_commands.describe(message_id="L'ID du message de l'événement", places="Nombre de places (0 = illimité)")
+@discord.app_commands.checks.has_permissions(administrator=True)
+@instrumented("places")
+async def places(interaction: discord.Interaction, message_id: str, places: int):
+    await defer_interaction(interaction, ephemeral=True, thinking=True)
+    try: msg_id_int = int(message_id)
+    except ValueError:
+        await interaction.followup.send("Erreur : L'ID doit être un nombre.", ephemeral=True); return
+    if places < 0:
+        await interaction.followup.send("Le nombre de places doit être positif (0 = illimité).", ephemeral=True); return
+    capacity = places or None
 
+    await attendance_writer.flush() # Les RSVP déjà reçus sont comptés avant la limite
+    promoted = await storage.write(_db_set_capacity_sync, msg_id_int, capacity)
+    if promoted is None:
+        await interaction.followup.send("Événement non trouvé dans la BDD.", ephemeral=True); return
+    # Après l'écriture, même si l'événement n'était pas en cache : les prochains clics passent par la transaction
+    _, end_ts, is_cancelled, _ = await storage.read(_get_event_state_sync, msg_id_int)
+    event_state_cache.set(msg_id_int, end_ts, is_cancelled, capacity)
+    index = attendance_indexes.peek(msg_id_int)
+    if index is not None:
+        apply_promotions(index, promoted)
+    if promoted:
+        asyncio.create_task(notify_promoted(msg_id_int, promoted))
+    print(f"Places : Événement {msg_id_int} limité à {capacity} par {interaction.user.name} ({len(promoted)} promu·e(s)).")
 
-# ====================================================================
-# 6. TÂCHES PLANIFIÉES (NETTOYAGE & RAPPELS)
-# ====================================================================
+    event = await get_event(msg_id_int)
+    try:
+        channel = await resolve_channel(event["channel_id"])
+        message = await channel.fetch_message(msg_id_int)
+        get_roster_coalescer(msg_id_int).mark_dirty(message, TrainingView())
+    except Exception as e: print(f"Erreur édition message (places): {e}")
 
-# MODIFIÉ : Fonctions BDD pour les tâches
-def _db_cleanup_get_events_sync():
-    """Récupère tous les événements pour la tâche de nettoyage."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
-    cursor = conn.cursor()
-    # AJOUT : Récupère duration_hours
-    cursor.execute("SELECT message_id, thread_id, event_date, event_time, details, target_group, channel_id, keep_thread, recurrence_type, duration_hours FROM events")
-    all_events = cursor.fetchall()
-    conn.close()
-    return all_events
+    limit = f"{capacity} place(s)" if capacity else "places illimitées"
+    more = f" {len(promoted)} membre(s) de la liste d'attente inscrit·e·s et prévenu·e·s par MP." if promoted else ""
+    await interaction.followup.send(f"Succès ! L'événement {msg_id_int} : {limit}.{more}", ephemeral=True)
 
-def _db_cleanup_delete_event_sync(message_id):
-    """Supprime l'événement ET ses présences (Correction fuite BDD)."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM events WHERE message_id = ?", (message_id,))
-    # CORRECTION : Supprime aussi les présences associées
-    cursor.execute("DELETE FROM attendance WHERE message_id = ?", (message_id,))
-    conn.commit()
-    conn.close()
-    print(f"Nettoyage BDD : Événement {message_id} et présences supprimés.")
+# --- AJOUT : COMMANDE DE PRÉ-CRÉATION D'UNE SAISON ---
+@bot.tree.command(name="planifier_saison", description="[ADMIN] Pré-crée (ou liste) les prochaines séances d'une série récurrente.")
+@discord.app_commands.describe(
+    message_id="L'ID du message d'une séance de la série",
+    semaines="Fenêtre à couvrir, en semaines (défaut : 12)",
+    apercu="True = lister les dates sans rien publier"
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@instrumented("planifier_saison")
+async def planifier_saison(interaction: discord.Interaction, message_id: str, semaines: int = 12, apercu: bool = False):
+    await defer_interaction(interaction, ephemeral=True, thinking=True)
+    try: msg_id_int = int(message_id)
+    except ValueError:
+        await interaction.followup.send("Erreur : L'ID doit être un nombre.", ephemeral=True); return
+    event = await get_event(msg_id_int)
+    if event is None or event["series_id"] is None:
+        await interaction.followup.send("Événement non trouvé, ou non récurrent.", ephemeral=True); return
+    series = await get_series(event["series_id"])
+    if series is None or not series["is_active"]:
+        await interaction.followup.send("Cette série est terminée.", ephemeral=True); return
+    semaines = max(1, min(semaines, 52))
 
-@tasks.loop(hours=1)
-async def check_for_cleanup():
-    print(f"{datetime.datetime.now()}: Tâche de nettoyage : Vérification...")
-    
-    # MODIFIÉ : Appel BDD dans un thread
-    try:
-        all_events = await asyncio.to_thread(_db_cleanup_get_events_sync)
-    except Exception as e:
-        print(f"Erreur BDD (check_for_cleanup): {e}")
+    if apercu:
+        rule = RecurrenceRule.parse(series["rule"])
+        anchor = series_anchor(series)
+        now_local = datetime.datetime.now(anchor.tzinfo)
+        horizon_end = now_local + datetime.timedelta(weeks=semaines)
+        dates = []
+        for occurrence in rule.occurrences(anchor, now_local):
+            if occurrence > horizon_end or len(dates) >= SERIES_MAX_BATCH: break
+            dates.append(occurrence.strftime("%Y-%m-%d %H:%M"))
+        listing = "\n".join(f"• {d}" for d in dates) or "Aucune séance dans cette fenêtre."
+        await interaction.followup.send(f"**Série {series['series_id']}** — {rule.describe()}\n{listing}"[:2000], ephemeral=True)
         return
-        
-    if not all_events: return
-        
-    now_utc = datetime.datetime.now(datetime.timezone.utc)
-    now_local = datetime.datetime.now(FRENCH_TZ) # Pour la récurrence
-    
-    for event in all_events:
+
+    created = await extend_series(series["series_id"], horizon_days=semaines * 7)
+    print(f"Série {series['series_id']} : {len(created)} séance(s) pré-créée(s) par {interaction.user.name}")
+    if created:
+        await interaction.followup.send(f"Succès ! {len(created)} séance(s) publiée(s) : {', '.join(created)}"[:2000], ephemeral=True)
+    else:
+        await interaction.followup.send("Aucune nouvelle séance à publier dans cette fenêtre.", ephemeral=True)
+
+# --- AJOUT : IMPORT D'UNE SAISON (fichier CSV / JSON) ---
+# Tout le fichier est validé avant la moindre écriture, puis ses lignes sont enregistrées en
+# une transaction (import_jobs / import_rows). Les séances sont ensuite publiées une à une,
+# à rythme fixe et en dernière priorité ; chaque séance est enregistrée avec sa ligne d'import
+# dans une même transaction. Après un arrêt, la publication reprend à la première ligne
+# non publiée.
+IMPORT_MAX_BYTES = 512 * 1024
+IMPORT_MAX_ROWS = 300
+IMPORT_POST_INTERVAL_SECONDS = 2.0 # Pause entre deux séances (chacune : message, fil, message du fil, mention)
+IMPORT_PROGRESS_EVERY = 5 # MP de progression mis à jour toutes les N séances
+IMPORT_COLUMNS = ("date", "heure", "details", "groupe", "duree", "garder_le_fil", "salon")
+IMPORT_TRUE = ("oui", "true", "vrai", "1", "yes")
+IMPORT_FALSE = ("non", "false", "faux", "0", "no", "")
+
+def parse_import_file(data, file_name):
+    """Lit un fichier d'import -> [dict] (colonnes en minuscules, valeurs en texte).
+
+    CSV avec ligne d'en-tête (séparateur `,` `;` ou tabulation), ou JSON : liste d'objets.
+    Lève ValueError si le fichier est illisible.
+    """
+    text = data.decode("utf-8-sig")
+    if file_name.lower().endswith(".json"):
+        records = json.loads(text)
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError("le JSON doit être une liste d'objets")
+    else:
+        try: dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;\t")
+        except csv.Error: dialect = csv.excel # Une seule colonne : rien à détecter
+        try: records = list(csv.DictReader(io.StringIO(text), dialect=dialect))
+        except csv.Error as e: raise ValueError(f"CSV illisible ({e})")
+    return [{str(key).strip().lower(): "" if value is None else str(value).strip()
+             for key, value in record.items() if key is not None} for record in records]
+
+def _resolve_import_channel(guild, value, default_channel):
+    value = value.strip("<#>")
+    if not value:
+        channel = default_channel
+    elif value.isdigit():
+        channel = guild.get_channel(int(value))
+    else:
+        channel = discord.utils.get(guild.text_channels, name=value.lower())
+    return channel if isinstance(channel, discord.TextChannel) else None
+
+def _resolve_import_group(guild, value):
+    """`Nom du rôle` ou `@Nom du rôle` -> mention du rôle ; mentions et autres textes inchangés."""
+    if not value or value.startswith("<"):
+        return value or None
+    role = discord.utils.find(lambda r: r.name.lower() == value.lstrip("@").lower(), guild.roles)
+    return role.mention if role else value
+
+def validate_import_rows(records, guild, default_channel, existing):
+    """Valide toutes les lignes. Retourne (lignes prêtes à enregistrer, erreurs « ligne N : ... »).
+
+    `existing` : {(salon, date, heure)} des événements déjà publiés (doublons refusés).
+    Les lignes sont numérotées à partir de 1, en-tête non compté.
+    """
+    errors = []
+    unknown = sorted(set().union(*records) - set(IMPORT_COLUMNS)) if records else []
+    if unknown:
+        errors.append(f"Colonne(s) inconnue(s) : {', '.join(unknown)} (attendu : {', '.join(IMPORT_COLUMNS)})")
+    if not records:
+        errors.append("Le fichier ne contient aucune séance.")
+    elif len(records) > IMPORT_MAX_ROWS:
+        errors.append(f"Trop de séances ({len(records)}) : {IMPORT_MAX_ROWS} au maximum par import.")
+    if errors:
+        return [], errors
+
+    tz = guild_settings.tz(guild.id)
+    now_local = datetime.datetime.now(tz)
+    rows, seen = [], set(existing)
+    for line, record in enumerate(records, start=1):
+        problems = []
         try:
-            message_id, thread_id, date, time, details, target_group, channel_id, keep_thread, recurrence_type, duration_hours = event
-            
-            if duration_hours is None: duration_hours = 2.0
-            
-            channel = bot.get_channel(channel_id)
-            if not channel: 
-                print(f"Nettoyage : Salon {channel_id} non trouvé, suppression BDD.")
-                # Si le salon n'existe plus, on nettoie
-                await asyncio.to_thread(_db_cleanup_delete_event_sync, message_id)
-                continue 
-                
-            naive_dt = datetime.datetime.fromisoformat(f"{date}T{time}")
-            event_start_local = naive_dt.replace(tzinfo=FRENCH_TZ)
-            event_start_utc = event_start_local.astimezone(datetime.timezone.utc)
-            
-            # MODIFIÉ : Utilise duration_hours pour le temps de fin
-            event_end_utc = event_start_utc + datetime.timedelta(hours=duration_hours)
-            cleanup_time_utc = event_end_utc + datetime.timedelta(hours=24) # Nettoyage 24h APRÈS la FIN
-            
-            if now_utc > cleanup_time_utc:
-                print(f"Nettoyage : Événement {message_id} terminé. Nettoyage...")
-                next_local_dt = None
-                
-                # --- Récurrence (CORRIGÉ : Gestion du "rattrapage") ---
-                if recurrence_type == 'weekly': 
-                    next_local_dt = event_start_local + datetime.timedelta(weeks=1)
-                    # CORRECTION : Boucle while pour rattraper les dates passées
-                    while next_local_dt < now_local:
-                        print(f"Rattrapage récurrence (Hebdo) {message_id}: {next_local_dt} est passé. Recalcul...")
-                        next_local_dt = next_local_dt + datetime.timedelta(weeks=1)
-                        
-                elif recurrence_type == 'monthly': 
-                    next_local_dt = event_start_local + relativedelta(months=1)
-                    # CORRECTION : Boucle while pour rattraper les dates passées
-                    while next_local_dt < now_local:
-                        print(f"Rattrapage récurrence (Mensuel) {message_id}: {next_local_dt} est passé. Recalcul...")
-                        next_local_dt = next_local_dt + relativedelta(months=1)
-                        
-                if next_local_dt:
-                    # Si on a trouvé une date future valide
-                    next_date_str = next_local_dt.strftime("%Y-%m-%d")
-                    next_time_str = next_local_dt.strftime("%H:%M:%S")
-                    
-                    if not keep_thread:
-                        print(f"Nettoyage : Purge anciens messages bot dans {channel.id}...")
-                        def is_bot_message(m): return m.author == bot.user
-                        try: await channel.purge(limit=100, check=is_bot_message, bulk=False)
-                        except Exception as e: print(f"Erreur purge : {e}")
-                        
-                    print(f"Nettoyage : Création prochain événement récurrent ({recurrence_type})...")
-                    # MODIFIÉ : Passe duration_hours au prochain événement
-                    await create_event_post(next_date_str, next_time_str, details, recurrence_type, target_group, channel, bool(keep_thread), duration_hours)
-
-                # --- Rapport Final ---
-                summary = await get_attendance_summary(message_id) # Appel async BDD
-                summary_embed = discord.Embed(title=f"✅ Rapport final {date}", description="Événement terminé.", color=discord.Color.dark_grey())
-                coming_list = "\n".join([f"• {name}" for name, user_id in summary["coming"]]) or "Personne"
-                maybe_list = "\n".join([f"• {name}" for name, user_id in summary["maybe"]]) or "Personne"
-                not_coming_list = "\n".join([f"• {name}" for name, user_id in summary["not_coming"]]) or "Personne"
-                summary_embed.add_field(name="✅ Présent·e·s", value=coming_list, inline=False)
-                summary_embed.add_field(name="❓ Indécis·e·s", value=maybe_list, inline=False)
-                summary_embed.add_field(name="❌ Absent·e·s", value=not_coming_list, inline=False)
-
-                # --- Nettoyage Discord ---
-                if keep_thread:
-                    try:
-                        thread = bot.get_channel(thread_id) or await bot.fetch_channel(thread_id)
-                        await thread.send(embed=summary_embed); await thread.send("Événement terminé. Fil archivé.")
-                    except Exception: pass
-                    try:
-                        message = await channel.fetch_message(message_id)
-                        await message.edit(embed=summary_embed, view=None) 
-                    except Exception: pass
+            start = datetime.datetime.combine(datetime.date.fromisoformat(record.get("date", "")),
+                                              datetime.time.fromisoformat(record.get("heure", "")), tz)
+            if start <= now_local:
+                problems.append("date passée")
+        except ValueError:
+            start = None
+            problems.append("date (AAAA-MM-JJ) ou heure (HH:MM) invalide")
+        details = record.get("details", "")
+        if not details:
+            problems.append("détails manquants")
+        try:
+            duration = float(record["duree"].replace(",", ".")) if record.get("duree") else guild_settings.default_duration(guild.id)
+            if not 0 < duration <= 24:
+                problems.append("durée hors de ]0, 24] h")
+        except ValueError:
+            problems.append(f"durée illisible ({record['duree']})")
+        keep_thread = record.get("garder_le_fil", "").lower()
+        if keep_thread not in IMPORT_TRUE + IMPORT_FALSE:
+            problems.append(f"garder_le_fil doit valoir oui ou non ({record['garder_le_fil']})")
+        channel = _resolve_import_channel(guild, record.get("salon", ""), default_channel)
+        if channel is None:
+            problems.append(f"salon introuvable ({record.get('salon') or 'salon par défaut : pas un salon textuel'})")
+        if start and channel:
+            key = (channel.id, start.strftime("%Y-%m-%d"), start.strftime("%H:%M:%S"))
+            if key in seen:
+                problems.append("séance en double (même salon, date et heure)")
+            seen.add(key)
+        if problems:
+            errors.append(f"Ligne {line} : {', '.join(problems)}")
+            continue
+        rows.append((channel.id, start.strftime("%Y-%m-%d"), start.strftime("%H:%M:%S"), details,
+                     _resolve_import_group(guild, record.get("groupe", "")), int(keep_thread in IMPORT_TRUE), duration))
+    return rows, errors
+
+def _db_get_event_slots_sync(conn, guild_id):
+    return {tuple(row) for row in conn.execute(
+        "SELECT channel_id, event_date, event_time FROM events WHERE guild_id = ?", (guild_id,))}
+
+def _db_create_import_job_sync(conn, guild_id, user_id, file_name, rows):
+    """Enregistre l'import et toutes ses lignes (une seule transaction). Retourne l'ID de l'import."""
+    job_id = conn.execute('''
+        INSERT INTO import_jobs (guild_id, user_id, file_name, total, created_utc) VALUES (?, ?, ?, ?, ?)
+    ''', (guild_id, user_id, file_name, len(rows), int(time.time()))).lastrowid
+    conn.executemany('''
+        INSERT INTO import_rows (job_id, row_no, channel_id, event_date, event_time, details,
+                                 target_group, keep_thread, duration_hours)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(job_id, row_no, *row) for row_no, row in enumerate(rows, start=1)])
+    return job_id
+
+def _db_get_import_job_sync(conn, job_id):
+    """L'import, ses compteurs et ses lignes restant à publier."""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    job = cursor.execute('''
+        SELECT j.*, SUM(r.state = 'posted') AS posted, SUM(r.state = 'failed') AS failed
+        FROM import_jobs j JOIN import_rows r ON r.job_id = j.job_id
+        WHERE j.job_id = ? GROUP BY j.job_id
+    ''', (job_id,)).fetchone()
+    rows = cursor.execute(
+        "SELECT * FROM import_rows WHERE job_id = ? AND state IN ('pending', 'posting') ORDER BY row_no", (job_id,)
+    ).fetchall()
+    return job, rows
+
+def _db_get_running_imports_sync(conn):
+    return [row[0] for row in conn.execute("SELECT job_id FROM import_jobs WHERE status = 'running' ORDER BY job_id")]
+
+def _db_set_import_row_state_sync(conn, job_id, row_no, state, error=None):
+    conn.execute("UPDATE import_rows SET state = ?, error = ?, updated_utc = ? WHERE job_id = ? AND row_no = ?",
+                 (state, error, int(time.time()), job_id, row_no))
+
+def _db_commit_import_row_sync(conn, row, message_id, thread_id, tracked, guild_id):
+    """Enregistre la séance publiée et marque sa ligne d'import, dans la même transaction."""
+    _db_insert_event_sync(conn, message_id, thread_id, row["channel_id"], row["event_date"], row["event_time"],
+                          row["details"], 'none', row["target_group"], bool(row["keep_thread"]), row["duration_hours"],
+                          tracked_messages=tracked, guild_id=guild_id)
+    conn.execute('''
+        UPDATE import_rows SET state = 'posted', message_id = ?, error = NULL, updated_utc = ?
+        WHERE job_id = ? AND row_no = ?
+    ''', (message_id, int(time.time()), row["job_id"], row["row_no"]))
+
+def _db_finish_import_job_sync(conn, job_id):
+    conn.execute("UPDATE import_jobs SET status = 'done', finished_utc = ? WHERE job_id = ?", (int(time.time()), job_id))
+    return conn.execute("SELECT row_no, error FROM import_rows WHERE job_id = ? AND state = 'failed' ORDER BY row_no",
+                        (job_id,)).fetchall()
+
+async def discard_interrupted_import_post(channel, row):
+    """Ligne restée « posting » après un arrêt : retire la publication orpheline éventuelle.
+
+    Le message a pu partir sans que la BDD ne l'enregistre. On cherche, parmi les messages du
+    bot publiés depuis le début de la tentative, ceux de cette séance (embed ou mention).
+    """
+    after = discord.Object(id=discord.utils.time_snowflake(
+        datetime.datetime.fromtimestamp(row["updated_utc"] - 5, datetime.timezone.utc)))
+    orphans = []
+    try:
+        async for message in channel.history(limit=50, after=after):
+            if message.author.id != bot.user.id:
+                continue
+            title = message.embeds[0].title if message.embeds else None
+            if title == f"📅 Entraînement : {row['event_date']}" or (
+                    message.content.startswith("Nouvel entraînement publié !") and f"({row['event_date']} @ {row['event_time']}" in message.content):
+                orphans.append(message.id)
+    except discord.HTTPException as e:
+        print(f"Import {row['job_id']} : Historique de {channel.id} illisible ({e}), pas de vérification des doublons.")
+        return
+    for message_id in orphans:
+        try: # Un fil ouvert sur un message porte son ID ; le cache peut l'ignorer, on le demande à l'API
+            await (await bot.fetch_channel(message_id)).delete()
+        except discord.NotFound: pass
+        except discord.HTTPException as e:
+            print(f"Import {row['job_id']} : Fil {message_id} non supprimé ({e}).")
+    if orphans:
+        print(f"Import {row['job_id']} : {len(orphans)} message(s) orphelin(s) retiré(s) (ligne {row['row_no']}).")
+        await delete_tracked_messages(channel, orphans)
+
+class SeasonImporter:
+    """Publie les imports enregistrés, un à la fois, et tient l'admin au courant par MP."""
+    def __init__(self):
+        self._queue = []
+        self._task = None
+        self.active_job = None
+
+    async def restore(self):
+        """Au démarrage : remet en file les imports interrompus."""
+        for job_id in await storage.read(_db_get_running_imports_sync):
+            self.submit(job_id, resumed=True)
+
+    def submit(self, job_id, resumed=False):
+        self._queue.append((job_id, resumed))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def pending(self):
+        return len(self._queue) + (self.active_job is not None)
+
+    async def _run(self):
+        if RUN_MODE != "worker": # restore() part de setup_hook : attendre READY pour que les salons soient en cache
+            await bot.wait_until_ready()
+        while self._queue:
+            job_id, resumed = self._queue.pop(0)
+            self.active_job = job_id
+            try:
+                await self._run_job(job_id, resumed)
+            except Exception as e:
+                print(f"Import {job_id} : Erreur inattendue ({e}), reprise au prochain démarrage.")
+            finally:
+                self.active_job = None
+
+    async def _run_job(self, job_id, resumed):
+        job, rows = await storage.read(_db_get_import_job_sync, job_id)
+        progress = {"posted": job["posted"] or 0, "failed": job["failed"] or 0, "dm": None}
+        await self._report(job, progress, "reprise après redémarrage" if resumed else "publication en cours")
+        for index, row in enumerate(rows):
+            outcome = await self._post_row(job, row)
+            progress[outcome] += 1
+            metrics.inc("import_rows_total", outcome=outcome)
+            if (index + 1) % IMPORT_PROGRESS_EVERY == 0:
+                await self._report(job, progress, "publication en cours")
+            if index + 1 < len(rows):
+                await asyncio.sleep(IMPORT_POST_INTERVAL_SECONDS)
+        failures = await storage.write(_db_finish_import_job_sync, job_id)
+        details = "".join(f"\n• ligne {row_no} : {error}" for row_no, error in failures[:10])
+        await self._report(job, progress, "terminé ✅" + details)
+        print(f"Import {job_id} : Terminé ({progress['posted']} publiée(s), {progress['failed']} en échec).")
+
+    async def _post_row(self, job, row):
+        """Publie une ligne. Retourne 'posted' ou 'failed'."""
+        channel = await resolve_channel(row["channel_id"])
+        if channel is None:
+            await storage.write(_db_set_import_row_state_sync, row["job_id"], row["row_no"], "failed", "salon introuvable")
+            return "failed"
+        if row["state"] == "posting":
+            await discard_interrupted_import_post(channel, row)
+        await storage.write(_db_set_import_row_state_sync, row["job_id"], row["row_no"], "posting")
+        with outbound_context(PRIORITY_IMPORT):
+            posted = await post_event_message(row["event_date"], row["event_time"], row["details"], None,
+                                              row["target_group"], channel, row["duration_hours"])
+            if posted is None:
+                await storage.write(_db_set_import_row_state_sync, row["job_id"], row["row_no"], "failed",
+                                    "publication refusée (permissions du bot ?)")
+                return "failed"
+            message, thread, tracked = posted
+            try:
+                await storage.write(_db_commit_import_row_sync, row, message.id, thread.id if thread else None,
+                                    tracked, job["guild_id"])
+            except Exception as e:
+                print(f"Import {row['job_id']} : ERREUR BDD ligne {row['row_no']} : {e}")
+                await discard_event_post(message, thread, tracked)
+                await storage.write(_db_set_import_row_state_sync, row["job_id"], row["row_no"], "failed", "erreur BDD")
+                return "failed"
+        event_state_cache.set(message.id, compute_event_end_ts(row["event_date"], row["event_time"], row["duration_hours"],
+                                                               guild_settings.tz(job["guild_id"])))
+        await reschedule_event(message.id)
+        return "posted"
+
+    async def _report(self, job, progress, state):
+        """Crée puis met à jour le MP de progression de l'admin (MPs fermés : on continue sans)."""
+        text = (f"📥 **Import n°{job['job_id']}** ({job['file_name']}) : {progress['posted']}/{job['total']} séance(s) publiée(s)"
+                + (f", {progress['failed']} en échec" if progress["failed"] else "") + f" — {state}")[:2000]
+        try:
+            with outbound_context(PRIORITY_DM):
+                if progress["dm"] is None:
+                    user = bot.get_user(job["user_id"]) or await bot.fetch_user(job["user_id"])
+                    progress["dm"] = await user.send(text)
+                elif progress["dm"]:
+                    await progress["dm"].edit(content=text)
+        except discord.HTTPException:
+            progress["dm"] = False
+
+season_importer = SeasonImporter()
+
+@bot.tree.command(name="importer_saison", description="[ADMIN] Publie toutes les séances d'un fichier CSV ou JSON.")
+@discord.app_commands.describe(
+    fichier=f"CSV (en-tête) ou JSON. Colonnes : {', '.join(IMPORT_COLUMNS)}",
+    salon="Salon des séances sans colonne `salon` (défaut : ce salon)"
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@discord.app_commands.guild_only()
+@instrumented("importer_saison")
+async def importer_saison(interaction: discord.Interaction, fichier: discord.Attachment, salon: discord.TextChannel = None):
+    await defer_interaction(interaction, ephemeral=True, thinking=True)
+    if fichier.size > IMPORT_MAX_BYTES:
+        await interaction.followup.send(f"Fichier trop volumineux (max {IMPORT_MAX_BYTES // 1024} Ko).", ephemeral=True); return
+    try:
+        records = parse_import_file(await fichier.read(), fichier.filename)
+    except (ValueError, discord.HTTPException) as e:
+        await interaction.followup.send(f"Fichier illisible : {e}", ephemeral=True); return
+
+    guild = interaction.guild
+    existing = await storage.read(_db_get_event_slots_sync, guild.id)
+    rows, errors = validate_import_rows(records, guild, salon or interaction.channel, existing)
+    if errors:
+        listing = "\n".join(f"• {error}" for error in errors[:20])
+        more = f"\n… et {len(errors) - 20} autre(s)." if len(errors) > 20 else ""
+        await interaction.followup.send(f"❌ **Import refusé**, rien n'a été publié :\n{listing}{more}"[:2000], ephemeral=True)
+        return
+
+    job_id = await storage.write(_db_create_import_job_sync, guild.id, interaction.user.id, fichier.filename, rows)
+    waiting = season_importer.pending()
+    season_importer.submit(job_id)
+    print(f"Import {job_id} : {len(rows)} séance(s) validée(s) par {interaction.user.name}.")
+    await interaction.followup.send(
+        f"✅ {len(rows)} séance(s) validée(s) (import n°{job_id}). Publication progressive en cours"
+        + (f", après {waiting} import(s) en attente" if waiting else "") + " : suivi par MP.", ephemeral=True)
+
+# --- AJOUT : EXPORT DES PRÉSENCES (aussi en ligne de commande : python bot.py export) ---
+# Les lignes (événement x réponse, archives puis événements en cours) sont lues par lots de
+# EXPORT_CHUNK_ROWS sur un curseur SQLite et compressées (gzip) au fil de l'eau : la mémoire
+# reste constante quelle que soit la taille de l'historique.
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_COLUMNS = ("message_id", "guild_id", "channel_id", "event_date", "event_time", "details", "duration_hours",
+                  "is_cancelled", "archived", "user_id", "user_name", "status")
+
+def _db_export_attendance_sync(conn, fileobj, fmt, guild_id=None, channel_id=None, user_id=None, since=None, until=None):
+    """Écrit l'export gzip dans `fileobj` (fichier binaire). Filtres optionnels ; dates AAAA-MM-JJ incluses.
+
+    Retourne le nombre de lignes exportées. Les événements sans réponse sortent sur une
+    ligne aux colonnes de réponse vides (sauf filtre par membre).
+    """
+    clauses, params = [], []
+    for condition, value in (("e.guild_id = ?", guild_id), ("e.channel_id = ?", channel_id), ("a.user_id = ?", user_id),
+                             ("e.event_date >= ?", since), ("e.event_date <= ?", until)):
+        if value is not None:
+            clauses.append(condition)
+            params.append(value)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as compressed, \
+            io.TextIOWrapper(compressed, encoding="utf-8", newline="") as out:
+        writer = csv.writer(out) if fmt == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+        for events_table, attendance_table, archived in (("events_archive", "attendance_archive", 1), ("events", "attendance", 0)):
+            cursor = conn.execute(f'''
+            SELECT e.message_id, e.guild_id, e.channel_id, e.event_date, e.event_time, e.details, e.duration_hours,
+                   e.is_cancelled, {archived}, a.user_id, a.user_name, a.status
+            FROM {events_table} e LEFT JOIN {attendance_table} a ON a.message_id = e.message_id
+            {where} ORDER BY e.start_utc, e.message_id
+            ''', params)
+            while rows := cursor.fetchmany(EXPORT_CHUNK_ROWS):
+                if writer:
+                    writer.writerows(rows)
                 else:
-                    try:
-                        thread = bot.get_channel(thread_id) or await bot.fetch_channel(thread_id)
-                        await thread.send(embed=summary_embed); await thread.send("Fil supprimé.")
-                        await thread.delete()
-                    except Exception: pass
-                    try:
-                        message = await channel.fetch_message(message_id)
-                        await message.delete() 
-                    except Exception: pass
-
-                # --- Suppression BDD (MODIFIÉ : Appel BDD dans thread) ---
-                # Utilise la nouvelle fonction qui nettoie les deux tables
-                await asyncio.to_thread(_db_cleanup_delete_event_sync, message_id)
-                
+                    out.write("".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows))
+                count += len(rows)
+    return count
+
+@bot.tree.command(name="exporter_presences", description="[ADMIN] Exporte l'historique des présences (CSV ou JSON Lines, compressé).")
+@discord.app_commands.describe(
+    format="csv (tableur) ou jsonl (une ligne JSON par réponse)",
+    depuis="Date de début incluse (AAAA-MM-JJ)", jusqu_au="Date de fin incluse (AAAA-MM-JJ)",
+    salon="Seulement les événements de ce salon", membre="Seulement les réponses de ce·tte membre"
+)
+@discord.app_commands.choices(format=[discord.app_commands.Choice(name=fmt, value=fmt) for fmt in EXPORT_FORMATS])
+@discord.app_commands.checks.has_permissions(administrator=True)
+@discord.app_commands.guild_only()
+@instrumented("exporter_presences")
+async def exporter_presences(interaction: discord.Interaction, format: str = "csv", depuis: str = None, jusqu_au: str = None,
+                             salon: discord.TextChannel = None, membre: discord.Member = None):
+    try:
+        for value in (depuis, jusqu_au):
+            if value: datetime.date.fromisoformat(value)
+    except ValueError:
+        await interaction.response.send_message("Erreur : Dates au format AAAA-MM-JJ.", ephemeral=True); return
+    await defer_interaction(interaction, ephemeral=True, thinking=True)
+    guild = interaction.guild
+    with tempfile.TemporaryFile() as export_file:
+        count = await storage.read(_db_export_attendance_sync, export_file, format, guild.id,
+                                   salon.id if salon else None, membre.id if membre else None, depuis, jusqu_au)
+        size = export_file.tell()
+        if size > guild.filesize_limit:
+            await interaction.followup.send(
+                f"Export trop volumineux pour Discord ({size // 1024} Ko compressés). Réduisez la période, "
+                "ou lancez `python bot.py export` sur le serveur du bot.", ephemeral=True)
+            return
+        export_file.seek(0)
+        file_name = f"presences_{guild.id}_{datetime.date.today().isoformat()}.{format}.gz"
+        await interaction.followup.send(f"📦 {count} ligne(s) exportée(s).", file=discord.File(export_file, filename=file_name),
+                                        ephemeral=True)
+    print(f"Export : {count} ligne(s) pour le serveur {guild.id} par {interaction.user.name}.")
+
+# --- AJOUT : RÉGLAGES DU SERVEUR ---
+@bot.tree.command(name="parametres_serveur", description="[ADMIN] Fuseau horaire et durée par défaut des entraînements de ce serveur.")
+@discord.app_commands.describe(
+    fuseau="Fuseau horaire IANA, ex: Europe/Paris, America/Montreal",
+    duree_defaut="Durée par défaut des entraînements, en heures"
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@discord.app_commands.guild_only()
+@instrumented("parametres_serveur")
+async def parametres_serveur(interaction: discord.Interaction, fuseau: str = None, duree_defaut: float = None):
+    guild_id = interaction.guild.id
+    if fuseau:
+        try: ZoneInfo(fuseau)
+        except (ZoneInfoNotFoundError, ValueError):
+            await interaction.response.send_message(f"Fuseau inconnu : `{fuseau}` (ex: `Europe/Paris`).", ephemeral=True); return
+    if duree_defaut is not None and not 0 < duree_defaut <= 24:
+        await interaction.response.send_message("La durée doit être comprise entre 0 et 24 heures.", ephemeral=True); return
+    if fuseau or duree_defaut is not None:
+        await storage.write(_db_set_guild_settings_sync, guild_id, fuseau, duree_defaut)
+        guild_settings.set(guild_id, fuseau, duree_defaut)
+        ipc_hub.broadcast({"op": "settings"}) # Mode gateway : le worker recharge les réglages
+        print(f"Réglages : Serveur {guild_id} mis à jour par {interaction.user.name} ({fuseau}, {duree_defaut}).")
+    await interaction.response.send_message(
+        f"Fuseau : **{guild_settings.tz(guild_id).key}** — Durée par défaut : **{guild_settings.default_duration(guild_id)} h**\n"
+        "(s'applique aux événements créés à partir de maintenant)", ephemeral=True)
+
+# --- AJOUT : RÈGLES DE RAPPEL PAR SALON / PAR ÉVÉNEMENT ---
+def _db_describe_reminder_rules_sync(conn, scope, scope_id):
+    """(origine, règles en vigueur, rappels à venir) pour un salon ou un événement ; None si l'événement est inconnu."""
+    if scope == "event":
+        row = conn.execute("SELECT channel_id FROM events WHERE message_id = ?", (scope_id,)).fetchone()
+        if row is None:
+            return None
+        message_id, channel_id = scope_id, row[0]
+    else:
+        message_id, channel_id = None, scope_id
+    origin = conn.execute('''
+        SELECT scope FROM reminder_rules WHERE (scope = 'event' AND scope_id = ?) OR (scope = 'channel' AND scope_id = ?)
+        ORDER BY scope = 'event' DESC LIMIT 1
+    ''', (message_id, channel_id)).fetchone()
+    upcoming = conn.execute("SELECT rule_key, due_at FROM reminders WHERE message_id = ? AND sent_at IS NULL ORDER BY due_at",
+                            (message_id,)).fetchall()
+    return (origin[0] if origin else "default"), _db_get_reminder_rules_sync(conn, message_id, channel_id), upcoming
+
+def _db_set_reminder_rules_sync(conn, scope, scope_id, rules):
+    """Enregistre (ou supprime si `rules` est None) les règles d'un salon ou d'un événement, puis
+    recrée les rappels non envoyés des événements à venir concernés. Retourne leurs message_id."""
+    if rules is None:
+        conn.execute("DELETE FROM reminder_rules WHERE scope = ? AND scope_id = ?", (scope, scope_id))
+    else:
+        conn.execute("REPLACE INTO reminder_rules (scope, scope_id, rules) VALUES (?, ?, ?)", (scope, scope_id, rules))
+    column = "message_id" if scope == "event" else "channel_id"
+    message_ids = [row[0] for row in conn.execute(
+        f"SELECT message_id FROM events WHERE {column} = ? AND start_utc > ? AND is_cancelled = 0", (scope_id, int(time.time())))]
+    for message_id in message_ids:
+        _db_materialize_reminders_sync(conn, message_id)
+    return message_ids
+
+@bot.tree.command(name="rappels", description="[ADMIN] Affiche ou modifie les rappels d'un salon ou d'un événement.")
+@discord.app_commands.describe(
+    regles="Ex: J-3:salon:groupe, H-24:fil:participants, H-2:mp:participants — « aucun » ou « defaut »",
+    message_id="Règles propres à cet événement (sinon : celles du salon)",
+    salon="Salon concerné (défaut : ce salon)"
+)
+@discord.app_commands.checks.has_permissions(administrator=True)
+@discord.app_commands.guild_only()
+@instrumented("rappels")
+async def rappels(interaction: discord.Interaction, regles: str = None, message_id: str = None, salon: discord.TextChannel = None):
+    if message_id is not None:
+        try: scope, scope_id = "event", int(message_id)
+        except ValueError:
+            await interaction.response.send_message("Erreur : L'ID doit être un nombre.", ephemeral=True); return
+        target = f"l'événement {scope_id}"
+    else:
+        channel = salon or interaction.channel
+        scope, scope_id, target = "channel", channel.id, channel.mention
+
+    if regles is not None:
+        rules = None if regles.strip().lower() in ("defaut", "défaut") else regles
+        try:
+            if rules is not None:
+                rules = ", ".join(str(rule) for rule in ReminderRule.parse_list(rules)) or "aucun"
+        except ValueError as e:
+            await interaction.response.send_message(f"Règle invalide : {e}", ephemeral=True); return
+        await defer_interaction(interaction, ephemeral=True, thinking=True)
+        if scope == "event" and await storage.read(_db_describe_reminder_rules_sync, scope, scope_id) is None:
+            await interaction.followup.send("Événement non trouvé dans la BDD.", ephemeral=True); return
+        message_ids = await storage.write(_db_set_reminder_rules_sync, scope, scope_id, rules)
+        for event_id in message_ids:
+            await reschedule_event(event_id)
+        print(f"Rappels : Règles de {scope} {scope_id} mises à jour par {interaction.user.name} ({rules or 'défaut'}).")
+    else:
+        await defer_interaction(interaction, ephemeral=True, thinking=True)
+
+    described = await storage.read(_db_describe_reminder_rules_sync, scope, scope_id)
+    if described is None:
+        await interaction.followup.send("Événement non trouvé dans la BDD.", ephemeral=True); return
+    origin, rules, upcoming = described
+    origins = {"event": "propres à l'événement", "channel": "du salon", "default": "par défaut"}
+    lines = [f"• `{rule}` — {rule.describe()}" for rule in rules] or ["• Aucun rappel"]
+    embed = discord.Embed(title=f"🔔 Rappels de {target}" if scope == "channel" else "🔔 Rappels de l'événement",
+                          description=f"Règles {origins[origin]} :\n" + "\n".join(lines), color=discord.Color.blue())
+    if upcoming:
+        embed.add_field(name="Prochains envois", value="\n".join(f"`{key}` <t:{due}:R>" for key, due in upcoming[:10]), inline=False)
+    if regles is not None and scope == "channel":
+        embed.set_footer(text=f"{len(message_ids)} événement(s) à venir mis à jour")
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+# --- AJOUT : STATISTIQUES DE PRÉSENCE (agrégats précalculés à l'archivage) ---
+def _rate(part, total):
+    return f"{100 * part / total:.0f} %" if total else "—"
+
+@bot.tree.command(name="stats_membre", description="Historique de présence d'un·e membre (événements terminés).")
+@discord.app_commands.describe(membre="Membre (par défaut : vous)")
+@discord.app_commands.guild_only()
+@instrumented("stats_membre")
+async def stats_membre(interaction: discord.Interaction, membre: discord.Member = None):
+    membre = membre or interaction.user
+    row = await storage.read(_db_get_member_stats_sync, interaction.guild.id, membre.id)
+    if row is None or not row["responses"]:
+        await interaction.response.send_message(f"Aucun événement terminé pour {membre.display_name}.", ephemeral=True); return
+    embed = discord.Embed(title=f"📈 Présences de {membre.display_name}", color=discord.Color.teal())
+    embed.add_field(name="✅ Présent·e", value=f"{row['coming']} ({_rate(row['coming'], row['responses'])})", inline=True)
+    embed.add_field(name="❓ Indécis·e", value=f"{row['maybe']} ({_rate(row['maybe'], row['responses'])})", inline=True)
+    embed.add_field(name="❌ Absent·e", value=f"{row['not_coming']} ({_rate(row['not_coming'], row['responses'])})", inline=True)
+    embed.add_field(name="🔥 Série en cours", value=f"{row['current_streak']} (record : {row['best_streak']})", inline=False)
+    embed.set_footer(text=f"{row['responses']} réponse(s) à des événements terminés")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@bot.tree.command(name="stats_serie", description="Fréquentation d'une série récurrente (événements terminés).")
+@discord.app_commands.describe(message_id="L'ID du message d'une séance de la série (en cours ou passée)")
+@instrumented("stats_serie")
+async def stats_serie(interaction: discord.Interaction, message_id: str):
+    try: msg_id_int = int(message_id)
+    except ValueError:
+        await interaction.response.send_message("Erreur : L'ID doit être un nombre.", ephemeral=True); return
+    row = await storage.read(_db_get_series_stats_sync, msg_id_int)
+    if row is None:
+        await interaction.response.send_message("Événement non trouvé, ou non récurrent.", ephemeral=True); return
+    events = row["events"] or 0
+    embed = discord.Embed(title=f"📊 Série {row['series_id']} — {RecurrenceRule.parse(row['rule']).describe()}",
+                          description="Série active" if row["is_active"] else "Série terminée", color=discord.Color.teal())
+    if events:
+        embed.add_field(name="Séances terminées", value=str(events), inline=True)
+        embed.add_field(name="Présent·e·s en moyenne", value=f"{row['coming'] / events:.1f} (record : {row['best_turnout']})", inline=True)
+        embed.add_field(name="Taux d'indécis·e·s", value=_rate(row["maybe"], row["responses"]), inline=True)
+        embed.add_field(name="Taux d'absences", value=_rate(row["not_coming"], row["responses"]), inline=True)
+    else:
+        embed.add_field(name="Séances terminées", value="Aucune pour l'instant.", inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# --- COMMANDE DE STATISTIQUES D'EXÉCUTION ---
+def _stats_block(metric_name, label_key, limit=8):
+    """Lignes « label : n, p50, p99 » des séries d'un histogramme, triées par temps cumulé."""
+    series = sorted(metrics.series(metric_name), key=lambda item: item[1].total, reverse=True)[:limit]
+    lines = [
+        f"`{labels.get(label_key, '—')}` : {h.count}× — p50 {h.quantile(0.5) * 1000:.0f} ms, p99 {h.quantile(0.99) * 1000:.0f} ms"
+        for labels, h in series
+    ]
+    return ("\n".join(lines) or "— Aucune mesure —")[:1024]
+
+@bot.tree.command(name="stats", description="[ADMIN] Statistiques d'exécution du bot (latences, BDD, API).")
+@discord.app_commands.checks.has_permissions(administrator=True)
+@instrumented("stats")
+async def stats(interaction: discord.Interaction):
+    embed = discord.Embed(title="📊 Statistiques d'exécution", color=discord.Color.blurple())
+    embed.add_field(name="Commandes et boutons", value=_stats_block("handler_seconds", "handler"), inline=False)
+    defer_series = metrics.series("interaction_defer_seconds")
+    if defer_series:
+        h = defer_series[0][1]
+        embed.add_field(name="Defer des interactions", value=f"{h.count}× — p50 {h.quantile(0.5) * 1000:.0f} ms, p99 {h.quantile(0.99) * 1000:.0f} ms", inline=False)
+    embed.add_field(name="BDD (par temps cumulé)", value=_stats_block("db_seconds", "helper"), inline=False)
+    rest_calls = sum(h.count for _, h in metrics.series("discord_rest_seconds"))
+    rate_limited = metrics.counter_total("discord_rest_429_total")
+    embed.add_field(name=f"API Discord : {rest_calls} appels, {rate_limited} × 429", value=_stats_block("discord_rest_seconds", "route", 5), inline=False)
+    embed.add_field(name="Ordonnanceur", value=(
+        f"{len(event_scheduler)} action(s) programmée(s), arriéré : {event_scheduler.overdue()}\n"
+        f"RSVP en attente d'écriture : {len(attendance_writer)}\n" + _stats_block("scheduler_action_seconds", "action", 4)
+    )[:1024], inline=False)
+    uptime = datetime.timedelta(seconds=int(time.time() - metrics.started_at))
+    embed.set_footer(text=f"En ligne depuis {uptime}")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# --- GESTION DES ERREURS ---
+@bot.event
+async def on_tree_error(interaction: discord.Interaction, error: discord.app_commands.AppCommandError):
+    if isinstance(error, discord.app_commands.MissingPermissions):
+        await interaction.response.send_message("Erreur : Permissions (Admin) insuffisantes.", ephemeral=True)
+    else:
+        print(f"Erreur commande non gérée : {error}")
+        error_msg = f"Une erreur inattendue est survenue."
+        try: 
+            if interaction.response.is_done():
+                await interaction.followup.send(error_msg, ephemeral=True)
+            else:
+                await interaction.response.send_message(error_msg, ephemeral=True)
         except Exception as e:
-            print(f"Erreur MAJEURE boucle nettoyage (event {message_id}): {e}") 
+            print(f"Impossible d'envoyer un message d'erreur à l'utilisateur : {e}")
 
-# MODIFIÉ : Fonctions BDD pour les tâches de rappel
-def _db_reminders_get_events_sync():
-    """Récupère les événements pour les rappels."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
+
+# ====================================================================
+# 6. TÂCHES PLANIFIÉES (NETTOYAGE & RAPPELS)
+# ====================================================================
+
+# MODIFIÉ : Les boucles horaires sont remplacées par un ordonnanceur à échéances
+CLEANUP_DELAY_SECONDS = 24 * 3600 # Nettoyage 24h APRÈS la FIN de l'événement
+ACTION_RETRY_SECONDS = 300 # Nouvel essai d'une action en erreur (l'ancienne boucle réessayait à l'heure suivante)
+ACTION_CLAIM_TTL_SECONDS = 15 * 60 # Réservation plus ancienne : l'instance est considérée morte (reprise possible)
+SCHEDULER_MAX_SLEEP = 3600 # Réveil de sécurité de l'ordonnanceur (ex: horloge système modifiée)
+SCHEDULER_GUILD_CONCURRENCY = 4 # Actions simultanées max par serveur (un gros serveur ne monopolise pas les MPs / l'API)
+
+EVENT_COLUMNS = """message_id, thread_id, channel_id, event_date, event_time, details, target_group,
+    keep_thread, recurrence_type, duration_hours, is_cancelled,
+    start_utc, end_utc, series_id, guild_id, capacity"""
+
+def _db_get_event_sync(conn, message_id):
+    """Récupère un événement complet (sqlite3.Row) ou None."""
     cursor = conn.cursor()
-    # AJOUT : Récupère duration_hours
-    cursor.execute("SELECT message_id, thread_id, event_date, event_time, details, target_group, channel_id, reminder_3d_sent, reminder_24h_sent, reminder_dm_sent, duration_hours FROM events WHERE is_cancelled = 0")
-    all_events = cursor.fetchall()
-    conn.close()
-    return all_events
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(f"SELECT {EVENT_COLUMNS} FROM events WHERE message_id = ?", (message_id,)).fetchone()
 
-def _db_reminders_update_sent_sync(message_id, flag_name):
-    """Marque un rappel comme envoyé (ex: 'reminder_3d_sent')."""
-    conn = sqlite3.connect(DB_NAME, timeout=DB_TIMEOUT)
+def _db_get_all_events_sync(conn):
+    """Récupère tous les événements (reconstruction de l'ordonnanceur au démarrage)."""
     cursor = conn.cursor()
-    # Utilisation de f-string sécurisée car flag_name vient de notre propre code
-    cursor.execute(f"UPDATE events SET {flag_name} = 1 WHERE message_id = ?", (message_id,))
-    conn.commit()
-    conn.close()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(f"SELECT {EVENT_COLUMNS} FROM events").fetchall()
 
-@tasks.loop(hours=1) 
-async def check_reminders():
-    print(f"{datetime.datetime.now()}: Tâche de rappel : Vérification...")
-    
-    # MODIFIÉ : Appel BDD dans un thread
+# --- AJOUT : Archives et agrégats (historique conservé après le nettoyage) ---
+def _db_archive_event_sync(conn, message_id, reason, now_ts):
+    """Déplace l'événement et ses présences vers les archives, et met à jour les agrégats.
+
+    Les agrégats (par membre et par série) ne comptent que les événements terminés et non
+    annulés, une seule fois : un événement déjà archivé n'est pas recompté.
+    Retourne True si l'événement existait.
+    """
+    event = conn.execute('''
+        SELECT guild_id, series_id, end_utc, is_cancelled FROM events WHERE message_id = ?
+    ''', (message_id,)).fetchone()
+    if event is None:
+        return False
+    guild_id, series_id, end_ts, is_cancelled = event
+    guild_key = guild_id or 0 # Événements antérieurs au multi-serveur
+    archived = conn.execute('''
+        INSERT OR IGNORE INTO events_archive (message_id, guild_id, channel_id, series_id, event_date, event_time,
+                                              details, duration_hours, start_utc, end_utc, is_cancelled,
+                                              archive_reason, archived_utc)
+        SELECT message_id, guild_id, channel_id, series_id, event_date, event_time, details, duration_hours,
+               start_utc, end_utc, is_cancelled, ?, ?
+        FROM events WHERE message_id = ?
+    ''', (reason, now_ts, message_id)).rowcount == 1
+    conn.execute('''
+        INSERT OR REPLACE INTO attendance_archive (message_id, user_id, user_name, status)
+        SELECT message_id, user_id, user_name, status FROM attendance WHERE message_id = ?
+    ''', (message_id,))
+    if archived and not is_cancelled and end_ts is not None and end_ts <= now_ts:
+        roster = conn.execute("SELECT user_id, user_name, status FROM attendance WHERE message_id = ? AND status != ?",
+                              (message_id, WAITLIST_STATUS)).fetchall() # Liste d'attente : pas une réponse
+        conn.executemany('''
+        INSERT INTO member_stats (guild_id, user_id, user_name, responses, coming, maybe, not_coming,
+                                  current_streak, best_streak, last_event_utc)
+        VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(guild_id, user_id) DO UPDATE SET
+            user_name = excluded.user_name,
+            responses = responses + 1,
+            coming = coming + excluded.coming,
+            maybe = maybe + excluded.maybe,
+            not_coming = not_coming + excluded.not_coming,
+            current_streak = CASE WHEN excluded.coming = 1 THEN current_streak + 1 ELSE 0 END,
+            best_streak = MAX(best_streak, CASE WHEN excluded.coming = 1 THEN current_streak + 1 ELSE 0 END),
+            last_event_utc = excluded.last_event_utc
+        ''', [(guild_key, user_id, user_name, int(status == "Coming"), int(status == "Maybe"), int(status == "Not Coming"),
+               int(status == "Coming"), int(status == "Coming"), end_ts) for user_id, user_name, status in roster])
+        if series_id is not None:
+            coming = sum(1 for _, _, status in roster if status == "Coming")
+            maybe = sum(1 for _, _, status in roster if status == "Maybe")
+            conn.execute('''
+            INSERT INTO series_stats (series_id, guild_id, events, responses, coming, maybe, not_coming, best_turnout, last_event_utc)
+            VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(series_id) DO UPDATE SET
+                events = events + 1,
+                responses = responses + excluded.responses,
+                coming = coming + excluded.coming,
+                maybe = maybe + excluded.maybe,
+                not_coming = not_coming + excluded.not_coming,
+                best_turnout = MAX(best_turnout, excluded.best_turnout),
+                last_event_utc = excluded.last_event_utc
+            ''', (series_id, guild_key, len(roster), coming, maybe, len(roster) - coming - maybe, coming, end_ts))
+    conn.execute("DELETE FROM events WHERE message_id = ?", (message_id,))
+    conn.execute("DELETE FROM attendance WHERE message_id = ?", (message_id,))
+    conn.execute("DELETE FROM reminders WHERE message_id = ?", (message_id,))
+    return True
+
+def _db_get_member_stats_sync(conn, guild_id, user_id):
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute("SELECT * FROM member_stats WHERE guild_id = ? AND user_id = ?", (guild_id or 0, user_id)).fetchone()
+
+def _db_get_series_stats_sync(conn, message_id):
+    """Agrégats de la série d'un événement (en cours ou archivé), avec la règle de la série."""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute('''
+    SELECT s.series_id, s.rule, s.is_active, st.events, st.responses, st.coming, st.maybe, st.not_coming,
+           st.best_turnout, st.last_event_utc
+    FROM series s LEFT JOIN series_stats st ON st.series_id = s.series_id
+    WHERE s.series_id = COALESCE((SELECT series_id FROM events WHERE message_id = ?),
+                                 (SELECT series_id FROM events_archive WHERE message_id = ?))
+    ''', (message_id, message_id)).fetchone()
+
+def _db_cleanup_delete_event_sync(conn, message_id):
+    """Archive l'événement et ses présences (agrégats compris), puis nettoie les tables de suivi."""
+    _db_archive_event_sync(conn, message_id, "cleanup", int(time.time()))
+    conn.execute("DELETE FROM bot_messages WHERE event_id = ?", (message_id,))
+    conn.execute("DELETE FROM action_claims WHERE message_id = ?", (message_id,))
+
+def _db_claim_action_sync(conn, message_id, action, holder, now_ts, lease_name):
+    """Réserve l'exécution d'une action (True si cette instance l'a obtenue).
+
+    La réservation d'une autre instance est reprise si elle a plus de ACTION_CLAIM_TTL_SECONDS
+    ou si son titulaire ne détient plus le bail de leader (processus arrêté en cours d'action).
+    """
+    cursor = conn.execute('''
+        INSERT INTO action_claims (message_id, action, holder, claimed_utc) VALUES (?, ?, ?, ?)
+        ON CONFLICT(message_id, action) DO UPDATE SET holder = excluded.holder, claimed_utc = excluded.claimed_utc
+        WHERE action_claims.holder != excluded.holder
+          AND (action_claims.claimed_utc < ? OR NOT EXISTS (
+                SELECT 1 FROM leases WHERE name = ? AND holder = action_claims.holder AND expires_utc >= ?))
+    ''', (message_id, action, holder, now_ts, now_ts - ACTION_CLAIM_TTL_SECONDS, lease_name, now_ts))
+    return cursor.rowcount == 1
+
+def _db_release_claim_sync(conn, message_id, action, holder):
+    """Libère une réservation après un échec (l'action pourra être réessayée)."""
+    conn.execute("DELETE FROM action_claims WHERE message_id = ? AND action = ? AND holder = ?", (message_id, action, holder))
+
+async def claim_action(message_id, action):
+    return await storage.write(_db_claim_action_sync, message_id, action, INSTANCE_ID, int(time.time()), "scheduler") # Bail du worker leader
+
+async def release_claim(message_id, action):
+    await storage.write(_db_release_claim_sync, message_id, action, INSTANCE_ID)
+
+# MODIFIÉ : Rappels lus dans la table `reminders` (index partiel sur due_at des rappels non envoyés)
+REMINDER_COLUMNS = "id, message_id, rule_key, target, audience, due_at, window_end"
+
+def _db_get_pending_reminders_sync(conn, message_id):
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(f"SELECT {REMINDER_COLUMNS} FROM reminders WHERE message_id = ? AND sent_at IS NULL",
+                          (message_id,)).fetchall()
+
+def _db_get_due_reminders_sync(conn, since_ts, until_ts):
+    """Rappels non envoyés dont l'échéance tombe dans [since_ts, until_ts) : un parcours de idx_reminders_due."""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor.execute(f"""
+        SELECT {REMINDER_COLUMNS} FROM reminders
+        WHERE sent_at IS NULL AND due_at >= ? AND due_at < ?
+    """, (since_ts, until_ts)).fetchall()
+
+def _db_mark_reminder_sent_sync(conn, reminder_id, sent_ts, outcome="sent"):
+    conn.execute("UPDATE reminders SET sent_at = ?, outcome = ? WHERE id = ? AND sent_at IS NULL", (sent_ts, outcome, reminder_id))
+
+async def get_event(message_id):
+    """Wrapper Asynchrone : Récupère un événement complet."""
+    return await storage.read(_db_get_event_sync, message_id)
+
+async def cleanup_delete_event(message_id):
+    """Wrapper Asynchrone : Archive l'événement et ses présences."""
+    await attendance_writer.flush() # Aucun RSVP en attente ne doit recréer de présences orphelines
+    await storage.write(_db_cleanup_delete_event_sync, message_id)
+    event_state_cache.discard(message_id)
+    discard_roster_coalescer(message_id)
+    attendance_indexes.discard(message_id)
+    event_scheduler.unschedule(message_id)
+    ipc_client.send({"op": "discard", "message_id": message_id}) # Worker : le gateway oublie ses caches
+    print(f"Nettoyage BDD : Événement {message_id} et présences archivés.")
+
+async def get_pending_reminders(message_id):
+    return await storage.read(_db_get_pending_reminders_sync, message_id)
+
+async def reminders_mark_sent(reminder_id, outcome="sent"):
+    """Wrapper Asynchrone : Marque un rappel comme traité (une seule ligne)."""
+    await storage.write(_db_mark_reminder_sent_sync, reminder_id, int(time.time()), outcome)
+
+# --- Envoi groupé des MPs ---
+DM_CONCURRENCY = 8 # Nombre max de MPs en cours d'envoi simultanément
+DM_RATE_PER_SECOND = 5.0 # Budget global d'envoi de MPs (tous événements confondus)
+
+dm_semaphore = asyncio.Semaphore(DM_CONCURRENCY)
+dm_rate_budget = RateBudget(DM_RATE_PER_SECOND)
+
+def percentile(values, fraction):
+    """Percentile simple (plus proche rang) d'une liste de valeurs, ou 0.0 si vide."""
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def resolve_user(user_id):
+    """Utilisateur depuis le cache de la passerelle, ou via l'API REST en dernier recours."""
+    return bot.get_user(user_id) or await bot.fetch_user(user_id)
+
+_fetched_channels = {} # channel_id -> salon lu via REST (worker : pas de cache de passerelle)
+
+async def resolve_channel(channel_id):
+    """Salon depuis le cache de la passerelle, sinon via REST (mis en cache). None s'il n'existe plus
+    ou n'est plus accessible ; les autres erreurs remontent (l'action sera réessayée)."""
+    channel = bot.get_channel(channel_id) or _fetched_channels.get(channel_id)
+    if channel is not None:
+        return channel
     try:
-        all_events = await asyncio.to_thread(_db_reminders_get_events_sync)
-    except Exception as e:
-        print(f"Erreur BDD (check_reminders): {e}")
+        channel = await bot.fetch_channel(channel_id)
+    except (discord.NotFound, discord.Forbidden):
+        return None
+    _fetched_channels[channel_id] = channel
+    return channel
+
+async def fan_out_dms(recipients, content=None, embed=None):
+    """Envoie le même MP à une liste [(nom, user_id)] en parallèle (sémaphore + budget global).
+
+    Retourne les statistiques de livraison : sent / forbidden / failed / latences (s).
+    """
+    stats = {"sent": 0, "forbidden": 0, "failed": 0, "latencies": []}
+
+    async def deliver(name, user_id):
+        async with dm_semaphore:
+            await dm_rate_budget.acquire()
+            started = time.monotonic()
+            try:
+                user = await resolve_user(user_id)
+                await user.send(content=content, embed=embed)
+                stats["sent"] += 1
+            except discord.Forbidden:
+                stats["forbidden"] += 1
+                print(f"Erreur MP : Impossible d'envoyer à {name} (MPs fermés).")
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"Erreur MP : Erreur inconnue (user {user_id}): {e}")
+            finally:
+                stats["latencies"].append(time.monotonic() - started)
+
+    await asyncio.gather(*(deliver(name, user_id) for name, user_id in recipients))
+    return stats
+
+def format_delivery_stats(stats):
+    latencies = stats["latencies"]
+    return (f"{stats['sent']} envoyé(s), {stats['forbidden']} MPs fermés, {stats['failed']} échec(s), "
+            f"latence p50 {percentile(latencies, 0.5) * 1000:.0f} ms / max {max(latencies, default=0) * 1000:.0f} ms")
+
+def event_action_windows(event, reminders):
+    """Actions restantes d'un événement : [(échéance, fin de fenêtre ou None, action)].
+
+    Les rappels non envoyés (lignes de `reminders`) ont pour action leur rule_key et gardent
+    la fenêtre calculée à leur création ; le nettoyage n'a pas de fin de fenêtre.
+    """
+    start_ts, end_ts = event["start_utc"], event["end_utc"]
+    if start_ts is None or end_ts is None:
+        return []
+    candidates = [] # (échéance, fin de fenêtre, action)
+    if not event["is_cancelled"]:
+        candidates.extend((r["due_at"], r["window_end"], r["rule_key"]) for r in reminders)
+    candidates.append((end_ts + CLEANUP_DELAY_SECONDS, None, "cleanup"))
+    return candidates
+
+def next_event_action(event, reminders, now_ts):
+    """Calcule la prochaine action d'un événement : (échéance en epoch UTC, action) ou None.
+
+    Un rappel dont la fenêtre est passée est ignoré ici (voir catch_up_missed_reminders).
+    """
+    pending = [(due, action) for due, window_end, action in event_action_windows(event, reminders)
+               if window_end is None or now_ts < window_end]
+    return min(pending) if pending else None
+
+class DeadlineScheduler:
+    """Ordonnanceur à échéances (file de priorité).
+
+    Garde la prochaine action due de chaque événement dans un tas et dort jusqu'à
+    l'échéance la plus proche. Les entrées remplacées ou retirées sont ignorées au
+    moment où elles sortent du tas (suppression paresseuse).
+    """
+    def __init__(self, runner, max_inflight=None):
+        self._runner = runner # coroutine runner(message_id, action)
+        self._max_inflight = max_inflight # None = pas de limite d'actions simultanées
+        self._heap = [] # (échéance, message_id, action)
+        self._entries = {} # message_id -> (échéance, action) en vigueur
+        self._wake = asyncio.Event()
+        self._task = None
+        self._inflight = set()
+
+    def schedule(self, message_id, due_ts, action):
+        entry = (due_ts, action)
+        if self._entries.get(message_id) == entry:
+            return
+        self._entries[message_id] = entry
+        heapq.heappush(self._heap, (due_ts, message_id, action))
+        if self._heap[0][1] == message_id:
+            self._wake.set() # Nouvelle échéance la plus proche : on se réveille pour la viser
+
+    def unschedule(self, message_id):
+        self._entries.pop(message_id, None)
+
+    def next_deadline(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def overdue(self):
+        """Nombre d'actions échues pas encore démarrées, plus celles en cours (arriéré)."""
+        now_ts = time.time()
+        return sum(1 for due_ts, _ in self._entries.values() if due_ts <= now_ts) + len(self._inflight)
+
+    def is_running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.is_running():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def _drop_stale(self):
+        while self._heap:
+            due_ts, message_id, action = self._heap[0]
+            if self._entries.get(message_id) == (due_ts, action):
+                return
+            heapq.heappop(self._heap)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            deadline = self.next_deadline()
+            delay = SCHEDULER_MAX_SLEEP if deadline is None else deadline - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=min(delay, SCHEDULER_MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self._max_inflight and len(self._inflight) >= self._max_inflight:
+                await asyncio.wait(set(self._inflight), return_when=asyncio.FIRST_COMPLETED)
+                continue # L'échéance la plus proche a pu changer entre-temps
+            due_ts, message_id, action = heapq.heappop(self._heap)
+            del self._entries[message_id]
+            metrics.observe("scheduler_lag_seconds", max(0.0, time.time() - due_ts), action=action)
+            task = asyncio.create_task(self._runner(message_id, action))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+class PartitionedScheduler:
+    """Un ordonnanceur à échéances par serveur, chacun limité à `max_inflight` actions simultanées.
+
+    Même interface que DeadlineScheduler (+ `partition`) : une rafale de rappels sur un gros
+    serveur attend son tour dans sa propre partition au lieu de retarder les autres serveurs.
+    """
+    def __init__(self, runner, max_inflight=SCHEDULER_GUILD_CONCURRENCY):
+        self._runner = runner
+        self._max_inflight = max_inflight
+        self._partitions = {} # guild_id (None = inconnu) -> DeadlineScheduler
+        self._partition_of = {} # message_id -> guild_id
+        self._running = False
+
+    def _partition(self, key):
+        scheduler = self._partitions.get(key)
+        if scheduler is None:
+            scheduler = self._partitions[key] = DeadlineScheduler(self._runner, self._max_inflight)
+            if self._running:
+                scheduler.start()
+        return scheduler
+
+    def schedule(self, message_id, due_ts, action, partition=None):
+        previous = self._partition_of.get(message_id, partition)
+        if previous != partition: # Serveur renseigné après coup (migration)
+            self._partitions[previous].unschedule(message_id)
+        self._partition_of[message_id] = partition
+        self._partition(partition).schedule(message_id, due_ts, action)
+
+    def unschedule(self, message_id):
+        key = self._partition_of.pop(message_id, None)
+        if key in self._partitions:
+            self._partitions[key].unschedule(message_id)
+
+    def next_deadline(self):
+        return min((d for d in (p.next_deadline() for p in self._partitions.values()) if d is not None), default=None)
+
+    def __len__(self):
+        return sum(len(p) for p in self._partitions.values())
+
+    def overdue(self):
+        return sum(p.overdue() for p in self._partitions.values())
+
+    def partitions(self):
+        return len(self._partitions)
+
+    def is_running(self):
+        return self._running
+
+    def start(self):
+        self._running = True
+        for scheduler in self._partitions.values():
+            scheduler.start()
+
+    def stop(self):
+        self._running = False
+        for scheduler in self._partitions.values():
+            scheduler.stop()
+
+async def reschedule_event(message_id):
+    """Relit l'événement en BDD et (re)programme sa prochaine action."""
+    event = await get_event(message_id)
+    if event is None:
+        event_scheduler.unschedule(message_id)
+        return
+    planned = next_event_action(event, await get_pending_reminders(message_id), time.time())
+    if planned:
+        event_scheduler.schedule(message_id, *planned, partition=event["guild_id"])
+    else:
+        event_scheduler.unschedule(message_id)
+
+async def rebuild_schedule(all_events=None):
+    """Reconstruit l'ordonnanceur depuis la BDD (au démarrage), ou depuis des lignes déjà lues."""
+    if RUN_MODE == "gateway":
+        ipc_hub.broadcast({"op": "rebuild"}) # Le worker leader relit la BDD
+        return
+    if all_events is None:
+        all_events = await storage.read(_db_get_all_events_sync)
+    now_ts = time.time()
+    # Rappels encore dans leur fenêtre (au plus REMINDER_MAX_WINDOW_SECONDS) : une plage de l'index partiel
+    reminders = {}
+    for reminder in await storage.read(_db_get_due_reminders_sync, now_ts - REMINDER_MAX_WINDOW_SECONDS, 2 ** 62):
+        reminders.setdefault(reminder["message_id"], []).append(reminder)
+    for event in all_events:
+        planned = next_event_action(event, reminders.get(event["message_id"], []), now_ts)
+        if planned:
+            event_scheduler.schedule(event["message_id"], *planned, partition=event["guild_id"])
+    print(f"Ordonnanceur : {len(event_scheduler)} échéance(s) programmée(s) sur {event_scheduler.partitions()} serveur(s).")
+
+async def run_event_action(message_id, action):
+    """Exécute une action échue, puis programme la suivante (ou un nouvel essai si erreur)."""
+    event = await get_event(message_id)
+    if event is None:
+        return
+    now_ts = time.time()
+    reminders = await get_pending_reminders(message_id)
+    planned = next_event_action(event, reminders, now_ts)
+    if planned and planned[1] == action and planned[0] <= now_ts:
+        if not await claim_action(message_id, action):
+            print(f"Ordonnanceur : Action {action} (event {message_id}) déjà réservée par une autre instance.")
+            # Nouvel essai plus tard (réservation expirée d'ici là, ou action terminée : la suivante est alors programmée)
+            event_scheduler.schedule(message_id, now_ts + ACTION_RETRY_SECONDS, action, partition=event["guild_id"])
+            return
+        reminder = next((r for r in reminders if r["rule_key"] == action), None)
+        label = f"reminder_{reminder['target']}" if reminder else action # Libellé borné pour les métriques
+        started = time.perf_counter()
+        try:
+            if reminder is None:
+                with outbound_context(PRIORITY_CLEANUP):
+                    await cleanup_event(event)
+            else:
+                await send_reminder(event, reminder)
+        except Exception as e:
+            metrics.inc("handler_errors_total", handler=f"ordonnanceur_{label}")
+            print(f"Ordonnanceur : Erreur lors de l'action {action} (event {message_id}): {e}")
+            await release_claim(message_id, action)
+            event_scheduler.schedule(message_id, now_ts + ACTION_RETRY_SECONDS, action, partition=event["guild_id"])
+            return
+        finally:
+            metrics.observe("scheduler_action_seconds", time.perf_counter() - started, action=label)
+    await reschedule_event(message_id)
+
+# --- Actions planifiées ---
+async def cleanup_event(event):
+    """Nettoyage 24h après la fin : récurrence, rapport final, nettoyage Discord et BDD."""
+    message_id, thread_id, channel_id = event["message_id"], event["thread_id"], event["channel_id"]
+    event_date, event_time, details = event["event_date"], event["event_time"], event["details"]
+    target_group, keep_thread = event["target_group"], event["keep_thread"]
+    duration_hours = event["duration_hours"]
+    if duration_hours is None: duration_hours = DEFAULT_DURATION_HOURS
+    
+    channel = await resolve_channel(channel_id)
+    if not channel: 
+        print(f"Nettoyage : Salon {channel_id} non trouvé, suppression BDD.")
+        # Si le salon n'existe plus, on nettoie
+        await cleanup_delete_event(message_id)
         return
         
-    if not all_events: return
-        
-    now_utc = datetime.datetime.now(datetime.timezone.utc)
-    now_local_date = datetime.datetime.now(FRENCH_TZ).date()
+    print(f"Nettoyage : Événement {message_id} terminé. Nettoyage...")
     
-    for event in all_events:
+    # --- Récurrence (MODIFIÉ : prochaine occurrence calculée directement par la série) ---
+    if event["series_id"] is not None:
+        with outbound_context(PRIORITY_REMINDER): # La prochaine séance passe avant les suppressions
+            created = await extend_series(event["series_id"])
+        if created:
+            print(f"Nettoyage : Série {event['series_id']} prolongée ({', '.join(created)}).")
+
+    # --- Rapport Final ---
+    summary = await get_attendance_summary(message_id) # Index en mémoire
+    summary_embed = discord.Embed(title=f"✅ Rapport final {event_date}", description="Événement terminé.", color=discord.Color.dark_grey())
+    coming_list = "\n".join([f"• {name}" for name, user_id in summary["coming"]]) or "Personne"
+    maybe_list = "\n".join([f"• {name}" for name, user_id in summary["maybe"]]) or "Personne"
+    not_coming_list = "\n".join([f"• {name}" for name, user_id in summary["not_coming"]]) or "Personne"
+    summary_embed.add_field(name="✅ Présent·e·s", value=coming_list, inline=False)
+    summary_embed.add_field(name="❓ Indécis·e·s", value=maybe_list, inline=False)
+    summary_embed.add_field(name="❌ Absent·e·s", value=not_coming_list, inline=False)
+
+    # --- Nettoyage Discord ---
+    discard_thread_membership(thread_id)
+    if keep_thread:
         try:
-            message_id, thread_id, event_date_str, event_time_str, details, target_group, channel_id, reminder_3d_sent, reminder_24h_sent, reminder_dm_sent, duration_hours = event
-            
-            channel = bot.get_channel(channel_id)
-            if not channel: continue
-                
-            naive_dt = datetime.datetime.fromisoformat(f"{event_date_str}T{event_time_str}")
-            event_start_local = naive_dt.replace(tzinfo=FRENCH_TZ)
-            event_start_utc = event_start_local.astimezone(datetime.timezone.utc)
-            time_until_event = event_start_utc - now_utc
-            total_seconds = time_until_event.total_seconds()
-            
-            if total_seconds < 0: # Événement déjà commencé
-                continue 
-                
-            # --- Rappel J-3 ---
-            event_local_date = event_start_local.date()
-            three_days_away = now_local_date + datetime.timedelta(days=3)
-            if not reminder_3d_sent and event_local_date == three_days_away and target_group:
-                print(f"Rappel : Envoi J-3 pour {message_id}...")
-                day_of_week = calendar.day_name[event_local_date.weekday()]
-                jours_fr = {"Monday": "lundi", "Tuesday": "mardi", "Wednesday": "mercredi", "Thursday": "jeudi", "Friday": "vendredi", "Saturday": "samedi", "Sunday": "dimanche"}
-                jour_fr = jours_fr.get(day_of_week, day_of_week)
-                reminder_message = (f"🔔 **Rappel !** Entraînement ce **{jour_fr}** ! {target_group} - confirmez votre présence. (Heure : {event_time_str} Paris)")
-                await channel.send(reminder_message)
-                
-                # MODIFIÉ : Appel BDD dans un thread
-                await asyncio.to_thread(_db_reminders_update_sent_sync, message_id, "reminder_3d_sent")
-
-            # --- Rappel H-24 ---
-            if not reminder_24h_sent and (23 * 3600 < total_seconds <= 24 * 3600):
-                print(f"Rappel : Envoi H-24 pour {message_id}...")
-                thread = bot.get_channel(thread_id) or await bot.fetch_channel(thread_id)
-                if thread:
-                    hours_remaining = int(total_seconds // 3600)
-                    minutes_remaining = int((total_seconds % 3600) // 60)
-                    temps_restant_str = f"{hours_remaining}h{minutes_remaining:02d}"
-                    embed = discord.Embed(title="🔔 Rappel : J-1", description=f"L'entraînement commence dans environ **{temps_restant_str}** !", color=discord.Color.blue())
-                    await thread.send(embed=embed)
-                    
-                    summary = await get_attendance_summary(message_id) # Appel async
-                    all_users_to_ping = summary['coming'] + summary['maybe']
-                    if all_users_to_ping:
-                        mention_string = " ".join([f"<@{user_id}>" for name, user_id in all_users_to_ping])
-                        await thread.send(f"Rappel pour les participant·e·s et indécis·e·s : {mention_string}")
-                        
-                    # MODIFIÉ : Appel BDD dans un thread
-                    await asyncio.to_thread(_db_reminders_update_sent_sync, message_id, "reminder_24h_sent")
-
-            # --- Rappel MP H-2 ---
-            if not reminder_dm_sent and (1 * 3600 < total_seconds <= 2 * 3600):
-                print(f"Rappel : Envoi des MPs H-2 pour {message_id}...")
-                summary = await get_attendance_summary(message_id) # Appel async
-                all_users_to_ping = summary['coming'] + summary['maybe']
-                if not all_users_to_ping: print("Aucun participant à notifier en MP.")
-                
-                # MODIFIÉ : Passe duration_hours au lien Google
-                google_link = create_google_calendar_link(event_date_str, event_time_str, details, duration_hours)
-                link_text = f"**[Ajouter à Google Calendar]({google_link})**" if google_link else ""
+            thread = bot.get_channel(thread_id) or await bot.fetch_channel(thread_id)
+            await thread.send(embed=summary_embed); await thread.send("Événement terminé. Fil archivé.")
+        except Exception: pass
+        try:
+            message = await channel.fetch_message(message_id)
+            await message.edit(embed=summary_embed, view=None) 
+        except Exception: pass
+    else:
+        try:
+            thread = bot.get_channel(thread_id) or await bot.fetch_channel(thread_id)
+            await thread.send(embed=summary_embed); await thread.send("Fil supprimé.")
+            await thread.delete()
+        except Exception: pass
+        # MODIFIÉ : Supprime exactement les messages publiés pour cet événement (plus de purge du salon)
+        tracked_ids = await storage.read(_db_get_tracked_messages_sync, message_id)
+        await delete_tracked_messages(channel, tracked_ids + [message_id])
 
-                hours_remaining = int(total_seconds // 3600)
-                minutes_remaining = int((total_seconds % 3600) // 60)
-                temps_restant_str = f"{hours_remaining}h{minutes_remaining:02d}" if hours_remaining > 0 else f"{minutes_remaining} minute(s)"
-                
-                embed = discord.Embed(title="🔔 Rappel d'entraînement", description=f"L'entraînement commence dans **{temps_restant_str}** !", color=discord.Color.green())
-                embed.add_field(name="Date", value=f"{event_date_str} à {event_time_str}", inline=False)
-                embed.add_field(name="Détails", value=details, inline=False)
-                
-                users_notified_count = 0
-                for name, user_id in all_users_to_ping:
-                    try:
-                        user = await bot.fetch_user(user_id)
-                        await user.send(content=link_text, embed=embed)
-                        users_notified_count += 1
-                    except discord.Forbidden: print(f"Erreur MP : Impossible d'envoyer à {name} (MPs fermés).")
-                    except Exception as e: print(f"Erreur MP : Erreur inconnue (user {user_id}): {e}")
-                
-                print(f"Rappel H-2 : {users_notified_count} membres notifiés en MP.")
-                # MODIFIÉ : Appel BDD dans un thread
-                await asyncio.to_thread(_db_reminders_update_sent_sync, message_id, "reminder_dm_sent")
+    # --- Suppression BDD (MODIFIÉ : via le thread écrivain) ---
+    # Utilise la nouvelle fonction qui nettoie les deux tables
+    await cleanup_delete_event(message_id)
+
+# MODIFIÉ : Un envoyeur par cible ; la règle (décalage, cible, public) vient de la table `reminders`
+AUDIENCE_LABELS = {"coming_maybe": "participant·e·s et indécis·e·s", "coming": "présent·e·s", "maybe": "indécis·e·s"}
+JOURS_FR = {0: "lundi", 1: "mardi", 2: "mercredi", 3: "jeudi", 4: "vendredi", 5: "samedi", 6: "dimanche"}
+
+def time_remaining_label(start_ts):
+    total_seconds = start_ts - time.time()
+    hours_remaining = int(total_seconds // 3600)
+    minutes_remaining = int((total_seconds % 3600) // 60)
+    return f"{hours_remaining}h{minutes_remaining:02d}" if hours_remaining > 0 else f"{minutes_remaining} minute(s)"
+
+async def reminder_audience(event, audience):
+    """Destinataires [(nom, user_id)] d'un rappel (vide pour le public « groupe »)."""
+    if audience == "target_group":
+        return []
+    summary = await get_attendance_summary(event["message_id"]) # Index en mémoire
+    return {"coming": summary["coming"], "maybe": summary["maybe"], "coming_maybe": summary["coming"] + summary["maybe"]}[audience]
+
+def audience_mentions(event, audience, recipients):
+    """Ligne de mentions d'un rappel dans le salon ou le fil, ou None si personne à mentionner."""
+    if audience == "target_group":
+        return event["target_group"]
+    if not recipients:
+        return None
+    return f"Rappel pour les {AUDIENCE_LABELS[audience]} : " + " ".join(f"<@{user_id}>" for name, user_id in recipients)
+
+async def send_channel_reminder(event, rule, recipients, channel):
+    """Rappel dans le salon (J-3 historique : mention du groupe cible)."""
+    jour_fr = JOURS_FR[datetime.date.fromisoformat(event["event_date"]).weekday()]
+    if rule.audience == "target_group":
+        mentions = event["target_group"]
+    else:
+        mentions = " ".join(f"<@{user_id}>" for name, user_id in recipients) or AUDIENCE_LABELS[rule.audience].capitalize()
+    reminder_message = (f"🔔 **Rappel !** Entraînement ce **{jour_fr}** ! {mentions} - confirmez votre présence. "
+                        f"(Heure : {event['event_time']}, {tz_label(guild_settings.tz(event['guild_id']))})")
+    reminder = await channel.send(reminder_message)
+    await track_bot_message(event["message_id"], reminder, "reminder")
+
+async def send_thread_reminder(event, rule, recipients, channel):
+    """Rappel dans le fil de l'événement (H-24 historique), dans le salon s'il n'y a pas de fil."""
+    thread = (bot.get_channel(event["thread_id"]) or await bot.fetch_channel(event["thread_id"])) if event["thread_id"] else channel
+    embed = discord.Embed(title=f"🔔 Rappel : {rule.label()}",
+                          description=f"L'entraînement commence dans environ **{time_remaining_label(event['start_utc'])}** !",
+                          color=discord.Color.blue())
+    await thread.send(embed=embed)
+    mentions = audience_mentions(event, rule.audience, recipients)
+    if mentions:
+        await thread.send(mentions)
+
+async def send_dm_reminder(event, rule, recipients, channel):
+    """Rappel en MP (H-2 historique), envoi parallèle borné."""
+    message_id = event["message_id"]
+    event_date_str, event_time_str, details = event["event_date"], event["event_time"], event["details"]
+    if not recipients: print("Aucun participant à notifier en MP.")
+    google_link = create_google_calendar_link(event_date_str, event_time_str, details, event["duration_hours"],
+                                              guild_settings.tz(event["guild_id"]))
+    link_text = f"**[Ajouter à Google Calendar]({google_link})**" if google_link else ""
+    embed = discord.Embed(title="🔔 Rappel d'entraînement",
+                          description=f"L'entraînement commence dans **{time_remaining_label(event['start_utc'])}** !",
+                          color=discord.Color.green())
+    embed.add_field(name="Date", value=f"{event_date_str} à {event_time_str}", inline=False)
+    embed.add_field(name="Détails", value=details, inline=False)
+    stats = await fan_out_dms(recipients, content=link_text, embed=embed)
+    for outcome in ("sent", "forbidden", "failed"):
+        metrics.inc("dm_delivery_total", stats[outcome], outcome=outcome)
+    print(f"Rappel {rule.label()} (event {message_id}) : {format_delivery_stats(stats)}.")
+
+REMINDER_SENDERS = {
+    "channel": send_channel_reminder,
+    "thread": send_thread_reminder,
+    "dm": send_dm_reminder,
+}
+
+async def send_reminder(event, reminder):
+    """Envoie un rappel (une ligne de `reminders`) puis le marque comme envoyé."""
+    rule = ReminderRule.parse(reminder["rule_key"])
+    channel = await resolve_channel(event["channel_id"])
+    if not channel:
+        await reminders_mark_sent(reminder["id"], "skipped") # Le nettoyage archivera l'événement
+        return
+    print(f"Rappel : Envoi {rule} pour {event['message_id']}...")
+    with outbound_context(PRIORITY_DM if rule.target == "dm" else PRIORITY_REMINDER):
+        recipients = await reminder_audience(event, rule.audience)
+        await REMINDER_SENDERS[rule.target](event, rule, recipients, channel)
+    await reminders_mark_sent(reminder["id"])
+
+event_scheduler = PartitionedScheduler(run_event_action)
+
+# ====================================================================
+# 6 bis. DÉMARRAGE À CHAUD
+# ====================================================================
+# Avant : `tree.sync()` à chaque on_ready (reconnexions comprises) et caches froids au premier
+# clic. Désormais tout est préparé une fois dans setup_hook, avant la connexion à la passerelle.
+startup_timings = {} # étape -> secondes (export : jauge time_to_ready_seconds)
+
+def _db_warm_start_sync(conn, active_since_ts):
+    """Une seule requête : tous les événements, avec les présences de ceux qui ne sont pas terminés."""
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    columns = ", ".join(f"e.{column.strip()}" for column in EVENT_COLUMNS.split(","))
+    return cursor.execute(f"""
+        SELECT {columns}, a.user_id AS rsvp_user_id, a.user_name AS rsvp_user_name, a.status AS rsvp_status
+        FROM events e
+        LEFT JOIN attendance a ON a.message_id = e.message_id AND e.end_utc >= ?
+        ORDER BY e.message_id, a.id
+    """, (active_since_ts,)).fetchall()
+
+def command_tree_hash():
+    """Empreinte des commandes globales telles qu'envoyées à Discord (noms, options, permissions...)."""
+    payload = sorted((command.to_dict(bot.tree) for command in bot.tree.get_commands()), key=lambda c: c["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+async def sync_commands_if_changed():
+    """Synchronise l'arbre de commandes seulement si son empreinte a changé depuis la dernière fois."""
+    key = f"command_tree_hash:{bot.application_id}"
+    current = command_tree_hash()
+    if await storage.read(_db_get_meta_sync, key) == current:
+        print("Commandes : arbre inchangé, synchronisation ignorée.")
+        return False
+    try:
+        await bot.tree.sync()
+    except discord.HTTPException as e:
+        print(f"Commandes : échec de la synchronisation ({e}), nouvel essai au prochain démarrage.")
+        return False
+    await storage.write(_db_set_meta_sync, key, current)
+    print(f"Commandes : {len(bot.tree.get_commands())} commande(s) synchronisée(s).")
+    return True
+
+async def warm_start():
+    """Pipeline de démarrage : vues persistantes, sync conditionnelle, caches et ordonnanceur en une lecture."""
+    started = time.perf_counter()
+    guild_settings.load(await storage.read(_db_get_guild_settings_sync)) # Avant tout calcul d'échéance (fuseaux)
+    bot.add_view(TrainingView())
+    await sync_commands_if_changed()
+    synced = time.perf_counter()
+    metrics.observe("startup_phase_seconds", synced - started, phase="command_sync")
+
+    now_ts = int(time.time())
+    rows = await storage.read(_db_warm_start_sync, now_ts)
+    events, rosters = {}, {}
+    for row in rows:
+        message_id = row["message_id"]
+        events.setdefault(message_id, row)
+        if row["rsvp_user_id"] is not None:
+            rosters.setdefault(message_id, []).append((row["rsvp_user_id"], row["rsvp_user_name"], row["rsvp_status"]))
+        elif row["end_utc"] is not None and row["end_utc"] >= now_ts:
+            rosters.setdefault(message_id, []) # Événement actif sans réponse : index vide mais chaud
+    event_state_cache.load((message_id, event["end_utc"], event["is_cancelled"], event["capacity"]) for message_id, event in events.items())
+    attendance_indexes.preload(rosters)
+    await rebuild_schedule(list(events.values()))
+    preloaded = time.perf_counter()
+    metrics.observe("startup_phase_seconds", preloaded - synced, phase="preload")
+    startup_timings["preload"] = preloaded - started
+    print(f"Démarrage : {len(event_state_cache)} événement(s), {len(rosters)} liste(s) de présence préchargée(s) en {preloaded - synced:.2f} s.")
+
+# --- Rattrapage des rappels manqués ---
+# Un rappel dont la fenêtre s'est refermée pendant un arrêt n'est jamais reprogrammé par
+# next_event_action. Au démarrage et après une reconnexion, ces rappels sont traités en lot :
+#   "send"     : chaque rappel manqué est envoyé ;
+#   "collapse" : seul le plus récent rappel manqué de l'événement est envoyé, les autres sont
+#                marqués « remplacés » (un seul message au lieu de J-3 + J-1 à la suite) ;
+#   "skip"     : rien n'est envoyé, les rappels sont seulement marqués et journalisés.
+CATCHUP_POLICY = "collapse"
+CATCHUP_MIN_LEAD_SECONDS = 15 * 60 # Trop proche du début (ou commencé) : rappel ignoré
+catchup_lock = asyncio.Lock()
+
+def _db_get_missed_reminders_sync(conn, now_ts):
+    """Rappels non envoyés dont la fenêtre est refermée, d'événements à venir et non annulés.
+
+    Parcours de l'index partiel idx_reminders_due (due_at <= now_ts), jointure sur l'événement.
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    columns = ", ".join(f"e.{column.strip()}" for column in EVENT_COLUMNS.split(","))
+    return cursor.execute(f"""
+        SELECT {columns}, r.id AS reminder_id, r.rule_key, r.target, r.audience, r.due_at, r.window_end
+        FROM reminders r CROSS JOIN events e ON e.message_id = r.message_id  -- CROSS JOIN : reminders en boucle externe
+        WHERE r.sent_at IS NULL AND r.due_at <= ? AND r.window_end <= ?
+          AND e.is_cancelled = 0 AND e.start_utc > ?
+        ORDER BY e.message_id, r.due_at
+    """, (now_ts, now_ts, now_ts)).fetchall()
+
+def _db_record_catchups_sync(conn, rows, handled_utc):
+    """Journalise les décisions et marque les rappels comme traités (un rappel manqué n'est rattrapé qu'une fois)."""
+    conn.executemany('''
+    INSERT INTO reminder_catchups (message_id, action, decision, missed_due_utc, handled_utc)
+    VALUES (?, ?, ?, ?, ?)
+    ''', [(reminder["message_id"], reminder["rule_key"], decision, reminder["due_at"], handled_utc)
+          for reminder, decision in rows])
+    for reminder, decision in rows: # Aussi pour 'sent' : l'envoi a pu s'arrêter avant de marquer
+        _db_mark_reminder_sent_sync(conn, reminder["reminder_id"], handled_utc, decision)
+
+async def _catch_up_event(event, missed, now_ts):
+    """Applique la politique à un événement ; renvoie les décisions [(rappel, décision)]."""
+    message_id = event["message_id"]
+    if event["start_utc"] - now_ts < CATCHUP_MIN_LEAD_SECONDS or CATCHUP_POLICY == "skip":
+        return [(reminder, "skipped") for reminder in missed]
+    to_send = missed if CATCHUP_POLICY == "send" else missed[-1:]
+    decisions = [(reminder, "collapsed") for reminder in missed if reminder not in to_send]
+    for reminder in to_send:
+        if not await claim_action(message_id, reminder["rule_key"]):
+            continue # Déjà traité par une autre instance
+        try:
+            await send_reminder(event, {"id": reminder["reminder_id"], "rule_key": reminder["rule_key"]})
+            decisions.append((reminder, "sent"))
+        except Exception as e:
+            metrics.inc("handler_errors_total", handler=f"rattrapage_reminder_{reminder['target']}")
+            print(f"Rattrapage : Échec du rappel {reminder['rule_key']} (event {message_id}) : {e}")
+            decisions.append((reminder, "skipped"))
+    return decisions
+
+async def catch_up_missed_reminders():
+    """Traite en lot les rappels manqués pendant un arrêt (démarrage et reconnexions)."""
+    if catchup_lock.locked():
+        return [] # Un rattrapage est déjà en cours
+    async with catchup_lock:
+        now_ts = int(time.time())
+        pending = {} # message_id -> (événement, [rappels manqués par échéance croissante])
+        for row in await storage.read(_db_get_missed_reminders_sync, now_ts):
+            pending.setdefault(row["message_id"], (row, []))[1].append(row)
+        if not pending:
+            return []
+        results = await asyncio.gather(*(_catch_up_event(event, missed, now_ts) for event, missed in pending.values()))
+        decisions = [decision for event_decisions in results for decision in event_decisions]
+        await storage.write(_db_record_catchups_sync, decisions, now_ts)
+        counts = {}
+        for reminder, decision in decisions:
+            metrics.inc("reminder_catchup_total", action=f"reminder_{reminder['target']}", decision=decision)
+            counts[decision] = counts.get(decision, 0) + 1
+        for message_id in pending:
+            await reschedule_event(message_id)
+        print(f"Rattrapage ({CATCHUP_POLICY}) : {len(pending)} événement(s), "
+              + ", ".join(f"{count} {decision}" for decision, count in sorted(counts.items())) + ".")
+        return decisions
+
+def _db_backfill_guild_ids_sync(conn, channel_guilds):
+    """Renseigne guild_id des événements et séries créés avant le multi-serveur."""
+    conn.executemany("UPDATE events SET guild_id = ? WHERE channel_id = ? AND guild_id IS NULL",
+                     [(guild_id, channel_id) for channel_id, guild_id in channel_guilds.items()])
+    conn.executemany("UPDATE series SET guild_id = ? WHERE channel_id = ? AND guild_id IS NULL",
+                     [(guild_id, channel_id) for channel_id, guild_id in channel_guilds.items()])
+    for channel_id in channel_guilds: # Rappels J-n recalculés dans le fuseau du serveur
+        for (message_id,) in conn.execute("SELECT message_id FROM events WHERE channel_id = ? AND start_utc > ?",
+                                          (channel_id, int(time.time()))).fetchall():
+            _db_materialize_reminders_sync(conn, message_id)
+
+def _db_get_unassigned_channels_sync(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT channel_id FROM events WHERE guild_id IS NULL UNION SELECT channel_id FROM series WHERE guild_id IS NULL")]
+
+async def backfill_guild_ids():
+    """Rattache les anciennes lignes à leur serveur (cache des salons disponible seulement après on_ready)."""
+    channel_ids = await storage.read(_db_get_unassigned_channels_sync)
+    channel_guilds = {cid: channel_guild_id(bot.get_channel(cid)) for cid in channel_ids}
+    channel_guilds = {cid: gid for cid, gid in channel_guilds.items() if gid is not None}
+    if not channel_guilds:
+        return
+    await storage.write(_db_backfill_guild_ids_sync, channel_guilds)
+    print(f"Migration BDD : Serveur renseigné pour {len(channel_guilds)} salon(s).")
+    await rebuild_schedule() # Chaque événement rejoint la partition de son serveur
+
+metrics.gauge("time_to_ready_seconds", "Secondes entre le lancement du processus et le premier on_ready.", lambda: startup_timings["ready"])
+metrics.gauge("outbound_queue_length", "Appels REST en attente dans la file sortante.", lambda: len(outbound))
+metrics.gauge("scheduler_pending", "Actions programmées dans l'ordonnanceur.", lambda: len(event_scheduler))
+metrics.gauge("scheduler_partitions", "Serveurs ayant une partition dans l'ordonnanceur.", lambda: event_scheduler.partitions())
+metrics.gauge("shard_count", "Shards de la connexion passerelle.", lambda: bot.shard_count or 1)
+metrics.gauge("scheduler_backlog", "Actions échues non terminées (arriéré).", lambda: event_scheduler.overdue())
+metrics.gauge("attendance_write_backlog", "RSVP en attente de validation groupée.", lambda: len(attendance_writer))
+metrics.gauge("event_state_cache_size", "Événements dans le cache d'état.", lambda: len(event_state_cache))
+
+# ====================================================================
+# 6 ter. DÉPLOIEMENT EN DEUX PROCESSUS (GATEWAY / WORKER)
+# ====================================================================
+# Option : `--mode gateway` ne traite que la passerelle (boutons, commandes, assistant) ;
+# `--mode worker` (REST seulement, sans passerelle) exécute rappels et nettoyages. Les deux
+# partagent la BDD SQLite (WAL) et un socket Unix local :
+#   gateway -> worker : "reschedule" / "unschedule" / "rebuild" / "settings" (le worker relit la BDD) ;
+#   worker -> gateway : "discard" (événement nettoyé : le gateway oublie ses caches).
+# Plusieurs workers peuvent tourner : un bail en BDD élit le seul leader qui exécute les
+# actions, et chaque action est réservée dans `action_claims` avant exécution.
+IPC_SOCKET_PATH = "training_bot.sock" # Relatif au dossier courant, comme DB_NAME
+IPC_RETRY_SECONDS = 5 # Délai avant reconnexion du worker au gateway
+LEASE_TTL_SECONDS = 30 # Un leader silencieux depuis plus longtemps est remplacé
+LEASE_RENEW_SECONDS = 10
+WORKER_HTTP_PORT = 9109 # Métriques du worker (le gateway garde HTTP_PORT)
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+
+class RemoteScheduler:
+    """Ordonnanceur du mode gateway : chaque (re)programmation est transmise au worker."""
+    def __init__(self):
+        self._running = False
+
+    def schedule(self, message_id, due_ts, action, partition=None):
+        ipc_hub.broadcast({"op": "reschedule", "message_id": message_id})
+
+    def unschedule(self, message_id):
+        ipc_hub.broadcast({"op": "unschedule", "message_id": message_id})
+
+    def __len__(self):
+        return 0
+
+    def overdue(self):
+        return 0
 
+    def partitions(self):
+        return 0
+
+    def is_running(self):
+        return self._running
+
+    def start(self):
+        self._running = True
+
+    def stop(self):
+        self._running = False
+
+async def _ipc_read_messages(reader, handler):
+    """Lit des messages JSON (un par ligne) jusqu'à la fermeture de la connexion."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        try:
+            await handler(message)
         except Exception as e:
-            print(f"Tâche de rappel : Erreur lors du traitement de l'événement {message_id}: {e}") 
+            print(f"IPC : Erreur de traitement de {message} : {e}")
+
+def _ipc_write(writer, message):
+    if not writer.is_closing():
+        writer.write(json.dumps(message).encode() + b"\n")
+
+class IpcHub:
+    """Côté gateway : serveur du socket Unix, diffusion vers tous les workers connectés."""
+    def __init__(self, path=IPC_SOCKET_PATH):
+        self.path = path
+        self._server = None
+        self._writers = set()
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path) # Socket laissé par un arrêt brutal
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        print(f"IPC : En écoute sur {self.path}.")
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            await _ipc_read_messages(reader, self._on_message)
+        except (ConnectionError, asyncio.CancelledError):
+            pass # Worker déconnecté, ou arrêt du gateway
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _on_message(self, message):
+        if message.get("op") == "discard":
+            forget_event_caches(message["message_id"])
+        elif message.get("op") == "feeds":
+            feed_versions.touch_events() # Événements créés ou modifiés par le worker
+
+    def broadcast(self, message):
+        for writer in list(self._writers):
+            _ipc_write(writer, message)
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        try: os.remove(self.path)
+        except OSError: pass
+
+class IpcClient:
+    """Côté worker : connexion (avec reprise) au gateway. Les envois hors connexion sont ignorés :
+    la BDD reste la référence, et le leader la relit à chaque (re)connexion."""
+    def __init__(self, path=IPC_SOCKET_PATH):
+        self.path = path
+        self._writer = None
+
+    def send(self, message):
+        if self._writer is not None:
+            _ipc_write(self._writer, message)
+
+    async def run(self, on_message, on_connect):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(IPC_RETRY_SECONDS)
+                continue
+            print("IPC : Connecté au gateway.")
+            try:
+                await on_connect()
+                await _ipc_read_messages(reader, on_message)
+            finally:
+                self._writer.close()
+                self._writer = None
+            print("IPC : Connexion au gateway perdue.")
+            await asyncio.sleep(IPC_RETRY_SECONDS)
+
+ipc_hub = IpcHub()
+ipc_client = IpcClient()
+
+def forget_event_caches(message_id):
+    """Gateway : un worker a nettoyé cet événement, ses caches en mémoire sont obsolètes."""
+    attendance_writer.discard(message_id) # Un lot déjà en cours de validation est filtré en BDD
+    event_state_cache.discard(message_id)
+    discard_roster_coalescer(message_id)
+    attendance_indexes.discard(message_id)
+
+# --- Élection du leader ---
+def _db_acquire_lease_sync(conn, name, holder, now_ts, ttl):
+    """Prend ou prolonge le bail (True si `holder` le détient après l'appel)."""
+    conn.execute("INSERT OR IGNORE INTO leases (name, holder, expires_utc) VALUES (?, NULL, 0)", (name,))
+    cursor = conn.execute(
+        "UPDATE leases SET holder = ?, expires_utc = ? WHERE name = ? AND (holder = ? OR holder IS NULL OR expires_utc < ?)",
+        (holder, now_ts + ttl, name, holder, now_ts))
+    return cursor.rowcount == 1
+
+def _db_release_lease_sync(conn, name, holder):
+    conn.execute("UPDATE leases SET holder = NULL, expires_utc = 0 WHERE name = ? AND holder = ?", (name, holder))
+
+class LeaderLease:
+    """Bail de leader en BDD : pris s'il est libre ou expiré, prolongé tant que le worker est vivant."""
+    def __init__(self, name="scheduler", holder=INSTANCE_ID, ttl=LEASE_TTL_SECONDS):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.is_leader = False
+
+    async def refresh(self):
+        try:
+            self.is_leader = await storage.write(_db_acquire_lease_sync, self.name, self.holder, time.time(), self.ttl)
+        except sqlite3.Error as e:
+            print(f"Bail : Erreur BDD ({e}), leadership abandonné par prudence.")
+            self.is_leader = False
+        return self.is_leader
+
+    async def release(self):
+        if self.is_leader:
+            await storage.write(_db_release_lease_sync, self.name, self.holder)
+            self.is_leader = False
+
+worker_lease = LeaderLease()
+
+async def on_worker_message(message):
+    """Worker : messages du gateway (seuls les réglages sont suivis tant que ce worker n'est pas leader)."""
+    op = message.get("op")
+    if op == "settings":
+        guild_settings.load(await storage.read(_db_get_guild_settings_sync))
+    if not worker_lease.is_leader:
+        return
+    if op == "reschedule":
+        await reschedule_event(message["message_id"])
+    elif op == "unschedule":
+        event_scheduler.unschedule(message["message_id"])
+    elif op == "rebuild":
+        await rebuild_schedule()
 
-@check_for_cleanup.before_loop
-@check_reminders.before_loop
-async def before_tasks():
-    await bot.wait_until_ready()
+async def on_worker_connect():
+    if worker_lease.is_leader:
+        await rebuild_schedule() # Messages éventuellement perdus pendant la coupure
+
+async def run_worker_loop():
+    """Worker : élection du leader, puis ordonnanceur et rattrapage tant que le bail est tenu."""
+    guild_settings.load(await storage.read(_db_get_guild_settings_sync))
+    ipc_task = asyncio.create_task(ipc_client.run(on_worker_message, on_worker_connect))
+    try:
+        while True:
+            was_leader = worker_lease.is_leader
+            if await worker_lease.refresh():
+                if not was_leader:
+                    print(f"Worker {INSTANCE_ID} : Leader, démarrage de l'ordonnanceur.")
+                    await rebuild_schedule()
+                    event_scheduler.start()
+                    await catch_up_missed_reminders()
+            elif was_leader:
+                print(f"Worker {INSTANCE_ID} : Bail perdu, arrêt de l'ordonnanceur.")
+                event_scheduler.stop()
+            await asyncio.sleep(LEASE_RENEW_SECONDS)
+    finally:
+        ipc_task.cancel()
+        event_scheduler.stop()
+        await worker_lease.release()
+
+async def run_worker():
+    """Processus worker : connexion REST seulement (pas de passerelle, pas d'intents)."""
+    async with bot:
+        await bot.login(BOT_TOKEN) # Appelle aussi setup_hook
+        await run_worker_loop()
+
+def configure_mode(mode):
+    """Adapte le processus au mode choisi avant le lancement."""
+    global RUN_MODE, HTTP_PORT, event_scheduler
+    RUN_MODE = mode
+    if mode == "gateway":
+        event_scheduler = RemoteScheduler()
+    elif mode == "worker":
+        HTTP_PORT = WORKER_HTTP_PORT
+
+# ====================================================================
+# 6 quater. FLUX ICALENDAR (SERVEUR HTTP LOCAL)
+# ====================================================================
+# Flux .ics par salon, par rôle (événements qui le mentionnent) et par membre (séances
+# répondues « Présent·e » ou « Indécis·e »), servis par le serveur HTTP local. L'ETag et la
+# date de modification viennent de compteurs en mémoire : une réponse 304 ne touche jamais
+# la BDD, et un flux n'est rendu à nouveau que si ses événements ou RSVP ont changé.
+# Les URL contiennent un jeton HMAC : pour les exposer, placer un proxy inverse devant
+# HTTP_HOST:HTTP_PORT et renseigner ICS_BASE_URL.
+ICS_BASE_URL = None # ex: "https://club.example.org" ; None -> http://HTTP_HOST:HTTP_PORT
+ICS_CACHE_MAX = 500 # Flux rendus gardés en mémoire
+ICS_FEEDS = ("channel", "role", "member")
+ICS_PRODID = "-//training_planner//Bot d'entraînements//FR"
+
+class FeedVersions:
+    """Compteurs des changements qui invalident les flux.
+
+    `events` change à chaque création, annulation, suppression ou nettoyage d'événement (via
+    EventStateCache) ; la version d'un membre, à chacun de ses RSVP.
+    """
+    def __init__(self):
+        self.boot = f"{random.getrandbits(32):08x}" # Les compteurs repartent de 0 à chaque démarrage
+        self.events = 0
+        self.events_changed = time.time()
+        self._members = {} # user_id -> (version, epoch du dernier RSVP)
+
+    def touch_events(self):
+        self.events += 1
+        self.events_changed = time.time()
+        ipc_client.send({"op": "feeds"}) # Worker : le gateway, qui sert les flux, les invalide aussi
+
+    def touch_member(self, user_id):
+        version, _ = self._members.get(user_id, (0, 0))
+        self._members[user_id] = (version + 1, time.time())
+
+    def stamp(self, kind, key):
+        """(ETag, epoch de dernière modification) actuels d'un flux."""
+        if kind == "member":
+            version, changed = self._members.get(key, (0, 0))
+            return f'"{self.boot}-{self.events}-{version}"', max(self.events_changed, changed)
+        return f'"{self.boot}-{self.events}"', self.events_changed
+
+feed_versions = FeedVersions()
+
+class FeedCache:
+    """Derniers flux rendus : (type, id) -> (ETag, corps), les moins récemment servis évincés."""
+    def __init__(self, max_items=ICS_CACHE_MAX):
+        self.max_items = max_items
+        self._items = {}
+
+    def get(self, key, etag):
+        item = self._items.pop(key, None)
+        if item is None or item[0] != etag:
+            return None
+        self._items[key] = item
+        return item[1]
+
+    def put(self, key, etag, body):
+        self._items.pop(key, None)
+        self._items[key] = (etag, body)
+        while len(self._items) > self.max_items:
+            self._items.pop(next(iter(self._items)))
+
+feed_cache = FeedCache()
+feed_secret = None
+
+def _db_get_feed_secret_sync(conn):
+    secret = _db_get_meta_sync(conn, "ics_secret")
+    if secret is None:
+        secret = secrets.token_hex(32)
+        _db_set_meta_sync(conn, "ics_secret", secret)
+    return secret
+
+async def load_feed_secret():
+    """Clé des jetons des URL de flux (créée au premier démarrage, gardée en mémoire)."""
+    global feed_secret
+    feed_secret = bytes.fromhex(await storage.write(_db_get_feed_secret_sync))
+
+def feed_token(kind, key):
+    return hmac.new(feed_secret, f"{kind}:{key}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def feed_url(kind, key):
+    base = (ICS_BASE_URL or f"http://{HTTP_HOST}:{HTTP_PORT}").rstrip("/")
+    return f"{base}/ics/{kind}/{key}/{feed_token(kind, key)}.ics"
+
+def _db_get_feed_events_sync(conn, kind, key):
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    columns = "e.message_id, e.guild_id, e.channel_id, e.details, e.start_utc, e.end_utc, e.is_cancelled"
+    if kind == "member":
+        return cursor.execute(f'''
+        SELECT {columns}, a.status FROM attendance a JOIN events e ON e.message_id = a.message_id
+        WHERE a.user_id = ? AND a.status IN ('Coming', 'Maybe') ORDER BY e.start_utc
+        ''', (key,)).fetchall()
+    if kind == "role":
+        return cursor.execute(f"SELECT {columns}, NULL AS status FROM events e WHERE e.target_group LIKE ? ORDER BY e.start_utc",
+                              (f"%<@&{key}>%",)).fetchall()
+    return cursor.execute(f"SELECT {columns}, NULL AS status FROM events e WHERE e.channel_id = ? ORDER BY e.start_utc",
+                          (key,)).fetchall()
+
+def _ics_escape(text):
+    return str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def _ics_fold(line):
+    """Plie une ligne à 75 octets (RFC 5545) sans couper de caractère UTF-8."""
+    if len(line.encode()) <= 75:
+        return line
+    parts, current, limit = [], "", 75
+    for char in line:
+        if len((current + char).encode()) > limit:
+            parts.append(current)
+            current, limit = "", 74 # Les lignes de continuation commencent par une espace
+        current += char
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+def _ics_time(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def render_ics(name, rows):
+    """Corps du flux iCalendar (octets) à partir des lignes d'événements."""
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{ICS_PRODID}", "CALSCALE:GREGORIAN", "METHOD:PUBLISH",
+             f"X-WR-CALNAME:{_ics_escape(name)}"]
+    stamp = _ics_time(time.time())
+    for row in rows:
+        if row["start_utc"] is None:
+            continue # Date illisible
+        link = f"https://discord.com/channels/{row['guild_id'] or '@me'}/{row['channel_id']}/{row['message_id']}"
+        status = "CANCELLED" if row["is_cancelled"] else "TENTATIVE" if row["status"] == "Maybe" else "CONFIRMED"
+        summary = ("[ANNULÉ] " if row["is_cancelled"] else "") + f"Entraînement : {row['details']}"
+        description = f"{row['details']}\n{link}"
+        lines += ["BEGIN:VEVENT", f"UID:{row['message_id']}@training-planner", f"DTSTAMP:{stamp}",
+                  f"DTSTART:{_ics_time(row['start_utc'])}", f"DTEND:{_ics_time(row['end_utc'])}",
+                  f"SUMMARY:{_ics_escape(summary)}", f"DESCRIPTION:{_ics_escape(description)}",
+                  f"URL:{link}", f"STATUS:{status}", "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(_ics_fold(line) for line in lines) + "\r\n").encode()
+
+def feed_name(kind, key):
+    if kind == "member":
+        return "Mes entraînements"
+    if kind == "channel":
+        channel = bot.get_channel(key)
+        return f"Entraînements #{channel.name}" if channel else "Entraînements"
+    role = next((role for guild in bot.guilds if (role := guild.get_role(key))), None)
+    return f"Entraînements {role.name}" if role else "Entraînements"
+
+def _is_fresh(request, etag, changed):
+    """Requête conditionnelle satisfaite (-> 304) ? If-None-Match prime sur If-Modified-Since."""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    since = request.if_modified_since
+    return since is not None and int(changed) <= since.timestamp()
+
+async def handle_ics(request):
+    kind, token = request.match_info["kind"], request.match_info["token"]
+    try:
+        key = int(request.match_info["key"])
+    except ValueError:
+        raise web.HTTPNotFound()
+    if kind not in ICS_FEEDS or feed_secret is None or not hmac.compare_digest(token, feed_token(kind, key)):
+        raise web.HTTPNotFound()
+
+    etag, changed = feed_versions.stamp(kind, key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _is_fresh(request, etag, changed):
+        metrics.inc("ics_requests_total", kind=kind, result="304")
+        response = web.Response(status=304, headers=headers)
+    else:
+        body = feed_cache.get((kind, key), etag)
+        metrics.inc("ics_requests_total", kind=kind, result="cache" if body is not None else "rendu")
+        if body is None:
+            if kind == "member":
+                await attendance_writer.flush() # Le flux reflète au moins les RSVP comptés dans l'ETag
+            rows = await storage.read(_db_get_feed_events_sync, kind, key)
+            body = render_ics(feed_name(kind, key), rows)
+            feed_cache.put((kind, key), etag, body)
+        response = web.Response(body=body, headers=headers, content_type="text/calendar", charset="utf-8")
+    response.last_modified = int(changed)
+    return response
+
+@bot.tree.command(name="calendrier", description="Liens d'abonnement iCalendar (agenda du téléphone, Google Agenda...).")
+@discord.app_commands.describe(role="Ajouter le flux des entraînements qui mentionnent ce rôle")
+@discord.app_commands.guild_only()
+@instrumented("calendrier")
+async def calendrier(interaction: discord.Interaction, role: discord.Role = None):
+    if HTTP_PORT is None or feed_secret is None:
+        await interaction.response.send_message("Les flux iCalendar ne sont pas activés sur ce bot.", ephemeral=True); return
+    lines = [f"📅 **Mes entraînements** (réponses Présent·e / Indécis·e) :\n<{feed_url('member', interaction.user.id)}>",
+             f"📢 **Ce salon** :\n<{feed_url('channel', interaction.channel_id)}>"]
+    if role:
+        lines.append(f"👥 **{role.name}** :\n<{feed_url('role', role.id)}>")
+    lines.append("Ajoutez un lien comme « calendrier par URL » dans votre agenda. Ne partagez pas votre lien personnel.")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
 
 # ====================================================================
 # 7. LANCEMENT DU BOT
 # ====================================================================
-bot.run(BOT_TOKEN)
\ No newline at end of file
+def run_export(args):
+    """`python bot.py export` : écrit l'export compressé sur disque, sans connexion à Discord."""
+    for value in (args.since, args.until):
+        if value:
+            datetime.date.fromisoformat(value) # ValueError -> message d'argparse ci-dessous
+    out = args.out or f"presences_{datetime.date.today().isoformat()}.{args.format}.gz"
+    try:
+        with open(out, "wb") as export_file:
+            count = asyncio.run(storage.read(_db_export_attendance_sync, export_file, args.format, args.guild,
+                                             args.channel, args.member, args.since, args.until))
+    finally:
+        storage.close()
+    print(f"Export : {count} ligne(s) écrite(s) dans {out}.")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bot de planification d'entraînements.")
+    parser.add_argument("--mode", choices=("all", "gateway", "worker"), default="all",
+                        help="all : un seul processus (défaut) ; gateway : interactions seulement ; worker : rappels et nettoyages")
+    subparsers = parser.add_subparsers(dest="command")
+    export = subparsers.add_parser("export", help="exporte l'historique des présences (gzip), sans lancer le bot")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export.add_argument("--out", help="fichier de sortie (défaut : presences_<date>.<format>.gz)")
+    export.add_argument("--since", help="date de début incluse (AAAA-MM-JJ)")
+    export.add_argument("--until", help="date de fin incluse (AAAA-MM-JJ)")
+    export.add_argument("--guild", type=int, help="ID du serveur")
+    export.add_argument("--channel", type=int, help="ID du salon")
+    export.add_argument("--member", type=int, help="ID du membre")
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        try:
+            run_export(args)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+    configure_mode(args.mode)
+    if args.mode == "worker":
+        try:
+            asyncio.run(run_worker())
+        except KeyboardInterrupt:
+            pass
+    else:
+        bot.run(BOT_TOKEN)
+
+# Lancement seulement en exécution directe : le module reste importable (banc de charge hors ligne)
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1 @@
+"""Outils de charge hors ligne : passerelle Discord factice et banc de mesures."""
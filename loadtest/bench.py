@@ -0,0 +1,289 @@
+"""Banc de charge hors ligne du bot (aucune connexion Discord requise).
+
+Rejoue des scénarios contre la passerelle factice et rapporte les latences p50/p99 et le
+nombre d'appels API par opération. Exemples :
+
+    python -m loadtest.bench rsvp_burst --members 500 --duration 30
+    python -m loadtest.bench reminder_window --events 200
+    python -m loadtest.bench thread_flip --members 500
+    python -m loadtest.bench all --quick --json
+
+La BDD est créée dans un dossier temporaire : la BDD de production n'est jamais touchée.
+"""
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from loadtest.fake_discord import FakeGateway
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_bot(workdir):
+    """Importe bot.py avec une BDD neuve dans `workdir` (DB_NAME est relatif au dossier courant)."""
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return importlib.import_module("bot")
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class ScenarioResult:
+    def __init__(self, name, operations, elapsed, latencies, gateway):
+        self.name = name
+        self.operations = operations
+        self.elapsed = elapsed
+        self.latencies = latencies # libellé -> [secondes]
+        self.api_calls = gateway.count_calls() - gateway.count_calls(status=429)
+        self.rate_limited = gateway.count_calls(status=429)
+        self.routes = gateway.calls_by_route()
+
+    def as_dict(self):
+        return {
+            "scenario": self.name,
+            "operations": self.operations,
+            "elapsed_s": round(self.elapsed, 3),
+            "latency_ms": {
+                label: {"p50": round(percentile(values, 0.5) * 1000, 1), "p99": round(percentile(values, 0.99) * 1000, 1)}
+                for label, values in self.latencies.items()
+            },
+            "api_calls": self.api_calls,
+            "api_calls_per_op": round(self.api_calls / self.operations, 2) if self.operations else 0.0,
+            "rate_limited_429": self.rate_limited,
+            "routes": {route: {"ok": ok, "429": limited} for route, (ok, limited) in sorted(self.routes.items())},
+        }
+
+    def render(self):
+        data = self.as_dict()
+        lines = [f"Scénario {self.name} : {self.operations} opération(s) en {data['elapsed_s']} s"]
+        for label, values in data["latency_ms"].items():
+            lines.append(f"  {label:<28} p50 {values['p50']:>8.1f} ms   p99 {values['p99']:>8.1f} ms")
+        lines.append(f"  appels API : {self.api_calls} ({data['api_calls_per_op']} / opération), 429 : {self.rate_limited}")
+        for route, counts in data["routes"].items():
+            lines.append(f"    {route:<58} {counts['ok']:>6} ok {counts['429']:>5} x 429")
+        return "\n".join(lines)
+
+async def drain(botmod):
+    """Attend la fin des éditions coalescées et la validation des RSVP en attente."""
+    while True:
+        tasks = [c._task for c in botmod.roster_coalescers.values() if c._task and not c._task.done()]
+        if not tasks:
+            break
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await botmod.attendance_writer.flush()
+
+def tomorrow(hour="18:00:00"):
+    day = datetime.datetime.now(datetime.timezone.utc).date() + datetime.timedelta(days=1)
+    return day.isoformat(), hour
+
+async def post_event(botmod, channel, date, hour, details="Banc de charge"):
+    before = set(channel.messages)
+    ok = await botmod.create_event_post(date, hour, details, "none", None, channel, False, 2.0)
+    if not ok:
+        raise RuntimeError("create_event_post a échoué")
+    # Le message de l'événement est le premier message porteur de la vue
+    return next(m for m_id, m in channel.messages.items() if m_id not in before and m.view is not None)
+
+async def scenario_rsvp_burst(botmod, gateway, members=500, duration=30.0):
+    """N membres cliquent au hasard sur les boutons RSVP d'un même événement en `duration` s."""
+    channel = gateway.create_guild().create_text_channel()
+    date, hour = tomorrow()
+    message = await post_event(botmod, channel, date, hour)
+    users = [gateway.create_user() for _ in range(members)]
+    view = botmod.TrainingView()
+    buttons = [view.coming_button, view.maybe_button, view.not_coming_button]
+    ack, followup = [], []
+    gateway.reset_calls()
+
+    async def click(user):
+        await asyncio.sleep(random.uniform(0, duration))
+        interaction = gateway.interaction(message, user)
+        await random.choice(buttons).callback(interaction)
+        ack.append(interaction.responded_at - interaction.started)
+        if interaction.followup_at:
+            followup.append(interaction.followup_at - interaction.started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(click(user) for user in users))
+    await drain(botmod)
+    elapsed = time.monotonic() - started
+    result = ScenarioResult("rsvp_burst", members, elapsed,
+                            {"accusé (defer)": ack, "confirmation (followup)": followup}, gateway)
+    result.roster_edits = message.edit_count
+    # Accès au fil : la file par fil continue après la rafale (débit limité par Discord)
+    result.thread_backlog = sum(len(m._pending) for m in botmod.thread_memberships.values())
+    for membership in list(botmod.thread_memberships.values()):
+        membership.cancel()
+    return result
+
+async def scenario_reminder_window(botmod, gateway, events=200, attendees=2):
+    """`events` événements entrent ensemble dans la fenêtre du rappel MP H-2."""
+    channel = gateway.create_guild().create_text_channel()
+    start = datetime.datetime.now(botmod.DEFAULT_TZ) + datetime.timedelta(hours=2) - datetime.timedelta(minutes=1)
+    message_ids = []
+    for _ in range(events):
+        message = await channel.send(content="événement")
+        thread = await channel.create_thread(name="fil", message=message)
+        await botmod.insert_event(message.id, thread.id, channel.id, start.strftime("%Y-%m-%d"),
+                                  start.strftime("%H:%M:%S"), "Banc de charge", "none", None, False, 2.0,
+                                  guild_id=channel.guild.id)
+        for _ in range(attendees):
+            user = gateway.create_user()
+            await botmod.log_attendance(message.id, user.id, user.display_name, "Coming")
+        message_ids.append(message.id)
+    await botmod.attendance_writer.flush()
+
+    durations, done = [], asyncio.Event()
+    original = botmod.REMINDER_SENDERS["dm"]
+
+    async def timed(event, rule, recipients, channel):
+        await original(event, rule, recipients, channel)
+        durations.append(time.monotonic() - started)
+        if len(durations) == events:
+            done.set()
+
+    botmod.REMINDER_SENDERS["dm"] = timed
+    gateway.reset_calls()
+    started = time.monotonic()
+    try:
+        await botmod.rebuild_schedule()
+        botmod.event_scheduler.start()
+        await done.wait()
+    finally:
+        botmod.event_scheduler.stop()
+        botmod.REMINDER_SENDERS["dm"] = original
+        for message_id in message_ids:
+            botmod.event_scheduler.unschedule(message_id)
+    return ScenarioResult("reminder_window", events, time.monotonic() - started,
+                          {"rappel H-2 terminé (depuis t0)": durations}, gateway)
+
+async def scenario_create_events(botmod, gateway, count=20):
+    """Création séquentielle de `count` événements (message, fil, BDD, ordonnanceur)."""
+    channel = gateway.create_guild().create_text_channel()
+    date, hour = tomorrow("10:00:00")
+    latencies = []
+    gateway.reset_calls()
+    started = time.monotonic()
+    for _ in range(count):
+        t0 = time.monotonic()
+        await post_event(botmod, channel, date, hour)
+        latencies.append(time.monotonic() - t0)
+    return ScenarioResult("create_events", count, time.monotonic() - started,
+                          {"create_event_post": latencies}, gateway)
+
+async def scenario_thread_flip(botmod, gateway, members=50):
+    """Chaque membre clique ✅ puis ❌ (ou l'inverse) pendant que son accès au fil est en cours.
+
+    Vérifie qu'à la fin, l'appartenance au fil correspond au dernier clic de chacun·e.
+    """
+    channel = gateway.create_guild().create_text_channel()
+    date, hour = tomorrow("12:00:00")
+    message = await post_event(botmod, channel, date, hour)
+    thread = message.thread
+    users = [gateway.create_user() for _ in range(members)]
+    view = botmod.TrainingView()
+    latencies = []
+    gateway.reset_calls()
+
+    async def flip(index, user):
+        # Un membre sur deux commence dans le fil : il clique ❌ puis ✅
+        first, last = (view.coming_button, view.not_coming_button) if index % 2 == 0 else (view.not_coming_button, view.coming_button)
+        for button in (first, last):
+            interaction = gateway.interaction(message, user)
+            t0 = time.monotonic()
+            await button.callback(interaction)
+            latencies.append(time.monotonic() - t0)
+            await asyncio.sleep(random.uniform(0, gateway.latency))
+
+    thread.member_ids.update(user.id for user in users[1::2])
+    started = time.monotonic()
+    membership = botmod.get_thread_membership(thread)
+    await membership._seed()
+    await asyncio.gather(*(flip(index, user) for index, user in enumerate(users)))
+    while membership._task and not membership._task.done():
+        await membership._task
+    await drain(botmod)
+    result = ScenarioResult("thread_flip", members * 2, time.monotonic() - started, {"clic RSVP": latencies}, gateway)
+    # Pairs : dernier clic ❌ (hors du fil) ; impairs : dernier clic ✅ (dans le fil)
+    result.thread_mismatches = sum((user.id in thread.member_ids) != bool(index % 2) for index, user in enumerate(users))
+    return result
+
+SCENARIOS = ("rsvp_burst", "reminder_window", "create_events", "thread_flip")
+
+async def run(args):
+    botmod = load_bot(args.workdir)
+    gateway = FakeGateway(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                          rate_limits={} if args.no_rate_limits else None,
+                          dm_closed_ratio=args.dm_closed_ratio, seed=args.seed)
+    gateway.install(botmod.bot)
+    # Comme setup_hook : mesure des appels REST puis file sortante par priorité
+    botmod.instrument_http_client(botmod.bot.http)
+    botmod.install_outbound_queue(botmod.bot.http)
+    if args.dm_rate:
+        botmod.dm_rate_budget = botmod.RateBudget(args.dm_rate)
+    scale = 10 if args.quick else 1
+    names = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = []
+    try:
+        for name in names:
+            if name == "rsvp_burst":
+                results.append(await scenario_rsvp_burst(botmod, gateway, args.members // scale, args.duration / scale))
+            elif name == "reminder_window":
+                results.append(await scenario_reminder_window(botmod, gateway, args.events // scale, args.attendees))
+            elif name == "create_events":
+                results.append(await scenario_create_events(botmod, gateway, max(1, args.count // scale)))
+            elif name == "thread_flip":
+                results.append(await scenario_thread_flip(botmod, gateway, max(2, args.members // 10 // scale)))
+    finally:
+        await botmod.attendance_writer.close()
+        botmod.storage.close()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc de charge hors ligne du bot d'entraînements.")
+    parser.add_argument("scenario", choices=SCENARIOS + ("all",))
+    parser.add_argument("--members", type=int, default=500, help="rsvp_burst : nombre de membres qui cliquent (thread_flip : un dixième)")
+    parser.add_argument("--duration", type=float, default=30.0, help="rsvp_burst : durée de la rafale (s)")
+    parser.add_argument("--events", type=int, default=200, help="reminder_window : événements dans la fenêtre H-2")
+    parser.add_argument("--attendees", type=int, default=2, help="reminder_window : participant·e·s par événement")
+    parser.add_argument("--count", type=int, default=20, help="create_events : événements créés")
+    parser.add_argument("--latency", type=float, default=50.0, help="latence REST simulée (ms)")
+    parser.add_argument("--jitter", type=float, default=20.0, help="gigue de latence (ms)")
+    parser.add_argument("--no-rate-limits", action="store_true", help="désactive l'injection de 429")
+    parser.add_argument("--dm-closed-ratio", type=float, default=0.05, help="part des membres aux MPs fermés")
+    parser.add_argument("--dm-rate", type=float, default=None, help="remplace DM_RATE_PER_SECOND")
+    parser.add_argument("--quick", action="store_true", help="divise la taille des scénarios par 10")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="sortie JSON (une ligne par scénario)")
+    parser.add_argument("--workdir", default=None, help="dossier de la BDD temporaire")
+    args = parser.parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="training-bench-") as tmp:
+        args.workdir = args.workdir or tmp
+        results = asyncio.run(run(args))
+    for result in results:
+        if args.json:
+            print(json.dumps(result.as_dict(), ensure_ascii=False))
+        else:
+            print(result.render())
+            if hasattr(result, "roster_edits"):
+                print(f"  éditions de l'embed : {result.roster_edits}")
+            if hasattr(result, "thread_backlog"):
+                print(f"  accès au fil encore en file : {result.thread_backlog}")
+            if hasattr(result, "thread_mismatches"):
+                print(f"  membres dont l'accès au fil contredit le dernier clic : {result.thread_mismatches}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""Passerelle Discord factice pour exercer bot.py hors ligne.
+
+Fournit des doublures des objets Discord utilisés par le bot (interactions, messages avec
+embeds, fils, salons, utilisateurs). Chaque appel « REST » est enregistré avec sa route et sa
+durée ; la latence et les limites de débit (429) sont injectées selon la configuration.
+Comme discord.py, un 429 est absorbé : l'appel attend `retry_after` puis réessaie.
+Une fois installée, la passerelle fait passer chaque appel par HTTPClient.request du bot
+(mesures et file sortante comprises), sauf les réponses d'interaction qui, comme dans
+discord.py, passent par le webhook d'interaction.
+"""
+import asyncio
+import random
+import time
+
+import discord
+
+# Limites de débit simulées : route -> (nombre d'appels, fenêtre en secondes), par ressource majeure
+DEFAULT_RATE_LIMITS = {
+    "POST /channels/{channel_id}/messages": (5, 5.0),
+    "PATCH /channels/{channel_id}/messages/{message_id}": (5, 5.0),
+    "DELETE /channels/{channel_id}/messages/{message_id}": (5, 1.0),
+    "POST /channels/{channel_id}/messages/bulk-delete": (1, 1.0),
+    "PUT /channels/{channel_id}/thread-members/{user_id}": (10, 10.0),
+    "DELETE /channels/{channel_id}/thread-members/{user_id}": (10, 10.0),
+    "POST /users/@me/channels": (10, 1.0),
+}
+
+_last_snowflake = 0
+
+def next_id():
+    """Snowflake horodaté comme ceux de Discord (l'âge d'un message se lit dans son ID), croissant."""
+    global _last_snowflake
+    _last_snowflake = max(_last_snowflake + 1, discord.utils.time_snowflake(discord.utils.utcnow()))
+    return _last_snowflake
+
+class _FakeResponse:
+    """Réponse HTTP minimale pour construire les exceptions discord.py."""
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+class ApiCall:
+    __slots__ = ("route", "bucket", "started", "duration", "status")
+
+    def __init__(self, route, bucket, started, duration, status):
+        self.route = route
+        self.bucket = bucket
+        self.started = started
+        self.duration = duration
+        self.status = status
+
+class FakeGateway:
+    """Monde Discord simulé : enregistre les appels, injecte latence et 429."""
+    def __init__(self, latency=0.05, jitter=0.02, rate_limits=None, dm_closed_ratio=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limits = DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits
+        self.dm_closed_ratio = dm_closed_ratio
+        self.random = random.Random(seed)
+        self.calls = []
+        self._buckets = {} # (route, ressource) -> [horodatages des appels dans la fenêtre]
+        self._locks = {}
+        self.channels = {}
+        self.users = {}
+        self.bot_user = FakeUser(self, next_id(), "TrainingPlanner", bot=True)
+        self.http = None # HTTPClient du bot une fois installé
+
+    # --- Appels « REST » ---
+    async def api(self, route, major=None):
+        """Appel REST : passe par HTTPClient.request du bot installé (et donc par ses enveloppes)."""
+        if self.http is None:
+            return await self.simulate(route, major)
+        method, path = route.split(" ", 1)
+        http_route = discord.http.Route(method, path)
+        if "{channel_id}" in path:
+            http_route.channel_id = major # Paramètre majeur : bucket par salon, comme discord.py
+        http_route.fake_major = major
+        return await self.http.request(http_route)
+
+    async def _http_request(self, route, **kwargs):
+        """Remplace l'accès réseau de discord.py : simule l'appel décrit par la Route."""
+        await self.simulate(f"{route.method} {route.path}", getattr(route, "fake_major", None))
+
+    async def simulate(self, route, major=None):
+        """Simule un appel REST : file de limite de débit, puis latence réseau."""
+        bucket = (route, major)
+        lock = self._locks.get(bucket)
+        if lock is None:
+            lock = self._locks[bucket] = asyncio.Lock()
+        async with lock: # Comme discord.py : les appels d'un même bucket font la queue
+            while True:
+                retry_after = self._take_token(route, bucket)
+                if retry_after is None:
+                    break
+                self.calls.append(ApiCall(route, bucket, time.monotonic(), 0.0, 429))
+                await asyncio.sleep(retry_after)
+        started = time.monotonic()
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(delay)
+        self.calls.append(ApiCall(route, bucket, started, time.monotonic() - started, 200))
+
+    def _take_token(self, route, bucket):
+        limit = self.rate_limits.get(route)
+        if not limit:
+            return None
+        count, window = limit
+        now = time.monotonic()
+        history = [t for t in self._buckets.get(bucket, ()) if now - t < window]
+        if len(history) >= count:
+            self._buckets[bucket] = history
+            return window - (now - history[0])
+        history.append(now)
+        self._buckets[bucket] = history
+        return None
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def count_calls(self, status=None, route=None):
+        return sum(1 for call in self.calls
+                   if (status is None or call.status == status) and (route is None or call.route == route))
+
+    def calls_by_route(self):
+        routes = {}
+        for call in self.calls:
+            ok, limited = routes.get(call.route, (0, 0))
+            routes[call.route] = (ok + (call.status != 429), limited + (call.status == 429))
+        return routes
+
+    # --- Fabrique d'objets ---
+    def create_guild(self, name="Club"):
+        return FakeGuild(self, next_id(), name)
+
+    def create_user(self, name=None):
+        user_id = next_id()
+        user = FakeUser(self, user_id, name or f"membre{user_id % 100000}",
+                        dm_closed=self.random.random() < self.dm_closed_ratio)
+        self.users[user_id] = user
+        return user
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        await self.api("GET /channels/{channel_id}", channel_id)
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            raise discord.NotFound(_FakeResponse(404, "Not Found"), "Unknown Channel")
+        return channel
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    async def fetch_user(self, user_id):
+        await self.api("GET /users/{user_id}", user_id)
+        user = self.users.get(user_id)
+        if user is None:
+            raise discord.NotFound(_FakeResponse(404, "Not Found"), "Unknown User")
+        return user
+
+    def install(self, bot):
+        """Branche la passerelle sur une instance de bot (résolution des salons/utilisateurs)."""
+        bot.get_channel = self.get_channel
+        bot.fetch_channel = self.fetch_channel
+        bot.get_user = self.get_user
+        bot.fetch_user = self.fetch_user
+        bot._connection.user = self.bot_user
+        bot.http.request = self._http_request
+        self.http = bot.http
+
+    def interaction(self, message, user):
+        """Interaction de clic sur un bouton du message donné."""
+        return FakeInteraction(self, message, user)
+
+class FakeGuild:
+    def __init__(self, gateway, guild_id, name):
+        self.gateway = gateway
+        self.id = guild_id
+        self.name = name
+
+    def create_text_channel(self, name="entrainements"):
+        channel = FakeTextChannel(self.gateway, next_id(), name, self)
+        self.gateway.channels[channel.id] = channel
+        return channel
+
+class FakeUser:
+    def __init__(self, gateway, user_id, name, bot=False, dm_closed=False):
+        self.gateway = gateway
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.dm_closed = dm_closed
+        self.dm_channel = None
+        self.received = []
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def create_dm(self):
+        if self.dm_channel is None:
+            await self.gateway.api("POST /users/@me/channels")
+            self.dm_channel = FakeDMChannel(self.gateway, next_id(), self)
+            self.gateway.channels[self.dm_channel.id] = self.dm_channel
+        return self.dm_channel
+
+    async def send(self, content=None, embed=None, view=None):
+        channel = await self.create_dm()
+        return await channel.send(content=content, embed=embed, view=view)
+
+class FakeMessage:
+    def __init__(self, gateway, message_id, channel, author, content=None, embeds=None, view=None):
+        self.gateway = gateway
+        self.id = message_id
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.embeds = list(embeds or [])
+        self.view = view
+        self.thread = None
+        self.deleted = False
+        self.created_at = discord.utils.utcnow()
+        self.edit_count = 0
+
+    async def edit(self, content=None, embed=None, view=discord.utils.MISSING):
+        await self.gateway.api("PATCH /channels/{channel_id}/messages/{message_id}", self.channel.id)
+        if self.deleted:
+            raise discord.NotFound(_FakeResponse(404, "Not Found"), "Unknown Message")
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [embed]
+        if view is not discord.utils.MISSING:
+            self.view = view
+        self.edit_count += 1
+        return self
+
+    async def delete(self):
+        await self.gateway.api("DELETE /channels/{channel_id}/messages/{message_id}", self.channel.id)
+        self.channel.remove_message(self.id)
+
+class _Messageable:
+    def __init__(self, gateway, channel_id, name):
+        self.gateway = gateway
+        self.id = channel_id
+        self.name = name
+        self.messages = {}
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    async def send(self, content=None, embed=None, view=None, delete_after=None, embeds=None):
+        await self.gateway.api("POST /channels/{channel_id}/messages", self.id)
+        if isinstance(self, FakeDMChannel) and self.recipient.dm_closed:
+            raise discord.Forbidden(_FakeResponse(403, "Forbidden"), "Cannot send messages to this user")
+        all_embeds = ([embed] if embed is not None else []) + list(embeds or [])
+        message = FakeMessage(self.gateway, next_id(), self, self.gateway.bot_user, content, all_embeds, view)
+        self.messages[message.id] = message
+        if isinstance(self, FakeDMChannel):
+            self.recipient.received.append(message)
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.gateway.api("GET /channels/{channel_id}/messages/{message_id}", self.id)
+        message = self.messages.get(message_id)
+        if message is None:
+            raise discord.NotFound(_FakeResponse(404, "Not Found"), "Unknown Message")
+        return message
+
+    def remove_message(self, message_id):
+        message = self.messages.pop(message_id, None)
+        if message:
+            message.deleted = True
+
+class FakeTextChannel(_Messageable):
+    def __init__(self, gateway, channel_id, name, guild):
+        super().__init__(gateway, channel_id, name)
+        self.guild = guild
+
+    async def create_thread(self, name, message=None, auto_archive_duration=1440, type=None):
+        await self.gateway.api("POST /channels/{channel_id}/threads", self.id)
+        thread = FakeThread(self.gateway, next_id(), name, self)
+        self.gateway.channels[thread.id] = thread
+        if message is not None:
+            message.thread = thread
+        return thread
+
+    async def purge(self, limit=100, check=None, bulk=True):
+        await self.gateway.api("GET /channels/{channel_id}/messages", self.id)
+        deleted = []
+        for message in list(self.messages.values())[-limit:]:
+            if check is None or check(message):
+                await message.delete()
+                deleted.append(message)
+        return deleted
+
+    async def delete_messages(self, messages):
+        messages = list(messages)
+        if len(messages) == 1:
+            await self.get_partial_message(messages[0].id).delete()
+            return
+        await self.gateway.api("POST /channels/{channel_id}/messages/bulk-delete", self.id)
+        for message in messages:
+            self.remove_message(message.id)
+
+    def get_partial_message(self, message_id):
+        return self.messages.get(message_id) or FakeMessage(self.gateway, message_id, self, self.gateway.bot_user)
+
+class FakeThread(_Messageable):
+    def __init__(self, gateway, thread_id, name, parent):
+        super().__init__(gateway, thread_id, name)
+        self.parent = parent
+        self.guild = parent.guild
+        self.member_ids = set()
+        self.deleted = False
+
+    async def add_user(self, user):
+        await self.gateway.api("PUT /channels/{channel_id}/thread-members/{user_id}", self.id)
+        self.member_ids.add(user.id)
+
+    async def remove_user(self, user):
+        await self.gateway.api("DELETE /channels/{channel_id}/thread-members/{user_id}", self.id)
+        self.member_ids.discard(user.id)
+
+    async def fetch_members(self):
+        await self.gateway.api("GET /channels/{channel_id}/thread-members", self.id)
+        return [discord.Object(id=user_id) for user_id in self.member_ids]
+
+    async def delete(self):
+        await self.gateway.api("DELETE /channels/{channel_id}", self.id)
+        self.deleted = True
+        self.gateway.channels.pop(self.id, None)
+
+class FakeDMChannel(_Messageable):
+    def __init__(self, gateway, channel_id, recipient):
+        super().__init__(gateway, channel_id, f"dm-{recipient.name}")
+        self.recipient = recipient
+        self.guild = None
+
+class _FakeInteractionResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        self._done = True
+        await self._interaction.gateway.simulate("POST /interactions/{interaction_id}/{token}/callback")
+        self._interaction.responded_at = time.monotonic()
+
+    async def defer(self, ephemeral=False, thinking=False):
+        await self._respond()
+
+    async def send_message(self, content=None, ephemeral=False, embed=None, view=None):
+        await self._respond()
+        self._interaction.sent.append(content)
+
+    async def edit_message(self, content=None, view=None):
+        await self._respond()
+
+class _FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, ephemeral=False, embed=None, file=None):
+        await self._interaction.gateway.simulate("POST /webhooks/{application_id}/{token}")
+        self._interaction.sent.append(content)
+        self._interaction.followup_at = time.monotonic()
+
+class FakeInteraction:
+    def __init__(self, gateway, message, user):
+        self.gateway = gateway
+        self.id = next_id()
+        self.message = message
+        self.user = user
+        self.channel = message.channel if message is not None else None
+        self.guild = getattr(self.channel, "guild", None)
+        self.response = _FakeInteractionResponse(self)
+        self.followup = _FakeFollowup(self)
+        self.created_at = discord.utils.utcnow()
+        self.started = time.monotonic()
+        self.responded_at = None
+        self.followup_at = None
+        self.sent = []
+
+    async def edit_original_response(self, content=None):
+        await self.gateway.simulate("PATCH /webhooks/{application_id}/{token}/messages/@original")
+        self.sent.append(content)
@@ -4,4 +4,4 @@ export VENV_NAME="env"
 export PYTHON_SCRIPT="bot.py"
 cd "$PROJECT_DIR"
 source "$PROJECT_DIR/$VENV_NAME/bin/activate"
-python "$PROJECT_DIR/$PYTHON_SCRIPT"
+python "$PROJECT_DIR/$PYTHON_SCRIPT" "$@"